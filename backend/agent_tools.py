@@ -4,6 +4,7 @@ from bs4 import BeautifulSoup
 import json
 import re
 from urllib.parse import parse_qs, urlparse, unquote, urljoin
+from backend.response_cache import response_cache
 
 
 def detect_query_locale(query: str) -> str:
@@ -24,6 +25,13 @@ def detect_query_locale(query: str) -> str:
 
 
 async def translate_to_english(text: str) -> str:
+    """Translate a search query to English, reusing earlier translations"""
+    return await response_cache.cached(
+        "translate", {"text": text.strip()}, lambda: _fetch_translation(text)
+    )
+
+
+async def _fetch_translation(text: str) -> str:
     translate_url = "https://translate.googleapis.com/translate_a/single"
     params = {
         "client": "gtx",
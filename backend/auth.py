@@ -1,17 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
-from fastapi import Depends, HTTPException, status
+from typing import Optional, Tuple
+import asyncio
+from fastapi import Depends, HTTPException, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
 from backend.config import settings
-from backend.database import get_db
-from backend.models import User
+from backend.database import get_db, read_user_id
+from backend.models import User, generate_uuid
+from backend.logger import get_logger
+from backend.user_cache import user_cache
+
+logger = get_logger(__name__)
 
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.bcrypt_rounds)
+
+# bcrypt is deliberately slow; request handlers hash in this bounded pool so a
+# burst of logins queues here instead of stalling the event loop
+_password_executor = ThreadPoolExecutor(
+    max_workers=settings.password_hash_workers, thread_name_prefix="password-hash"
+)
 
 # JWT settings
 SECRET_KEY = settings.secret_key
@@ -32,6 +43,25 @@ def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
 
+async def _run_hashing(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_password_executor, func, *args)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """Hash a password off the event loop"""
+    return await _run_hashing(pwd_context.hash, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password off the event loop
+
+    Also returns a new hash when the stored one uses a different work factor
+    than BCRYPT_ROUNDS (None otherwise), so hashes migrate on login.
+    """
+    return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
@@ -45,6 +75,44 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 
+def create_user_token(user: User) -> str:
+    """Access token for a user, bound to its current token version"""
+    return create_access_token(data={"sub": user.id, "ver": user.token_version or 0})
+
+
+def revoke_tokens(user: User):
+    """Invalidate every access token issued to the user so far (takes effect on commit)"""
+    user.token_version = (user.token_version or 0) + 1
+
+
+def _is_guest_token(token: str) -> bool:
+    """Guest tokens only identify a guest session; they don't authenticate a user"""
+    try:
+        return bool(jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get("guest"))
+    except JWTError:
+        return False
+
+
+async def _user_from_token(token: str, db: AsyncSession) -> Optional[User]:
+    """Decode a JWT and return its user, from user_cache when possible (raises JWTError)"""
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    return await _user_from_payload(payload, db)
+
+
+async def _user_from_payload(payload: dict, db: AsyncSession) -> Optional[User]:
+    if payload.get("guest"):
+        return None
+    user_id: str = payload.get("sub")
+    if user_id is None:
+        return None
+    # Tokens issued before token versions existed count as version 0
+    user = await user_cache.get_user(db, user_id, payload.get("ver", 0))
+    if user is not None:
+        # Replica reads of this request see the user's own recent writes
+        read_user_id.set(user.id)
+    return user
+
+
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: AsyncSession = Depends(get_db)
@@ -58,28 +126,25 @@ async def get_current_user(
     
     try:
         token = credentials.credentials
-        print(f"Validating token: {token[:20]}...")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        print(f"Token user_id: {user_id}")
-        if user_id is None:
-            raise credentials_exception
+        logger.debug(f"Validating token: {token[:20]}...")
+        user = await _user_from_token(token, db)
     except JWTError as e:
-        print(f"JWT Error: {e}")
+        logger.debug(f"JWT Error: {e}")
         raise credentials_exception
     
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalar_one_or_none()
+    if user is None and _is_guest_token(token):
+        # Same answer as a request without credentials
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authenticated")
     
     if user is None:
-        print(f"User not found: {user_id}")
+        logger.warning("User not found or token revoked")
         raise credentials_exception
     
     if not user.is_active:
-        print(f"User inactive: {user.username}")
+        logger.warning(f"User inactive: {user.username}")
         raise HTTPException(status_code=400, detail="Inactive user")
     
-    print(f"Authenticated user: {user.username} ({user.role})")
+    logger.debug(f"Authenticated user: {user.username} ({user.role})")
     return user
 
 
@@ -126,15 +191,7 @@ async def get_current_user_optional(
         return None
     
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            return None
-        
-        result = await db.execute(select(User).where(User.id == user_id))
-        user = result.scalar_one_or_none()
-        
+        user = await _user_from_token(credentials.credentials, db)
         if user and user.is_active:
             return user
     except JWTError:
@@ -144,22 +201,23 @@ async def get_current_user_optional(
 
 
 async def get_user_or_guest(
+    response: Response,
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
     db: AsyncSession = Depends(get_db)
 ) -> User:
-    """Get current user or create/return guest user"""
+    """Get current user or the guest user of this guest session"""
     from backend.settings_manager import is_guest_enabled, get_guest_message_limit
-    from datetime import datetime, timedelta
+    from backend.guest_sessions import guest_sessions, GUEST_TOKEN_HEADER
     
-    # Try to get authenticated user
+    # Try to get authenticated user (or the guest session the token belongs to)
+    guest_id = None
     if credentials:
         try:
-            token = credentials.credentials
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_id: str = payload.get("sub")
-            if user_id:
-                result = await db.execute(select(User).where(User.id == user_id))
-                user = result.scalar_one_or_none()
+            payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+            if payload.get("guest"):
+                guest_id = payload.get("sub")
+            else:
+                user = await _user_from_payload(payload, db)
                 if user and user.is_active:
                     return user
         except JWTError:
@@ -173,25 +231,14 @@ async def get_user_or_guest(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Create or get guest user (session-based)
-    # For simplicity, create a temporary guest user per session
-    guest_limit = await get_guest_message_limit(db)
-    
-    # Check for existing guest user or create new one
-    # In a real app, you'd use session tokens or IP-based tracking
-    guest_username = f"guest_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
-    
-    guest_user = User(
-        username=guest_username,
-        role="guest",
-        is_guest=True,
-        is_active=True,
-        daily_message_limit=guest_limit,
-        daily_messages_used=0
-    )
-    
-    db.add(guest_user)
-    await db.commit()
-    await db.refresh(guest_user)
+    if guest_id:
+        cached = await user_cache.get_user(db, guest_id)
+        if cached is not None:
+            return cached
+    else:
+        # New guest session: the client keeps the token and sends it as its bearer token
+        guest_id = generate_uuid()
+        response.headers[GUEST_TOKEN_HEADER] = guest_sessions.issue_token(guest_id)
     
-    return guest_user
+    guest_limit = await get_guest_message_limit(db)
+    return await guest_sessions.get_or_create(db, guest_id, guest_limit)
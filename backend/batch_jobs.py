@@ -0,0 +1,521 @@
+"""
+Batch LLM jobs for offline workloads
+
+Back-office tasks (re-titling or re-summarising conversations, suggestions for
+many messages) submit their prompts as one job instead of going through the
+interactive path one request at a time. A job runs in one of two modes:
+- direct: our own workers send the prompts through resilient_llm, bounded by
+  a per-provider concurrency limit that only batch work counts against
+- provider: the prompts are uploaded to the provider's batch endpoint (OpenAI
+  Batch) and the job polls until the provider has finished them
+
+Results are written to batch_items as they complete, so a job can be read
+while it runs. Every worker process runs a BatchRunner; a job is claimed with
+a lease that its worker keeps renewing, so it runs in one process at a time,
+and jobs whose lease has lapsed (unfinished at shutdown or crash) are resumed
+by whichever worker claims them next.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+import asyncio
+import json
+import os
+import socket
+import uuid
+from sqlalchemy import bindparam, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.config import settings
+from backend.database import AsyncSessionLocal
+from backend.db_writer import db_writer
+from backend.llm_providers import llm_manager
+from backend.llm_resilience import resilient_llm
+from backend.logger import get_logger
+from backend.models import BatchJob, BatchItem, generate_uuid
+from backend.usage import TokenUsage, usage_recorder
+
+logger = get_logger(__name__)
+
+MODES = ("auto", "direct", "provider")
+ACTIVE_STATUSES = ("pending", "running")
+PROVIDER_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+OPENAI_BATCH_ENDPOINT = "/v1/chat/completions"
+# Rows per statement when writing provider batch results
+WRITE_CHUNK = 500
+
+
+def _error_text(error: Any) -> str:
+    return str(error)[:2000]
+
+
+class BatchRunner:
+    """Schedules batch jobs with per-provider concurrency limits"""
+
+    def __init__(
+        self,
+        concurrency: Dict[str, int],
+        default_concurrency: int = 2,
+        provider_min_items: int = 100,
+        poll_interval: float = 60.0,
+        page_size: int = 500,
+        lease_seconds: float = 120.0
+    ):
+        self.concurrency = concurrency
+        self.default_concurrency = default_concurrency
+        self.provider_min_items = provider_min_items
+        self.poll_interval = poll_interval
+        self.page_size = page_size
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._resumer: Optional[asyncio.Task] = None
+
+    def limit(self, provider: str) -> int:
+        return max(1, self.concurrency.get(provider, self.default_concurrency))
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        """Shared by every job on the provider, so concurrent jobs split the limit"""
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.limit(provider))
+            self._semaphores[provider] = semaphore
+        return semaphore
+
+    def supports_provider_batch(self, provider: str) -> bool:
+        llm = llm_manager.providers.get(provider)
+        return (
+            provider == "openai"
+            and llm is not None
+            and llm.is_available()
+            and hasattr(getattr(llm, "client", None), "batches")
+        )
+
+    def choose_mode(self, provider: str, mode: str, item_count: int) -> str:
+        """Resolve 'auto' and check that the requested mode is possible"""
+        if mode not in MODES:
+            raise ValueError(f"Unknown batch mode: {mode}")
+        if mode == "auto":
+            use_provider = self.supports_provider_batch(provider) and item_count >= self.provider_min_items
+            return "provider" if use_provider else "direct"
+        if mode == "provider" and not self.supports_provider_batch(provider):
+            raise ValueError(f"Provider batch endpoint not available for {provider}")
+        return mode
+
+    async def submit(
+        self,
+        db: AsyncSession,
+        user_id: Optional[str],
+        provider: str,
+        model: str,
+        items: List[Dict[str, Any]],
+        mode: str = "auto",
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        name: Optional[str] = None
+    ) -> BatchJob:
+        """Store a job and its prompts, then start running it in the background"""
+        llm_manager.get_provider(provider)  # ValueError for unknown providers
+        job = BatchJob(
+            id=generate_uuid(),
+            created_by=user_id,
+            name=name,
+            provider=provider,
+            model=model,
+            mode=self.choose_mode(provider, mode, len(items)),
+            params={"temperature": temperature, "max_tokens": max_tokens},
+            total_items=len(items)
+        )
+        db.add(job)
+        await db.flush()
+        await db.execute(insert(BatchItem), [
+            {"id": generate_uuid(), "job_id": job.id, "custom_id": item.get("custom_id"), "messages": item["messages"]}
+            for item in items
+        ])
+        await db.commit()
+        logger.info(f"📦 Batch job {job.id} queued: {len(items)} prompts for {provider}:{model} ({job.mode})")
+        self._launch(job.id)
+        return job
+
+    def _launch(self, job_id: str):
+        if job_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def cancel(self, job_id: str) -> bool:
+        """Stop a pending or running job; finished results are kept"""
+        async with AsyncSessionLocal() as session:
+            job = await session.get(BatchJob, job_id)
+            if job is None or job.status not in ACTIVE_STATUSES:
+                return False
+            job.status = "cancelled"
+            job.completed_at = datetime.utcnow()
+            await session.commit()
+            provider_batch_id = job.provider_batch_id
+
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        if provider_batch_id:
+            try:
+                await llm_manager.get_provider("openai").client.batches.cancel(provider_batch_id)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not cancel provider batch {provider_batch_id}: {e}")
+        logger.info(f"🛑 Batch job {job_id} cancelled")
+        return True
+
+    def _unclaimed(self, now: datetime):
+        """Condition for jobs no live worker holds (or this one already does)"""
+        return or_(
+            BatchJob.owner.is_(None),
+            BatchJob.owner == self.worker_id,
+            BatchJob.lease_expires_at < now
+        )
+
+    async def _claim(self, job_id: str) -> Optional[BatchJob]:
+        """Atomically take an active job for this worker; None if another worker holds it"""
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(
+                update(BatchJob)
+                .where(BatchJob.id == job_id, BatchJob.status.in_(ACTIVE_STATUSES), self._unclaimed(now))
+                .values(status="running", owner=self.worker_id, lease_expires_at=now + timedelta(seconds=self.lease_seconds))
+            )
+            await session.commit()
+            if result.rowcount != 1:
+                return None
+            return await session.get(BatchJob, job_id)
+
+    async def _hold_lease(self, job_id: str, runner: asyncio.Task):
+        """Renew the claim while the job runs; stop the job if it was cancelled or taken over"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    update(BatchJob)
+                    .where(BatchJob.id == job_id, BatchJob.status == "running", BatchJob.owner == self.worker_id)
+                    .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+                )
+                await session.commit()
+            if result.rowcount != 1:
+                logger.info(f"🛑 Batch job {job_id} is no longer held by this worker, stopping")
+                runner.cancel()
+                return
+
+    async def _run(self, job_id: str):
+        job = await self._claim(job_id)
+        if job is None:
+            return
+        lease = asyncio.create_task(self._hold_lease(job_id, asyncio.current_task()))
+
+        # Usage of every call in this job is accounted to the job's creator
+        usage_recorder.start_turn(job.created_by)
+        try:
+            if job.mode == "provider":
+                await self._run_provider(job)
+            else:
+                await self._run_direct(job)
+        except asyncio.CancelledError:
+            # Cancelled by cancel() or shutdown; a job still marked running resumes on startup
+            raise
+        except Exception as e:
+            logger.error(f"❌ Batch job {job_id} failed: {e}")
+            await self._finish(job_id, error=_error_text(e))
+            return
+        finally:
+            lease.cancel()
+        await self._finish(job_id)
+
+    async def _finish(self, job_id: str, error: Optional[str] = None):
+        """Recount items and close the job (unless it was cancelled meanwhile)"""
+        async with AsyncSessionLocal() as session:
+            counts = dict((await session.execute(
+                select(BatchItem.status, func.count())
+                .where(BatchItem.job_id == job_id)
+                .group_by(BatchItem.status)
+            )).all())
+            await session.execute(
+                update(BatchJob)
+                .where(BatchJob.id == job_id, BatchJob.status == "running", BatchJob.owner == self.worker_id)
+                .values(
+                    status="failed" if error else "completed",
+                    error=error,
+                    completed_items=counts.get("completed", 0),
+                    failed_items=counts.get("failed", 0),
+                    completed_at=datetime.utcnow()
+                )
+            )
+            await session.commit()
+        logger.info(
+            f"✅ Batch job {job_id} finished: {counts.get('completed', 0)} completed, "
+            f"{counts.get('failed', 0)} failed"
+        )
+
+    async def _pending_items(self, job_id: str, after_id: str = "", limit: Optional[int] = None):
+        async with AsyncSessionLocal() as session:
+            query = (
+                select(BatchItem.id, BatchItem.messages)
+                .where(BatchItem.job_id == job_id, BatchItem.status == "pending", BatchItem.id > after_id)
+                .order_by(BatchItem.id)
+            )
+            if limit:
+                query = query.limit(limit)
+            return (await session.execute(query)).all()
+
+    # Direct mode
+
+    async def _run_direct(self, job: BatchJob):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.page_size)
+        workers = [
+            asyncio.create_task(self._worker(job, queue))
+            for _ in range(min(self.limit(job.provider), job.total_items or 1))
+        ]
+        try:
+            after_id = ""
+            while True:
+                page = await self._pending_items(job.id, after_id, self.page_size)
+                if not page:
+                    break
+                for item_id, messages in page:
+                    await queue.put((item_id, messages))
+                after_id = page[-1][0]
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                if not worker.done():
+                    worker.cancel()
+
+    async def _worker(self, job: BatchJob, queue: asyncio.Queue):
+        params = job.params or {}
+        while True:
+            entry = await queue.get()
+            if entry is None:
+                return
+            item_id, messages = entry
+            async with self._semaphore(job.provider):
+                try:
+                    result = await resilient_llm.chat(
+                        job.provider, job.model, messages,
+                        temperature=params.get("temperature", 0.7),
+                        max_tokens=params.get("max_tokens")
+                    )
+                    values = {"status": "completed", "response": result.get("content"), "usage": result.get("usage")}
+                except Exception as e:
+                    values = {"status": "failed", "error": _error_text(e)}
+            await self._store_result(job.id, item_id, values)
+
+    async def _store_result(self, job_id: str, item_id: str, values: Dict[str, Any]):
+        counter = BatchJob.completed_items if values["status"] == "completed" else BatchJob.failed_items
+
+        async def write(session):
+            await session.execute(
+                update(BatchItem)
+                .where(BatchItem.id == item_id)
+                .values(completed_at=datetime.utcnow(), **values)
+            )
+            await session.execute(
+                update(BatchJob).where(BatchJob.id == job_id).values({counter: counter + 1})
+            )
+
+        # Results of concurrent workers are committed together on SQLite
+        await db_writer.run(write)
+
+    # Provider mode (OpenAI Batch)
+
+    async def _run_provider(self, job: BatchJob):
+        llm = llm_manager.get_provider(job.provider)
+        client = llm.client
+        batch_id = job.provider_batch_id or await self._find_provider_batch(job, llm)
+        if not batch_id:
+            batch_id = await self._create_provider_batch(job, llm)
+
+        while True:
+            batch = await client.batches.retrieve(batch_id)
+            if batch.status in PROVIDER_FINAL_STATUSES:
+                break
+            counts = batch.request_counts
+            if counts is not None:
+                logger.debug(f"📦 Batch job {job.id}: {batch.status}, {counts.completed}/{counts.total} done")
+            await asyncio.sleep(self.poll_interval)
+
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await client.files.content(file_id)
+                await self._import_results(job, content.text)
+
+        # Anything the provider didn't return (expired or failed batches) is failed
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(BatchItem)
+                .where(BatchItem.job_id == job.id, BatchItem.status == "pending")
+                .values(status="failed", error=f"Provider batch {batch.status}", completed_at=datetime.utcnow())
+            )
+            await session.commit()
+
+    async def _find_provider_batch(self, job: BatchJob, llm) -> Optional[str]:
+        """
+        A provider batch already created for the job
+
+        A worker that died between batches.create and saving provider_batch_id
+        left one behind; resuming the job adopts it instead of paying twice.
+        """
+        # An hour of slack for clock skew between us and the provider
+        created_after = job.created_at.replace(tzinfo=timezone.utc).timestamp() - 3600
+        async for batch in llm.client.batches.list(limit=100):
+            if batch.created_at < created_after:
+                break  # Newest first; older batches can't belong to this job
+            if (batch.metadata or {}).get("batch_job_id") == job.id:
+                await self._save_provider_batch_id(job.id, batch.id)
+                logger.info(f"📦 Batch job {job.id} resumes provider batch {batch.id}")
+                return batch.id
+        return None
+
+    async def _save_provider_batch_id(self, job_id: str, batch_id: str):
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(BatchJob).where(BatchJob.id == job_id).values(provider_batch_id=batch_id)
+            )
+            await session.commit()
+
+    async def _create_provider_batch(self, job: BatchJob, llm) -> str:
+        params = job.params or {}
+        items = await self._pending_items(job.id)
+        lines = "\n".join(
+            json.dumps({
+                "custom_id": item_id,
+                "method": "POST",
+                "url": OPENAI_BATCH_ENDPOINT,
+                "body": llm.request_params(messages, job.model, params.get("temperature", 0.7), params.get("max_tokens"))
+            })
+            for item_id, messages in items
+        )
+        upload = await llm.client.files.create(file=(f"batch-{job.id}.jsonl", lines.encode()), purpose="batch")
+        batch = await llm.client.batches.create(
+            input_file_id=upload.id,
+            endpoint=OPENAI_BATCH_ENDPOINT,
+            completion_window="24h",
+            metadata={"batch_job_id": job.id}
+        )
+        await self._save_provider_batch_id(job.id, batch.id)
+        logger.info(f"📤 Batch job {job.id} submitted as provider batch {batch.id}")
+        return batch.id
+
+    async def _import_results(self, job: BatchJob, text: str):
+        """Write the lines of a Batch API output or error file to their items"""
+        rows = await asyncio.to_thread(self._parse_results, text)
+        now = datetime.utcnow()
+        table = BatchItem.__table__
+        applied = []
+        async with AsyncSessionLocal() as session:
+            for start in range(0, len(rows), WRITE_CHUNK):
+                chunk = rows[start:start + WRITE_CHUNK]
+                # Rows already written (a re-import after a crash) are skipped, and their usage isn't counted twice
+                pending_ids = set((await session.execute(
+                    select(table.c.id)
+                    .where(table.c.id.in_([row["id"] for row in chunk]), table.c.status == "pending")
+                    .with_for_update()
+                )).scalars().all())
+                chunk = [row for row in chunk if row["id"] in pending_ids]
+                if not chunk:
+                    continue
+                applied += chunk
+                await session.execute(
+                    update(table)
+                    .where(table.c.id == bindparam("b_id"), table.c.status == "pending")
+                    .values(
+                        status=bindparam("b_status"),
+                        response=bindparam("b_response"),
+                        usage=bindparam("b_usage"),
+                        error=bindparam("b_error"),
+                        completed_at=now
+                    ),
+                    [
+                        {"b_id": row["id"], "b_status": row["status"], "b_response": row["response"],
+                         "b_usage": row["usage"], "b_error": row["error"]}
+                        for row in chunk
+                    ]
+                )
+            await session.commit()
+        for row in applied:
+            if row["usage"] is not None:
+                usage_recorder.record(job.provider, job.model, TokenUsage.from_dict(row["usage"]))
+
+    @staticmethod
+    def _parse_results(text: str) -> List[Dict[str, Any]]:
+        rows = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            body = response.get("body") or {}
+            row = {"id": record.get("custom_id"), "status": "failed", "response": None, "usage": None, "error": None}
+            if response.get("status_code") == 200 and body.get("choices"):
+                usage = TokenUsage.from_openai(body.get("usage"))
+                row.update(
+                    status="completed",
+                    response=body["choices"][0]["message"].get("content"),
+                    usage=usage.to_dict() if usage else None
+                )
+            else:
+                row["error"] = _error_text(record.get("error") or body.get("error") or response)
+            rows.append(row)
+        return rows
+
+    # Lifecycle
+
+    async def _resume(self):
+        async with AsyncSessionLocal() as session:
+            job_ids = (await session.execute(
+                select(BatchJob.id)
+                .where(BatchJob.status.in_(ACTIVE_STATUSES), self._unclaimed(datetime.utcnow()))
+                .order_by(BatchJob.created_at)
+            )).scalars().all()
+        job_ids = [job_id for job_id in job_ids if job_id not in self._tasks]
+        for job_id in job_ids:
+            self._launch(job_id)
+        if job_ids:
+            logger.info(f"📦 Resuming {len(job_ids)} batch jobs")
+
+    async def _resume_loop(self):
+        # Also picks up jobs of a worker that died without releasing them
+        while True:
+            try:
+                await self._resume()
+            except Exception as e:
+                logger.warning(f"⚠️ Batch job resume check failed: {e}")
+            await asyncio.sleep(self.lease_seconds)
+
+    def start(self):
+        """Pick up jobs left unfinished by the previous process or a dead worker"""
+        if self._resumer is None:
+            self._resumer = asyncio.create_task(self._resume_loop())
+
+    async def stop(self):
+        """Interrupt running jobs and release them so the next worker to start resumes them"""
+        tasks = [task for task in (self._resumer, *self._tasks.values()) if task and not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        self._resumer = None
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(BatchJob)
+                .where(BatchJob.owner == self.worker_id, BatchJob.status.in_(ACTIVE_STATUSES))
+                .values(owner=None, lease_expires_at=None)
+            )
+            await session.commit()
+
+
+# Global batch runner instance
+batch_runner = BatchRunner(
+    settings.batch_concurrency,
+    default_concurrency=settings.batch_default_concurrency,
+    provider_min_items=settings.batch_provider_min_items,
+    poll_interval=settings.batch_poll_interval_seconds,
+    lease_seconds=settings.batch_lease_seconds
+)
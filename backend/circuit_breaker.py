@@ -0,0 +1,94 @@
+"""
+Circuit breakers for upstream providers
+
+A breaker opens after a run of consecutive failures so callers stop paying the
+full timeout of an endpoint that is down. After a cooldown one trial call is
+let through (half-open); its outcome closes the breaker or re-opens it.
+"""
+from typing import Dict
+import time
+from backend.config import settings
+from backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open trial"""
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.failure_threshold:
+            return "closed"
+        if self._trial_in_progress:
+            return "half_open"
+        return "open"
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != "closed"
+
+    def try_acquire_trial(self) -> bool:
+        """Claim the single trial call once the cooldown has elapsed"""
+        if self.state != "open" or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self._trial_in_progress = True
+        return True
+
+    def allow_request(self) -> bool:
+        """True when a call may go through (closed, or this caller holds the trial)"""
+        return not self.is_open or self.try_acquire_trial()
+
+    def record_success(self):
+        if self.failures >= self.failure_threshold:
+            logger.info(f"✅ Circuit closed for {self.name}")
+        self.failures = 0
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial_in_progress or self.failures == self.failure_threshold:
+            logger.warning(f"⚠️ Circuit open for {self.name} after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self._trial_in_progress = False
+
+    def release_trial(self):
+        """Give up a claimed trial without an outcome (e.g. the call was cancelled)"""
+        self._trial_in_progress = False
+
+    def snapshot(self) -> Dict[str, object]:
+        return {"state": self.state, "failures": self.failures}
+
+
+class CircuitBreakerRegistry:
+    """Named breakers created on first use"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+            self._breakers[name] = breaker
+        return breaker
+
+    def snapshot(self) -> Dict[str, Dict[str, object]]:
+        return {name: breaker.snapshot() for name, breaker in self._breakers.items()}
+
+
+# Global circuit breaker registry
+circuit_breakers = CircuitBreakerRegistry(
+    failure_threshold=settings.circuit_breaker_failure_threshold,
+    reset_timeout=settings.circuit_breaker_reset_seconds
+)
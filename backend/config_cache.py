@@ -0,0 +1,136 @@
+"""
+Read-through cache of system settings and model permissions
+
+Gating a chat request reads several settings and the same model permission
+more than once. Both tables are small and change only through the admin
+endpoints, so each worker keeps a snapshot of them in memory.
+
+Changes bump the "config" row of cache_versions in the same transaction. A
+worker re-reads that one row at most every CONFIG_CACHE_CHECK_SECONDS and
+reloads its snapshot when the version moved, so other workers see admin
+changes within that interval; the worker that made the change invalidates
+its own snapshot immediately.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Optional
+import asyncio
+import time
+from sqlalchemy import inspect, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.config import settings
+from backend.database import IS_POSTGRES
+from backend.logger import get_logger
+from backend.metrics import CACHE_REQUESTS_TOTAL
+from backend.models import CacheVersion, SystemSettings
+from backend.model_permissions import ModelPermission
+
+logger = get_logger(__name__)
+
+VERSION_NAME = "config"
+
+
+@dataclass
+class ConfigSnapshot:
+    version: int
+    settings: Dict[str, str] = field(default_factory=dict)
+    # Detached copies, read-only: admin routes that edit permissions query their own
+    permissions: Dict[str, ModelPermission] = field(default_factory=dict)
+
+
+class ConfigCache:
+    """Settings and model permissions snapshot guarded by a shared version counter"""
+
+    def __init__(self, check_interval: float = 2.0, enabled: bool = True):
+        self.check_interval = check_interval
+        self.enabled = enabled
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
+        self._permission_columns = [attr.key for attr in inspect(ModelPermission).column_attrs]
+
+    async def _read_version(self, db: AsyncSession) -> int:
+        result = await db.execute(select(CacheVersion.version).where(CacheVersion.name == VERSION_NAME))
+        return result.scalar_one_or_none() or 0
+
+    async def _load(self, db: AsyncSession, version: int) -> ConfigSnapshot:
+        snapshot = ConfigSnapshot(version=version)
+        for setting in (await db.execute(select(SystemSettings))).scalars():
+            snapshot.settings[setting.key] = setting.value
+        for permission in (await db.execute(select(ModelPermission))).scalars():
+            values = {name: getattr(permission, name) for name in self._permission_columns}
+            snapshot.permissions[permission.model_id] = ModelPermission(**values)
+        logger.debug(
+            f"⚙️ Config cache loaded (version {version}): "
+            f"{len(snapshot.settings)} settings, {len(snapshot.permissions)} model permissions"
+        )
+        return snapshot
+
+    async def _current(self, db: AsyncSession) -> ConfigSnapshot:
+        """The snapshot, revalidated against the version counter when due"""
+        if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+            CACHE_REQUESTS_TOTAL.inc(cache="config", result="hit")
+            return self._snapshot
+
+        async with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._checked_at < self.check_interval:
+                CACHE_REQUESTS_TOTAL.inc(cache="config", result="hit")
+                return self._snapshot
+            version = await self._read_version(db)
+            if self._snapshot is not None and self._snapshot.version == version:
+                CACHE_REQUESTS_TOTAL.inc(cache="config", result="revalidated")
+            else:
+                CACHE_REQUESTS_TOTAL.inc(cache="config", result="miss")
+                self._snapshot = await self._load(db, version)
+            self._checked_at = time.monotonic()
+            return self._snapshot
+
+    async def get_setting(self, db: AsyncSession, key: str) -> Optional[str]:
+        """Stored value of a setting, or None when it has never been set"""
+        if not self.enabled:
+            result = await db.execute(select(SystemSettings.value).where(SystemSettings.key == key))
+            return result.scalar_one_or_none()
+        return (await self._current(db)).settings.get(key)
+
+    async def get_permission(self, db: AsyncSession, model_id: str) -> Optional[ModelPermission]:
+        """Read-only permission row for a model"""
+        if not self.enabled:
+            result = await db.execute(select(ModelPermission).where(ModelPermission.model_id == model_id))
+            return result.scalar_one_or_none()
+        return (await self._current(db)).permissions.get(model_id)
+
+    async def bump(self, db: AsyncSession):
+        """
+        Record a change to settings or permissions
+
+        Commits with the caller's transaction; call invalidate() once it has
+        committed. An upsert, so concurrent first changes can't both insert
+        the row.
+        """
+        insert = postgresql.insert if IS_POSTGRES else sqlite.insert
+        statement = insert(CacheVersion).values(name=VERSION_NAME, version=1, updated_at=datetime.utcnow())
+        await db.execute(statement.on_conflict_do_update(
+            index_elements=[CacheVersion.name],
+            set_={"version": CacheVersion.version + 1, "updated_at": statement.excluded.updated_at}
+        ))
+
+    def invalidate(self):
+        """Reload this worker's snapshot on the next read"""
+        self._snapshot = None
+        self._checked_at = 0.0
+
+    async def load(self):
+        """Warm the cache at startup"""
+        if not self.enabled:
+            return
+        from backend.database import AsyncSessionLocal
+        async with AsyncSessionLocal() as session:
+            await self._current(session)
+
+
+# Global config cache instance
+config_cache = ConfigCache(
+    check_interval=settings.config_cache_check_seconds,
+    enabled=settings.config_cache_enabled
+)
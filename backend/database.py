@@ -1,16 +1,202 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional
+from fastapi import Request
+from sqlalchemy import event, make_url, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import Session, declarative_base
 from backend.config import settings
+from backend.logger import get_logger
+from backend.metrics import DB_QUERY_SECONDS
+import importlib.util
+import itertools
+import time
+
+logger = get_logger(__name__)
+
+IS_POSTGRES = make_url(settings.database_url).get_backend_name() == "postgresql"
+IS_SQLITE = make_url(settings.database_url).get_backend_name() == "sqlite"
+# Embeddings become a pgvector column (searched in SQL) when both are available
+USE_PGVECTOR = IS_POSTGRES and importlib.util.find_spec("pgvector") is not None
+
+if IS_POSTGRES and not USE_PGVECTOR:
+    logger.warning("⚠️ pgvector package not installed: embeddings are stored as JSON and ranked in Python")
+
+
+def _engine_options() -> dict:
+    if not IS_POSTGRES:
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+        "pool_pre_ping": True,
+        "connect_args": {
+            # SQLAlchemy's asyncpg adapter keeps this many prepared statements per connection
+            "prepared_statement_cache_size": settings.db_statement_cache_size,
+            "server_settings": {"application_name": "midas"}
+        }
+    }
+
 
 engine = create_async_engine(
     settings.database_url,
     echo=False,
-    future=True
+    future=True,
+    **_engine_options()
 )
 
+# Read replica for read-only routes and retrieval (same kind of database as the primary)
+replica_engine = create_async_engine(
+    settings.database_replica_url,
+    echo=False,
+    future=True,
+    **_engine_options()
+) if settings.database_replica_url else None
+
+
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_connection, connection_record):
+        """Per-connection SQLite tuning"""
+        cursor = dbapi_connection.cursor()
+        # WAL lets readers run while a write transaction is open
+        cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        # Negative cache_size is in KiB
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kb)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_mb) * 1024 * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_start = time.perf_counter()
+
+
+@event.listens_for(engine.sync_engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_query_start", None)
+    if start is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "unknown"
+    DB_QUERY_SECONDS.observe(time.perf_counter() - start, operation=operation)
+
+
+if replica_engine is not None:
+    event.listen(replica_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(replica_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# Read-your-writes: what a write touches, by the written row's table and its foreign keys
+_SCOPE_TABLES = {"conversations": "conversation", "users": "user", "bots": "bot"}
+_SCOPE_COLUMNS = {"conversation_id": "conversation", "user_id": "user", "creator_id": "user", "bot_id": "bot"}
+
+# User the current request is authenticated as (set by backend.auth)
+read_user_id: ContextVar[Optional[str]] = ContextVar("read_user_id", default=None)
+
+
+def scope_keys(conversation_id: str = None, user_id: str = None, bot_id: str = None) -> List[str]:
+    keys = []
+    if conversation_id:
+        keys.append(f"conversation:{conversation_id}")
+    if user_id:
+        keys.append(f"user:{user_id}")
+    if bot_id:
+        keys.append(f"bot:{bot_id}")
+    return keys
+
+
+class RecentWrites:
+    """
+    When this worker last committed a write to a conversation, user or bot
+
+    Reads of something written within the window go to the primary, so a
+    client sees its own writes despite replica lag. Writes made by other
+    workers are not known here; the window only needs to cover this worker's
+    requests following its own commits.
+    """
+
+    def __init__(self, window_seconds: float = 5.0, max_entries: int = 100000):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self._written: Dict[str, float] = {}
+
+    def mark(self, keys: Iterable[str]):
+        now = time.monotonic()
+        for key in keys:
+            self._written[key] = now
+        if len(self._written) > self.max_entries:
+            horizon = now - self.window_seconds
+            self._written = {key: at for key, at in self._written.items() if at > horizon}
+
+    def recent(self, keys: Iterable[str]) -> bool:
+        horizon = time.monotonic() - self.window_seconds
+        return any(self._written.get(key, 0.0) > horizon for key in keys)
+
+
+# Global recent writes instance
+recent_writes = RecentWrites(window_seconds=settings.replica_read_your_writes_seconds)
+
+
+class PrimarySession(Session):
+    """Read-write session; records what it commits for read-your-writes"""
+
+
+class ReadSession(Session):
+    """
+    Read-only session: queries go to the replica unless this worker recently
+    wrote the request's conversation, bot or user (then to the primary)
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if replica_engine is None:
+            return engine.sync_engine
+        keys = list(self.info.get("scope", ()))
+        keys += scope_keys(user_id=read_user_id.get())
+        if recent_writes.recent(keys):
+            return engine.sync_engine
+        return replica_engine.sync_engine
+
+
+if replica_engine is not None:
+    @event.listens_for(PrimarySession, "after_flush")
+    def _collect_written(session, flush_context):
+        written = session.info.setdefault("written", set())
+        for obj in itertools.chain(session.new, session.dirty, session.deleted):
+            # Loaded state only: no lazy loads inside a flush
+            state = obj.__dict__
+            kind = _SCOPE_TABLES.get(getattr(obj, "__tablename__", None))
+            if kind and state.get("id"):
+                written.add(f"{kind}:{state['id']}")
+            for column, kind in _SCOPE_COLUMNS.items():
+                if state.get(column):
+                    written.add(f"{kind}:{state[column]}")
+
+    @event.listens_for(PrimarySession, "after_commit")
+    def _mark_written(session):
+        recent_writes.mark(session.info.pop("written", ()))
+
+    @event.listens_for(PrimarySession, "after_rollback")
+    def _discard_written(session):
+        session.info.pop("written", None)
+
+
 AsyncSessionLocal = async_sessionmaker(
     engine,
     class_=AsyncSession,
+    sync_session_class=PrimarySession,
+    expire_on_commit=False
+)
+
+ReadSessionLocal = async_sessionmaker(
+    engine,
+    class_=AsyncSession,
+    sync_session_class=ReadSession,
     expire_on_commit=False
 )
 
@@ -25,6 +211,42 @@ async def get_db():
             await session.close()
 
 
+async def get_read_db(request: Request):
+    """Session for read-only routes, on the replica when one is configured (see ReadSession)"""
+    async with ReadSessionLocal() as session:
+        session.info["scope"] = scope_keys(
+            conversation_id=request.path_params.get("conversation_id") or request.query_params.get("conversation_id"),
+            bot_id=request.path_params.get("bot_id") or request.query_params.get("bot_id")
+        )
+        try:
+            yield session
+        finally:
+            await session.close()
+
+
+@asynccontextmanager
+async def read_session(db: AsyncSession, **scope):
+    """
+    Session for reads inside a request that otherwise writes through db:
+    a replica session, or db itself without a replica or when the scope
+    (conversation_id, user_id, bot_id) was just written
+    """
+    keys = scope_keys(**scope)
+    if replica_engine is None or recent_writes.recent(keys):
+        yield db
+        return
+    async with ReadSessionLocal() as session:
+        session.info["scope"] = keys
+        yield session
+
+
+async def create_extensions(conn):
+    """Database extensions the schema needs (pgvector on PostgreSQL)"""
+    if USE_PGVECTOR:
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+
+
 async def init_db():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """Create the schema, or check and upgrade it (see backend.migrations)"""
+    from backend.migrations import migrator
+    await migrator.ensure_schema(auto_migrate=settings.db_auto_migrate)
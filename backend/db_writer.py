@@ -0,0 +1,111 @@
+"""
+Single-writer queue for SQLite
+
+SQLite lets one connection write at a time; every other writer waits on the
+busy timeout and eventually fails with "database is locked". Background
+writes (document ingestion batches, usage and rate limit flushes, batch job
+results) are therefore handed to one task that runs them back to back,
+committing whatever is queued together in a single transaction. With WAL
+enabled readers never wait for it.
+
+On other databases, or before the writer has started, run() executes the job
+in its own session straight away.
+"""
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.config import settings
+from backend.database import AsyncSessionLocal, IS_SQLITE
+from backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+# A write job receives the shared session and must not commit it
+WriteJob = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class DatabaseWriter:
+    """Serializes and batches background write transactions"""
+
+    def __init__(self, enabled: bool = True, max_batch: int = 64):
+        self.enabled = enabled
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def run(self, job: WriteJob) -> Any:
+        """Run job(session) in a write transaction and return its result once committed"""
+        if self._task is None:
+            return (await self._commit([job]))[0]
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, future))
+        return await future
+
+    async def _commit(self, jobs: List[WriteJob]) -> List[Any]:
+        async with AsyncSessionLocal() as session:
+            results = [await job(session) for job in jobs]
+            await session.commit()
+        return results
+
+    async def _process(self, batch: List[Tuple[WriteJob, asyncio.Future]]):
+        batch = [(job, future) for job, future in batch if not future.done()]
+        if not batch:
+            return
+        try:
+            results = await self._commit([job for job, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # One job failed the shared transaction; retry each on its own
+            logger.warning(f"⚠️ Batched write of {len(batch)} jobs failed, retrying individually: {e}")
+            for item in batch:
+                await self._process([item])
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+        if len(batch) > 1:
+            logger.debug(f"✍️ Committed {len(batch)} queued writes in one transaction")
+
+    async def _loop(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stopping = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                await self._process(batch)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            if stopping:
+                return
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Finish the queued writes, then write directly"""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        await self._queue.put(None)
+        await task
+
+
+# Global database writer instance
+db_writer = DatabaseWriter(
+    enabled=IS_SQLITE and settings.sqlite_single_writer,
+    max_batch=settings.sqlite_writer_max_batch
+)
@@ -4,13 +4,19 @@ Provides comprehensive, well-reasoned answers from documents
 """
 from typing import List, Dict, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from backend.llm_providers import llm_manager
+from backend.llm_resilience import resilient_llm, LLMTarget
+from backend.response_cache import response_cache, normalize_messages
+from backend.logger import get_logger
+from backend.tracing import traced
+
+logger = get_logger(__name__)
 
 
 class DeepResearchRAG:
     """Enhanced RAG using OpenAI's reasoning capabilities for deep analysis"""
     
     @staticmethod
+    @traced("deep_research.query")
     async def deep_research_query(
         query: str,
         retrieved_chunks: List[Dict],
@@ -70,9 +76,6 @@ IMPORTANT INSTRUCTIONS:
 Please provide a thorough, research-quality answer based on the comprehensive document context provided."""
 
         try:
-            # Use OpenAI reasoning model for deep analysis
-            provider = llm_manager.get_provider("openai")
-            
             messages = [
                 {
                     "role": "user",
@@ -80,90 +83,70 @@ Please provide a thorough, research-quality answer based on the comprehensive do
                 }
             ]
             
-            # Try models in order of preference with automatic fallback
+            # Try models in order of preference; the resilient layer retries transient
+            # errors and moves down the chain when a model is unavailable
             models_to_try = DeepResearchRAG._get_model_fallback_chain(reasoning_model)
+            targets = resilient_llm.targets_for(
+                "openai", models_to_try[0], [LLMTarget("openai", name) for name in models_to_try[1:]]
+            )
+            logger.info(f"📊 Analyzing {len(retrieved_chunks)} document sections")
+            
+            async def run_research(provider, model_name: str) -> Dict:
+                logger.info(f"🔬 Attempting deep research with {model_name}...")
+                
+                # For reasoning models, use reasoning_effort parameter for deep research
+                # For GPT-4 models, use lower temperature for focused analysis
+                if model_name.startswith(('o1', 'o3')) and hasattr(provider, "chat_with_reasoning"):
+                    # O1/O3 models - minimal parameters only
+                    # These models inherently do deep reasoning with fixed settings
+                    logger.debug(f"   → Using O1/O3 reasoning model (fixed settings)")
+                    return await provider.chat_with_reasoning(
+                        messages=messages,
+                        model=model_name
+                    )
+                
+                # GPT-4 models accept temperature
+                logger.debug(f"   → Using GPT-4 parameters (temperature: 0.3, max_tokens: {max_reasoning_tokens})")
+                return await provider.chat(
+                    messages=messages,
+                    model=model_name,
+                    temperature=0.3,
+                    max_tokens=max_reasoning_tokens
+                )
+            
+            async def research() -> Dict:
+                response, target = await resilient_llm.call(targets, run_research)
+                return {"response": response, "model": target.model}
             
-            last_error = None
-            for model_name in models_to_try:
-                try:
-                    print(f"🔬 Attempting deep research with {model_name}...")
-                    print(f"📊 Analyzing {len(retrieved_chunks)} document sections")
-                    
-                    # Adjust parameters based on model type
-                    is_reasoning_model = model_name.startswith(('o1', 'o3'))
-                    
-                    # For reasoning models, use reasoning_effort parameter for deep research
-                    # For GPT-4 models, use lower temperature for focused analysis
-                    if is_reasoning_model:
-                        # O1/O3 models - minimal parameters only
-                        # These models inherently do deep reasoning with fixed settings
-                        print(f"   → Using O1/O3 reasoning model (fixed settings)")
-                        print(f"   → O1 models control their own token usage")
-                        
-                        # Call O1/O3 model with minimal parameters
-                        response = await provider.chat_with_reasoning(
-                            messages=messages,
-                            model=model_name
-                        )
-                    else:
-                        # GPT-4 models accept temperature
-                        print(f"   → Using GPT-4 parameters (temperature: 0.3)")
-                        print(f"   → max_tokens: {max_reasoning_tokens}")
-                        response = await provider.chat(
-                            messages=messages,
-                            model=model_name,
-                            temperature=0.3,
-                            max_tokens=max_reasoning_tokens
-                        )
-                    
-                    answer = response.get("content", "")
-                    reasoning_tokens = response.get("usage", {}).get("completion_tokens", 0)
-                    
-                    print(f"✅ Deep research complete with {model_name} ({reasoning_tokens} tokens)")
-                    
-                    # Extract sources
-                    sources = DeepResearchRAG._extract_sources(retrieved_chunks)
-                    
-                    return {
-                        "answer": answer,
-                        "reasoning_tokens": reasoning_tokens,
-                        "sources": sources,
-                        "model": model_name
-                    }
-                    
-                except Exception as e:
-                    error_msg = str(e)
-                    last_error = error_msg
-                    
-                    print(f"⚠️  Error with {model_name}: {error_msg}")
-                    
-                    # Check if it's a model availability error (try next model)
-                    if any(phrase in error_msg.lower() for phrase in [
-                        "does not exist",
-                        "model_not_found", 
-                        "not found",
-                        "invalid model",
-                        "not supported",
-                        "not available"
-                    ]):
-                        print(f"   → Model not available, trying next model...")
-                        continue
-                    else:
-                        # Other error (API error, rate limit, etc.) - don't try more models
-                        print(f"   → Non-availability error, stopping fallback chain")
-                        print(f"   → Full error: {e}")
-                        raise
+            # Identical questions over the same chunk set get the same answer
+            result = await response_cache.cached(
+                "deep_research",
+                {
+                    "targets": [str(target) for target in targets],
+                    "messages": normalize_messages(messages),
+                    "max_tokens": max_reasoning_tokens
+                },
+                research
+            )
+            response = result["response"]
+            
+            answer = response.get("content", "")
+            reasoning_tokens = (response.get("usage") or {}).get("completion_tokens", 0)
+            
+            logger.info(f"✅ Deep research complete with {result['model']} ({reasoning_tokens} tokens)")
+            
+            # Extract sources
+            sources = DeepResearchRAG._extract_sources(retrieved_chunks)
             
-            # All models failed
-            print(f"❌ All models failed. Last error: {last_error}")
             return {
-                "answer": f"Deep research unavailable. All models failed. Last error: {last_error}",
-                "reasoning": None,
-                "sources": []
+                "answer": answer,
+                "reasoning_tokens": reasoning_tokens,
+                "sources": sources,
+                "model": result["model"]
             }
             
         except Exception as e:
-            print(f"❌ Deep research error: {e}")
+            logger.error(f"❌ Deep research error: {e}")
             return {
                 "answer": f"Error during deep research: {str(e)}",
                 "reasoning": None,
@@ -198,7 +181,7 @@ Please provide a thorough, research-quality answer based on the comprehensive do
         # Get the fallback chain for the preferred model
         chain = fallback_chains.get(preferred_model, ["gpt-4o"])
         
-        print(f"🔄 Model fallback chain: {' → '.join(chain)}")
+        logger.info(f"🔄 Model fallback chain: {' → '.join(chain)}")
         return chain
     
     @staticmethod
@@ -323,20 +306,18 @@ class HybridRAG:
         should_use_deep = use_deep_research or is_complex
         
         # Detailed logging
-        print(f"\n{'='*60}")
-        print(f"🔍 RAG Query Analysis:")
-        print(f"  Query: {query[:100]}...")
-        print(f"  Query length: {query_length} words")
-        print(f"  Complexity threshold: {complexity_threshold} words")
-        print(f"  Keywords found: {found_keywords if found_keywords else 'None'}")
-        print(f"  Is complex: {is_complex}")
-        print(f"  Force deep research: {use_deep_research}")
-        print(f"  Should use deep: {should_use_deep}")
-        print(f"  Retrieved chunks: {len(retrieved_chunks)}")
-        print(f"{'='*60}\n")
+        logger.debug(f"🔍 RAG Query Analysis:")
+        logger.debug(f"  Query: {query[:100]}...")
+        logger.debug(f"  Query length: {query_length} words")
+        logger.debug(f"  Complexity threshold: {complexity_threshold} words")
+        logger.debug(f"  Keywords found: {found_keywords if found_keywords else 'None'}")
+        logger.debug(f"  Is complex: {is_complex}")
+        logger.debug(f"  Force deep research: {use_deep_research}")
+        logger.debug(f"  Should use deep: {should_use_deep}")
+        logger.debug(f"  Retrieved chunks: {len(retrieved_chunks)}")
         
         if should_use_deep and len(retrieved_chunks) > 0:
-            print(f"🔬 USING DEEP RESEARCH")
+            logger.info(f"🔬 USING DEEP RESEARCH")
             research_result = await DeepResearchRAG.deep_research_query(
                 query=query,
                 retrieved_chunks=retrieved_chunks,
@@ -344,7 +325,7 @@ class HybridRAG:
             )
             return DeepResearchRAG.format_research_response(research_result)
         else:
-            print(f"⚡ USING FAST RETRIEVAL (reading flow)")
+            logger.info(f"⚡ USING FAST RETRIEVAL (reading flow)")
             # Use reading flow for simple queries
             from backend.reading_flow_rag import reading_flow_rag
             return reading_flow_rag.format_reading_context(retrieved_chunks)
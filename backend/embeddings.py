@@ -6,6 +6,8 @@ from typing import List, Optional
 import httpx
 import os
 from dotenv import load_dotenv
+from backend.metrics import EMBEDDING_SECONDS
+from backend.tracing import tracer
 
 load_dotenv()
 
@@ -47,7 +49,8 @@ class EmbeddingProvider:
         }
         
         async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(url, json=payload, headers=headers)
+            with EMBEDDING_SECONDS.time(model=self.model), tracer.span("embedding.create", model=self.model, inputs=len(texts)):
+                response = await client.post(url, json=payload, headers=headers)
             response.raise_for_status()
             data = response.json()
             
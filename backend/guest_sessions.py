@@ -0,0 +1,118 @@
+"""
+Guest sessions
+
+An anonymous request gets a signed guest token (a JWT with a "guest" claim)
+in the X-Guest-Token response header and sends it back as its bearer token.
+The guest's users row is created the first time it is needed and found
+through the user cache afterwards, so guest traffic doesn't write a row per
+request. Guest tokens expire after GUEST_TOKEN_TTL_SECONDS; a background job
+deletes guest rows (and their conversations) older than that.
+"""
+from datetime import datetime, timedelta
+from typing import List, Optional
+import asyncio
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from backend.config import settings
+from backend.logger import get_logger
+from backend.models import AgentExecution, Conversation, Message, User
+
+logger = get_logger(__name__)
+
+GUEST_TOKEN_HEADER = "X-Guest-Token"
+# Guest ids deleted per statement by the reaper
+REAP_CHUNK = 500
+
+
+class GuestSessions:
+    """Lazily created guest users and their TTL cleanup"""
+
+    def __init__(self, token_ttl_seconds: int = 7 * 86400, reap_interval: float = 3600.0):
+        self.token_ttl_seconds = token_ttl_seconds
+        self.reap_interval = reap_interval
+        self._reaper: Optional[asyncio.Task] = None
+
+    def issue_token(self, guest_id: str) -> str:
+        from backend.auth import create_access_token
+        return create_access_token(
+            {"sub": guest_id, "guest": True},
+            expires_delta=timedelta(seconds=self.token_ttl_seconds)
+        )
+
+    async def get_or_create(self, db: AsyncSession, guest_id: str, message_limit: int) -> User:
+        """The guest's row, inserted on first use"""
+        user = await db.get(User, guest_id)
+        if user is not None:
+            return user
+        user = User(
+            id=guest_id,
+            username=f"guest_{guest_id.replace('-', '')[:16]}",
+            role="guest",
+            is_guest=True,
+            is_active=True,
+            daily_message_limit=message_limit,
+            daily_messages_used=0
+        )
+        db.add(user)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # A concurrent first request of the same guest created it
+            await db.rollback()
+            user = await db.get(User, guest_id)
+        return user
+
+    async def reap(self) -> int:
+        """Delete guests whose tokens have expired, with their conversations"""
+        from backend.database import AsyncSessionLocal
+        from backend.model_permissions import UserModelUsage
+
+        cutoff = datetime.utcnow() - timedelta(seconds=self.token_ttl_seconds)
+        reaped = 0
+        async with AsyncSessionLocal() as session:
+            while True:
+                guest_ids: List[str] = (await session.execute(
+                    select(User.id).where(User.is_guest == True, User.created_at < cutoff).limit(REAP_CHUNK)
+                )).scalars().all()
+                if not guest_ids:
+                    break
+                conversation_ids = select(Conversation.id).where(Conversation.user_id.in_(guest_ids))
+                await session.execute(delete(Message).where(Message.conversation_id.in_(conversation_ids)))
+                await session.execute(delete(AgentExecution).where(AgentExecution.conversation_id.in_(conversation_ids)))
+                await session.execute(delete(Conversation).where(Conversation.user_id.in_(guest_ids)))
+                await session.execute(delete(UserModelUsage).where(UserModelUsage.user_id.in_(guest_ids)))
+                await session.execute(delete(User).where(User.id.in_(guest_ids)))
+                await session.commit()
+                reaped += len(guest_ids)
+        if reaped:
+            logger.info(f"🧹 Reaped {reaped} expired guest users")
+        return reaped
+
+    async def _reap_loop(self):
+        while True:
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.warning(f"⚠️ Guest cleanup failed: {e}")
+            await asyncio.sleep(self.reap_interval)
+
+    def start(self):
+        if self._reaper is None and self.reap_interval > 0:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    async def stop(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+
+
+# Global guest sessions instance
+guest_sessions = GuestSessions(
+    token_ttl_seconds=settings.guest_token_ttl_seconds,
+    reap_interval=settings.guest_reap_interval_seconds
+)
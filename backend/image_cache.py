@@ -0,0 +1,230 @@
+"""
+Image cache for multimodal history replay
+
+Historical images are stored under backend/static/uploads and re-sent to
+vision providers on every turn. This module keeps a bounded LRU of encoded
+payloads (keyed by path + mtime so edited files are picked up) and a small
+registry of provider file handles so an image can be uploaded once and then
+referenced by handle on later turns.
+"""
+from typing import Dict, List, Optional, Tuple, Callable, Awaitable, Any
+from collections import OrderedDict
+from pathlib import Path
+import asyncio
+import base64
+import time
+from backend.config import settings
+from backend.metrics import CACHE_REQUESTS_TOTAL
+
+
+STATIC_ROOT = Path("backend/static")
+
+MIME_MAP = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp"
+}
+
+
+def resolve_static_path(static_url: str) -> Path:
+    """Map a '/static/uploads/x.jpg' URL to its file on disk"""
+    clean_path = static_url.replace("/static/", "")
+    return STATIC_ROOT / clean_path
+
+
+def guess_mime_type(file_path: Path) -> str:
+    """Determine image mime type from file extension"""
+    return MIME_MAP.get(file_path.suffix.lower(), "image/jpeg")
+
+
+class ImageCache:
+    """Bounded LRU cache of base64-encoded images and provider file handles"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 128 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, int], str]" = OrderedDict()
+        self._total_bytes = 0
+        self._file_handles: "OrderedDict[Tuple[str, str, int], Tuple[Any, float]]" = OrderedDict()
+        # Uploads in flight, so concurrent turns upload a file once
+        self._uploads: Dict[Tuple[str, str, int], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, file_path: Path) -> Optional[Tuple[str, int]]:
+        try:
+            return (str(file_path), file_path.stat().st_mtime_ns)
+        except OSError:
+            return None
+
+    def get_base64(self, static_url: str) -> Optional[str]:
+        """Get base64 payload for a stored image, encoding it only on cache miss"""
+        return self._encode(resolve_static_path(static_url))
+
+    def _encode(self, file_path: Path) -> Optional[str]:
+        key = self._key(file_path)
+        if key is None:
+            return None
+
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_REQUESTS_TOTAL.inc(cache="image", result="hit")
+            return cached
+
+        self.misses += 1
+        CACHE_REQUESTS_TOTAL.inc(cache="image", result="miss")
+        with open(file_path, "rb") as f:
+            encoded = base64.b64encode(f.read()).decode()
+
+        # Don't let one oversized file flush the whole cache
+        if len(encoded) <= self.max_bytes:
+            self._entries[key] = encoded
+            self._total_bytes += len(encoded)
+            self._evict()
+        return encoded
+
+    def get_data_url(self, static_url: str) -> Optional[str]:
+        """Get a data: URL for a stored image"""
+        return self._data_url(resolve_static_path(static_url))
+
+    def _data_url(self, file_path: Path) -> Optional[str]:
+        encoded = self._encode(file_path)
+        if encoded is None:
+            return None
+        return f"data:{guess_mime_type(file_path)};base64,{encoded}"
+
+    def _evict(self):
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+        ):
+            _, evicted = self._entries.popitem(last=False)
+            self._total_bytes -= len(evicted)
+
+    async def get_file_handle(
+        self,
+        provider: str,
+        file_path: str,
+        uploader: Callable[[], Awaitable[Any]],
+        ttl_seconds: float
+    ) -> Any:
+        """
+        Return a cached provider file handle, uploading the file on first use
+
+        Concurrent callers for the same file share one upload.
+
+        Args:
+            provider: Provider name the handle belongs to
+            file_path: Local path of the uploaded file
+            uploader: Coroutine factory that uploads the file and returns the handle
+            ttl_seconds: How long the provider keeps the uploaded file
+        """
+        path = Path(file_path)
+        key = self._key(path)
+        if key is None:
+            raise FileNotFoundError(file_path)
+        handle_key = (provider, key[0], key[1])
+
+        now = time.monotonic()
+        cached = self._file_handles.get(handle_key)
+        if cached and cached[1] > now:
+            self._file_handles.move_to_end(handle_key)
+            self.hits += 1
+            CACHE_REQUESTS_TOTAL.inc(cache=f"{provider}_file", result="hit")
+            return cached[0]
+
+        pending = self._uploads.get(handle_key)
+        if pending is not None:
+            self.hits += 1
+            CACHE_REQUESTS_TOTAL.inc(cache=f"{provider}_file", result="hit")
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        CACHE_REQUESTS_TOTAL.inc(cache=f"{provider}_file", result="miss")
+        pending = self._uploads[handle_key] = asyncio.get_running_loop().create_future()
+        try:
+            handle = await uploader()
+        except BaseException as e:
+            pending.set_exception(e if isinstance(e, Exception) else RuntimeError("Upload cancelled"))
+            pending.exception()  # Waiters re-raise it; don't log it as never retrieved
+            raise
+        finally:
+            del self._uploads[handle_key]
+        pending.set_result(handle)
+
+        self._file_handles[handle_key] = (handle, now + ttl_seconds)
+        self._file_handles.move_to_end(handle_key)
+        # LRU bound: expired handles go first, then the least recently used
+        if len(self._file_handles) > self.max_entries:
+            for expired in [k for k, v in self._file_handles.items() if v[1] <= now]:
+                del self._file_handles[expired]
+        while len(self._file_handles) > self.max_entries:
+            self._file_handles.popitem(last=False)
+        return handle
+
+    def build_image_part(self, static_url: str, provider: str) -> Optional[Dict[str, Any]]:
+        """
+        Build a multimodal content item for a stored image
+
+        Providers that support file references get a lightweight 'image_file'
+        item (uploaded once by the provider); everyone else gets an inline
+        data URL served from the cache.
+        """
+        file_path = resolve_static_path(static_url)
+        if not file_path.exists():
+            return None
+
+        if provider == "google" and settings.google_image_file_refs:
+            return {
+                "type": "image_file",
+                "image_file": {"path": str(file_path), "mime_type": guess_mime_type(file_path)}
+            }
+
+        data_url = self.get_data_url(static_url)
+        if data_url is None:
+            return None
+        return {"type": "image_url", "image_url": {"url": data_url}}
+
+    def inline_image_files(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Replace 'image_file' items with inline image_url items
+
+        For messages built for Google that are sent to another provider
+        (failover, batch jobs); messages without such items are returned as-is.
+        """
+        converted = []
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, list) and any(
+                isinstance(item, dict) and item.get("type") == "image_file" for item in content
+            ):
+                items = []
+                for item in content:
+                    if isinstance(item, dict) and item.get("type") == "image_file":
+                        data_url = self._data_url(Path(item["image_file"]["path"]))
+                        if data_url is None:
+                            continue
+                        item = {"type": "image_url", "image_url": {"url": data_url}}
+                    items.append(item)
+                message = {**message, "content": items}
+            converted.append(message)
+        return converted
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "file_handles": len(self._file_handles),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Global image cache instance
+image_cache = ImageCache(
+    max_entries=settings.image_cache_max_entries,
+    max_bytes=settings.image_cache_max_mb * 1024 * 1024
+)
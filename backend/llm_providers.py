@@ -1,16 +1,144 @@
-from typing import List, Dict, Any, Optional, AsyncGenerator
+from typing import List, Dict, Any, Optional, AsyncGenerator, Tuple
+from collections import OrderedDict
+from pathlib import Path
 import httpx
 from openai import AsyncOpenAI
 from anthropic import AsyncAnthropic
 from google import genai
 from google.genai import types
 from backend.config import settings
+from backend.metrics import LLM_REQUEST_SECONDS, model_labels
+from backend.logger import get_logger
+from backend.tracing import tracer
+from backend.circuit_breaker import circuit_breakers
+from backend.usage import TokenUsage, estimate_usage, usage_recorder
+from backend.image_cache import image_cache
+import asyncio
+import base64
+import functools
+import hashlib
 import json
+import threading
+import time
+
+logger = get_logger(__name__)
+
+# llm_resilience owns retries; the SDKs' own (2 by default) would multiply its attempts
+SDK_CLIENT_OPTIONS = {"max_retries": 0, "timeout": settings.llm_request_timeout}
+
+
+def _model_arg(args: tuple, kwargs: dict) -> str:
+    """Pull the model name out of a chat(messages, model, ...) call"""
+    if "model" in kwargs:
+        return kwargs["model"]
+    return args[1] if len(args) > 1 else ""
+
+
+def _messages_arg(args: tuple, kwargs: dict) -> List[Dict[str, Any]]:
+    if "messages" in kwargs:
+        return kwargs["messages"]
+    return args[0] if args else []
+
+
+def _instrument_chat(func):
+    """Record latency and token usage for a provider's chat()"""
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        model = _model_arg(args, kwargs)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            with tracer.span("llm.chat", provider=self.name, model=model) as span:
+                result = await func(self, *args, **kwargs)
+                status = "ok"
+                usage = result.get("usage")
+                if not isinstance(usage, TokenUsage):
+                    usage = TokenUsage.from_dict(usage)
+                if usage is None:
+                    usage = await asyncio.to_thread(
+                        estimate_usage, _messages_arg(args, kwargs), result.get("content") or ""
+                    )
+                result["usage"] = usage.to_dict()
+                result["tokens"] = usage.total_tokens
+                model_labels.label(self.name, model, accepted=True)  # Before the token counters use it
+                usage_recorder.record(self.name, model, usage)
+                span.set(tokens=usage.total_tokens, usage_estimated=usage.estimated)
+            return result
+        finally:
+            LLM_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                provider=self.name, model=model_labels.label(self.name, model, accepted=status == "ok"),
+                method="chat", status=status
+            )
+    return wrapper
+
+
+def _instrument_stream(func):
+    """
+    Record latency and token usage for a provider's chat_stream()
+
+    Providers yield a TokenUsage item for the stream-final usage report; it is
+    consumed here and never reaches the caller.
+    """
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        model = _model_arg(args, kwargs)
+        start = time.perf_counter()
+        status = "error"
+        # Not made current: the span must not leak into the consumer between yields
+        span = tracer.start_span("llm.chat_stream", provider=self.name, model=model)
+        chunks = []
+        usage = None
+        try:
+            async for chunk in func(self, *args, **kwargs):
+                if isinstance(chunk, TokenUsage):
+                    usage = chunk
+                    continue
+                if not chunks and span:
+                    span.set(first_chunk_ms=round((time.perf_counter() - start) * 1000, 2))
+                chunks.append(chunk)
+                yield chunk
+            status = "ok"
+            if usage is None and chunks:
+                usage = await asyncio.to_thread(estimate_usage, _messages_arg(args, kwargs), "".join(chunks))
+        except (GeneratorExit, asyncio.CancelledError):
+            status = "cancelled"
+            raise
+        finally:
+            # A model that produced output exists for this provider
+            label = model_labels.label(self.name, model, accepted=bool(chunks))
+            if usage is None and chunks and status == "cancelled":
+                # Abandoned streams are still billed for what was generated
+                usage = estimate_usage(_messages_arg(args, kwargs), "".join(chunks))
+            if usage is not None:
+                usage_recorder.record(self.name, model, usage)
+            if span:
+                span.set(chunks=len(chunks))
+                if usage is not None:
+                    span.set(tokens=usage.total_tokens, usage_estimated=usage.estimated)
+                span.end(status=status)
+            LLM_REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                provider=self.name, model=label, method="stream", status=status
+            )
+    return wrapper
 
 
 class LLMProvider:
     """Base class for LLM providers"""
     
+    name = "base"
+    
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Instrument every provider's entry points in one place
+        if "chat" in cls.__dict__:
+            cls.chat = _instrument_chat(cls.__dict__["chat"])
+        if "chat_with_reasoning" in cls.__dict__:
+            cls.chat_with_reasoning = _instrument_chat(cls.__dict__["chat_with_reasoning"])
+        if "chat_stream" in cls.__dict__:
+            cls.chat_stream = _instrument_stream(cls.__dict__["chat_stream"])
+    
     async def chat(
         self,
         messages: List[Dict[str, Any]],
@@ -32,10 +160,15 @@ class LLMProvider:
 
 
 class OpenAIProvider(LLMProvider):
+    name = "openai"
+    
     NO_TEMP_KEYWORDS = ['chatgpt-4o-latest', 'gpt-5', 'o1', 'o3', 'realtime']
 
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key) if settings.openai_api_key else None
+        self.client = AsyncOpenAI(
+            api_key=settings.openai_api_key,
+            **SDK_CLIENT_OPTIONS
+        ) if settings.openai_api_key else None
     
     def is_available(self) -> bool:
         return self.client is not None
@@ -44,22 +177,17 @@ class OpenAIProvider(LLMProvider):
         lower_id = model_id.lower()
         return not any(keyword in lower_id for keyword in self.NO_TEMP_KEYWORDS)
     
-    async def chat(
+    def request_params(
         self,
-        messages: List[Dict[str, str]],
+        messages: List[Dict[str, Any]],
         model: str,
         temperature: float = 0.7,
-        max_tokens: Optional[int] = None,
-        stream: bool = False,
-        tools: Optional[List[Dict[str, Any]]] = None
+        max_tokens: Optional[int] = None
     ) -> Dict[str, Any]:
-        if not self.is_available():
-            raise ValueError("OpenAI API key not configured")
-        
+        """Chat completion parameters for a model (also the body of Batch API requests)"""
         params = {
             "model": model,
-            "messages": messages,
-            "stream": stream
+            "messages": messages
         }
         
         # Only add temperature if model supports it
@@ -76,6 +204,22 @@ class OpenAIProvider(LLMProvider):
                 pass  # GPT-5 models might not support this yet
             else:
                 params["max_tokens"] = max_tokens
+        return params
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, str]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        tools: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        if not self.is_available():
+            raise ValueError("OpenAI API key not configured")
+        
+        params = self.request_params(messages, model, temperature, max_tokens)
+        params["stream"] = stream
         
         # Add tools if provided
         if tools:
@@ -86,7 +230,7 @@ class OpenAIProvider(LLMProvider):
         result = {
             "content": response.choices[0].message.content,
             "model": response.model,
-            "tokens": response.usage.total_tokens if response.usage else None
+            "usage": TokenUsage.from_openai(response.usage)
         }
         
         # Include tool calls if present
@@ -144,8 +288,8 @@ class OpenAIProvider(LLMProvider):
             "messages": messages,
         }
         
-        print(f"🔬 Calling O1/O3 model: {model}")
-        print(f"   → Using minimal parameters (O1 models have fixed settings)")
+        logger.debug(f"🔬 Calling O1/O3 model: {model}")
+        logger.debug(f"   → Using minimal parameters (O1 models have fixed settings)")
         
         try:
             response = await self.client.chat.completions.create(**params)
@@ -153,16 +297,12 @@ class OpenAIProvider(LLMProvider):
             result = {
                 "content": response.choices[0].message.content,
                 "model": response.model,
-                "usage": {
-                    "completion_tokens": response.usage.completion_tokens if response.usage else 0,
-                    "prompt_tokens": response.usage.prompt_tokens if response.usage else 0,
-                    "total_tokens": response.usage.total_tokens if response.usage else 0
-                }
+                "usage": TokenUsage.from_openai(response.usage)
             }
             
             return result
         except Exception as e:
-            print(f"❌ Error calling O1/O3: {e}")
+            logger.error(f"❌ Error calling O1/O3: {e}")
             raise
     
     async def chat_stream(
@@ -175,54 +315,119 @@ class OpenAIProvider(LLMProvider):
         if not self.is_available():
             raise ValueError("OpenAI API key not configured")
         
-        print(f"🔍 OpenAI chat_stream - Model: {model}")
-        print(f"Temperature requested: {temperature}")
-        print(f"Messages received: {len(messages)} messages")
+        logger.debug(f"🔍 OpenAI chat_stream - Model: {model}")
+        logger.debug(f"Temperature requested: {temperature}")
+        logger.debug(f"Messages received: {len(messages)} messages")
         for i, msg in enumerate(messages):
             content = msg.get('content', '')
             if isinstance(content, list):
-                print(f"  Message {i}: role={msg.get('role')}, content=<multimodal list with {len(content)} items>")
+                logger.debug(f"  Message {i}: role={msg.get('role')}, content=<multimodal list with {len(content)} items>")
             else:
                 preview = content[:100] if len(content) <= 100000 else f"<large content {len(content)} chars>"
-                print(f"  Message {i}: role={msg.get('role')}, content={preview}...")
+                logger.debug(f"  Message {i}: role={msg.get('role')}, content={preview}...")
         
         params = {
             "model": model,
             "messages": messages,
-            "stream": True
+            "stream": True,
+            # Ask for the stream-final usage chunk
+            "extra_body": {"stream_options": {"include_usage": True}}
         }
         
         # Only add temperature if model supports it
         if self._supports_temperature(model):
             params["temperature"] = temperature
-            print(f"✅ Temperature added: {temperature}")
+            logger.debug(f"✅ Temperature added: {temperature}")
         else:
-            print(f"⚠️ Temperature skipped for {model}")
+            logger.debug(f"⚠️ Temperature skipped for {model}")
         
         # Handle max_tokens (skip for models that don't support the parameter)
         if max_tokens:
             lower_model = model.lower()
             if any(lower_model.startswith(prefix) for prefix in ['gpt-5', 'o1', 'o3']):
-                print(f"⚠️ Max tokens skipped for {model}")
+                logger.debug(f"⚠️ Max tokens skipped for {model}")
             else:
                 params["max_tokens"] = max_tokens
-                print(f"✅ Max tokens added: {max_tokens}")
+                logger.debug(f"✅ Max tokens added: {max_tokens}")
         
-        print(f"Final params: {params}")
+        logger.debug(f"Final params: {params}")
         stream = await self.client.chat.completions.create(**params)
         
         async for chunk in stream:
-            if chunk.choices[0].delta.content:
+            # The usage chunk comes last and has no choices
+            if chunk.choices and chunk.choices[0].delta.content:
                 yield chunk.choices[0].delta.content
+            usage = TokenUsage.from_openai(getattr(chunk, "usage", None))
+            if usage:
+                yield usage
+
+
+def _with_cache_breakpoint(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of an Anthropic message whose last content block ends a cached prefix"""
+    content = message.get("content")
+    if not content:
+        return message
+    blocks = [{"type": "text", "text": content}] if isinstance(content, str) else [dict(block) for block in content]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return {**message, "content": blocks}
 
 
 class AnthropicProvider(LLMProvider):
+    name = "anthropic"
+    
     def __init__(self):
-        self.client = AsyncAnthropic(api_key=settings.anthropic_api_key) if settings.anthropic_api_key else None
+        self.client = AsyncAnthropic(
+            api_key=settings.anthropic_api_key,
+            **SDK_CLIENT_OPTIONS
+        ) if settings.anthropic_api_key else None
     
     def is_available(self) -> bool:
         return self.client is not None
     
+    def _request_kwargs(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Build system/messages, marking the stable prefix for prompt caching
+        
+        Leading system messages form the system prompt. System messages further
+        down (per-turn RAG or web context) are sent as user text so they no
+        longer replace it. Cache breakpoints go on the system prompt and on the
+        last assistant reply, i.e. everything before the current turn.
+        
+        With prompt caching off, the last system message is the system prompt
+        and messages are otherwise passed through, as before caching existed.
+        """
+        if not settings.prompt_cache_enabled:
+            system_message = None
+            converted_messages = []
+            for msg in messages:
+                if msg["role"] == "system":
+                    system_message = msg["content"]
+                else:
+                    converted_messages.append(msg)
+            kwargs = {"messages": converted_messages}
+            if system_message:
+                kwargs["system"] = system_message
+            return kwargs
+        
+        system_parts = []
+        converted_messages = []
+        for msg in messages:
+            if msg["role"] != "system":
+                converted_messages.append(msg)
+            elif converted_messages:
+                converted_messages.append({"role": "user", "content": msg["content"]})
+            else:
+                system_parts.append(msg["content"])
+        
+        kwargs: Dict[str, Any] = {"messages": converted_messages}
+        system_message = "\n\n".join(system_parts)
+        if system_message:
+            kwargs["system"] = [{"type": "text", "text": system_message, "cache_control": {"type": "ephemeral"}}]
+        last_reply = max((i for i, m in enumerate(converted_messages) if m["role"] == "assistant"), default=None)
+        if last_reply is not None:
+            converted_messages[last_reply] = _with_cache_breakpoint(converted_messages[last_reply])
+        return kwargs
+    
     async def chat(
         self,
         messages: List[Dict[str, str]],
@@ -234,27 +439,17 @@ class AnthropicProvider(LLMProvider):
         if not self.is_available():
             raise ValueError("Anthropic API key not configured")
         
-        # Convert messages format
-        system_message = None
-        converted_messages = []
-        for msg in messages:
-            if msg["role"] == "system":
-                system_message = msg["content"]
-            else:
-                converted_messages.append(msg)
-        
         response = await self.client.messages.create(
             model=model,
-            messages=converted_messages,
-            system=system_message,
             temperature=temperature,
-            max_tokens=max_tokens or 4096
+            max_tokens=max_tokens or 4096,
+            **self._request_kwargs(messages)
         )
         
         return {
             "content": response.content[0].text,
             "model": response.model,
-            "tokens": response.usage.input_tokens + response.usage.output_tokens
+            "usage": TokenUsage.from_anthropic(response.usage)
         }
     
     async def chat_stream(
@@ -267,26 +462,23 @@ class AnthropicProvider(LLMProvider):
         if not self.is_available():
             raise ValueError("Anthropic API key not configured")
         
-        system_message = None
-        converted_messages = []
-        for msg in messages:
-            if msg["role"] == "system":
-                system_message = msg["content"]
-            else:
-                converted_messages.append(msg)
-        
         async with self.client.messages.stream(
             model=model,
-            messages=converted_messages,
-            system=system_message,
             temperature=temperature,
-            max_tokens=max_tokens or 4096
+            max_tokens=max_tokens or 4096,
+            **self._request_kwargs(messages)
         ) as stream:
             async for text in stream.text_stream:
                 yield text
+            final_message = await stream.get_final_message()
+            usage = TokenUsage.from_anthropic(final_message.usage)
+            if usage:
+                yield usage
 
 
 class OllamaProvider(LLMProvider):
+    name = "ollama"
+    
     def __init__(self):
         self.base_url = settings.ollama_base_url
     
@@ -325,7 +517,10 @@ class OllamaProvider(LLMProvider):
             return {
                 "content": data["message"]["content"],
                 "model": model,
-                "tokens": data.get("eval_count", 0) + data.get("prompt_eval_count", 0)
+                "usage": TokenUsage(
+                    prompt_tokens=data.get("prompt_eval_count", 0),
+                    completion_tokens=data.get("eval_count", 0)
+                )
             }
     
     async def chat_stream(
@@ -354,13 +549,21 @@ class OllamaProvider(LLMProvider):
                         data = json.loads(line)
                         if "message" in data and "content" in data["message"]:
                             yield data["message"]["content"]
+                        if data.get("done"):
+                            yield TokenUsage(
+                                prompt_tokens=data.get("prompt_eval_count", 0),
+                                completion_tokens=data.get("eval_count", 0)
+                            )
 
 
 class OpenRouterProvider(LLMProvider):
+    name = "openrouter"
+    
     def __init__(self):
         self.client = AsyncOpenAI(
             api_key=settings.openrouter_api_key,
-            base_url="https://openrouter.ai/api/v1"
+            base_url="https://openrouter.ai/api/v1",
+            **SDK_CLIENT_OPTIONS
         ) if settings.openrouter_api_key else None
     
     def is_available(self) -> bool:
@@ -388,7 +591,7 @@ class OpenRouterProvider(LLMProvider):
         return {
             "content": response.choices[0].message.content,
             "model": response.model,
-            "tokens": response.usage.total_tokens if response.usage else None
+            "usage": TokenUsage.from_openai(response.usage)
         }
     
     async def chat_stream(
@@ -406,16 +609,22 @@ class OpenRouterProvider(LLMProvider):
             messages=messages,
             temperature=temperature,
             max_tokens=max_tokens,
-            stream=True
+            stream=True,
+            extra_body={"stream_options": {"include_usage": True}}
         )
         
         async for chunk in stream:
-            if chunk.choices[0].delta.content:
+            if chunk.choices and chunk.choices[0].delta.content:
                 yield chunk.choices[0].delta.content
+            usage = TokenUsage.from_openai(getattr(chunk, "usage", None))
+            if usage:
+                yield usage
 
 
 class VolcanoProvider(LLMProvider):
     """火山引擎 (Volcano Engine) Provider"""
+    
+    name = "volcano"
     def __init__(self):
         self.api_key = settings.volcano_api_key
         self.endpoint_id = settings.volcano_endpoint_id
@@ -508,13 +717,13 @@ class VolcanoProvider(LLMProvider):
                                 "supports_image_generation": is_media
                             })
             except Exception as e:
-                print(f"⚠️ Error parsing VOLCANO_MODEL_MAP: {e}")
+                logger.warning(f"⚠️ Error parsing VOLCANO_MODEL_MAP: {e}")
 
         try:
             async with httpx.AsyncClient(timeout=10.0) as client:
                 # 4. Try OpenAI-compatible /models
                 url_models = f"{self.base_url}/models"
-                print(f"🔍 Fetching Volcano models from: {url_models}")
+                logger.debug(f"🔍 Fetching Volcano models from: {url_models}")
                 try:
                     resp_models = await client.get(
                         url_models,
@@ -552,11 +761,11 @@ class VolcanoProvider(LLMProvider):
                                 "supports_image_generation": is_media
                             })
                 except Exception as e:
-                    print(f"⚠️ /models discovery failed: {e}")
+                    logger.warning(f"⚠️ /models discovery failed: {e}")
 
                 # 5. Try /endpoints as supplement
                 url_endpoints = f"{self.base_url}/endpoints"
-                print(f"🔍 Fetching Volcano endpoints from: {url_endpoints}")
+                logger.debug(f"🔍 Fetching Volcano endpoints from: {url_endpoints}")
                 try:
                     resp_endpoints = await client.get(
                         url_endpoints,
@@ -594,12 +803,12 @@ class VolcanoProvider(LLMProvider):
                                 "supports_image_generation": is_media
                             })
                 except Exception as e:
-                    print(f"⚠️ /endpoints discovery failed: {e}")
+                    logger.warning(f"⚠️ /endpoints discovery failed: {e}")
                     
-            print(f"✅ Total Volcano models found: {len(models)}")
+            logger.debug(f"✅ Total Volcano models found: {len(models)}")
             return models
         except Exception as e:
-            print(f"⚠️ Error in Volcano discovery: {e}")
+            logger.warning(f"⚠️ Error in Volcano discovery: {e}")
             return models if models else []
 
     def _get_endpoint_id(self, model: str) -> str:
@@ -617,14 +826,14 @@ class VolcanoProvider(LLMProvider):
                 if model in model_map:
                     return model_map[model]
             except Exception as e:
-                print(f"⚠️ Error parsing VOLCANO_MODEL_MAP: {e}")
+                logger.warning(f"⚠️ Error parsing VOLCANO_MODEL_MAP: {e}")
         
         # Fallback to default endpoint ID from settings
         # Validate that the endpoint_id looks like a real endpoint ID (ep-...)
         if self.endpoint_id and self.endpoint_id.startswith("ep-"):
             return self.endpoint_id
             
-        print(f"⚠️ No valid mapping found for Volcano model '{model}' and default endpoint_id is invalid: '{self.endpoint_id}'")
+        logger.warning(f"⚠️ No valid mapping found for Volcano model '{model}' and default endpoint_id is invalid: '{self.endpoint_id}'")
         return model # Fallback to model name itself, which will likely fail but at least it's clear
 
     async def chat(
@@ -644,7 +853,7 @@ class VolcanoProvider(LLMProvider):
             raise ValueError(f"Model '{model}' is a non-chat model and cannot be used with the chat completion endpoint. Please use a Doubao chat model.")
 
         endpoint_id = self._get_endpoint_id(model)
-        print(f"🌋 Volcano Chat: model={model}, endpoint={endpoint_id}")
+        logger.debug(f"🌋 Volcano Chat: model={model}, endpoint={endpoint_id}")
         
         async with httpx.AsyncClient(timeout=120.0) as client:
             response = await client.post(
@@ -663,7 +872,7 @@ class VolcanoProvider(LLMProvider):
             
             if response.status_code != 200:
                 error_text = response.text
-                print(f"❌ Volcano API Error ({response.status_code}): {error_text}")
+                logger.error(f"❌ Volcano API Error ({response.status_code}): {error_text}")
                 raise ValueError(f"Volcano API Error: {error_text}")
                 
             data = response.json()
@@ -677,7 +886,7 @@ class VolcanoProvider(LLMProvider):
             result = {
                 "content": content,
                 "model": model,
-                "tokens": data.get("usage", {}).get("total_tokens", 0)
+                "usage": TokenUsage.from_openai(data.get("usage"))
             }
             
             if reasoning_content:
@@ -701,65 +910,66 @@ class VolcanoProvider(LLMProvider):
         non_chat_keywords = ["seedance", "seedream", "video-generation", "t2v", "i2v", "speech", "voice", "audio"]
         
         if model in all_image_models or any(kw in model.lower() for kw in non_chat_keywords):
-            yield f"Error: Model '{model}' is a non-chat model (video/audio/image) and is not supported for chat completions. Please use the image generation interface."
-            return
+            raise ValueError(f"Model '{model}' is a non-chat model (video/audio/image) and is not supported for chat completions. Please use the image generation interface.")
 
         endpoint_id = self._get_endpoint_id(model)
-        print(f"🌋 Volcano Stream: model={model}, endpoint={endpoint_id}")
+        logger.debug(f"🌋 Volcano Stream: model={model}, endpoint={endpoint_id}")
         
         async with httpx.AsyncClient(timeout=120.0) as client:
-            try:
-                async with client.stream(
-                    "POST",
-                    f"{self.base_url}/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": endpoint_id,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": max_tokens or 4096,
-                        "stream": True
-                    }
-                ) as response:
-                    if response.status_code != 200:
-                        error_text = await response.aread()
-                        print(f"❌ Volcano Stream Error ({response.status_code}): {error_text.decode()}")
-                        yield f"Error from Volcano Engine ({response.status_code}): {error_text.decode()}"
-                        return
+            async with client.stream(
+                "POST",
+                f"{self.base_url}/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                },
+                json={
+                    "model": endpoint_id,
+                    "messages": messages,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens or 4096,
+                    "stream": True,
+                    "stream_options": {"include_usage": True}
+                }
+            ) as response:
+                if response.status_code != 200:
+                    error_text = await response.aread()
+                    logger.error(f"❌ Volcano Stream Error ({response.status_code}): {error_text.decode()}")
+                    # Raise with the response attached so llm_resilience can read the status
+                    response.raise_for_status()
 
-                    async for line in response.aiter_lines():
-                        if not line.strip():
-                            continue
+                async for line in response.aiter_lines():
+                    if not line.strip():
+                        continue
                             
-                        if line.startswith("data: "):
-                            content = line[6:].strip()
-                            if content == "[DONE]":
-                                break
-                            try:
-                                data = json.loads(content)
-                                if "choices" in data and len(data["choices"]) > 0:
-                                    delta = data["choices"][0].get("delta", {})
+                    if line.startswith("data: "):
+                        content = line[6:].strip()
+                        if content == "[DONE]":
+                            break
+                        try:
+                            data = json.loads(content)
+                            usage = TokenUsage.from_openai(data.get("usage"))
+                            if usage:
+                                yield usage
+                            if "choices" in data and len(data["choices"]) > 0:
+                                delta = data["choices"][0].get("delta", {})
                                     
-                                    # Support for reasoning_content (DeepSeek R1 on Ark)
-                                    if "reasoning_content" in delta:
-                                        yield f"<think>\n{delta['reasoning_content']}\n</think>"
+                                # Support for reasoning_content (DeepSeek R1 on Ark)
+                                if "reasoning_content" in delta:
+                                    yield f"<think>\n{delta['reasoning_content']}\n</think>"
                                         
-                                    if "content" in delta:
-                                        yield delta["content"]
-                            except json.JSONDecodeError as e:
-                                print(f"⚠️ Volcano JSON parse error: {e}, line: {line}")
-                                continue
-            except Exception as e:
-                print(f"💥 Volcano stream exception: {e}")
-                yield f"Stream connection error: {str(e)}"
+                                if "content" in delta:
+                                    yield delta["content"]
+                        except json.JSONDecodeError as e:
+                            logger.warning(f"⚠️ Volcano JSON parse error: {e}, line: {line}")
+                            continue
 
 
 class GoogleProvider(LLMProvider):
     """Google AI (Gemini) Provider - using google-genai SDK for full Gemini 3 support"""
     
+    name = "google"
+    
     # Gemini 3 models that need special handling
     GEMINI_3_MODELS = ['gemini-3-pro-preview', 'gemini-3-pro-image-preview']
     
@@ -767,7 +977,18 @@ class GoogleProvider(LLMProvider):
         self.api_key = settings.google_api_key
         self.client = None
         if self.api_key:
-            self.client = genai.Client(api_key=self.api_key)
+            self.client = genai.Client(
+                api_key=self.api_key,
+                http_options=types.HttpOptions(timeout=int(settings.llm_request_timeout * 1000))  # milliseconds
+            )
+        # sha256(model, system prompt) -> (cache name or None if caching failed, expiry)
+        self._context_caches: Dict[str, tuple] = {}
+        # Cache creations in flight by key, so concurrent turns create each cache once
+        self._context_cache_pending: Dict[str, asyncio.Future] = {}
+        # Converted multimodal messages by message id, so history isn't re-decoded on every turn
+        self._converted: "OrderedDict[str, Tuple[List[Any], int]]" = OrderedDict()
+        self._converted_bytes = 0
+        self._converted_lock = threading.Lock()
     
     def is_available(self) -> bool:
         return self.client is not None
@@ -775,25 +996,143 @@ class GoogleProvider(LLMProvider):
     def _is_gemini_3(self, model: str) -> bool:
         """Check if model is Gemini 3 series"""
         return any(g3 in model for g3 in self.GEMINI_3_MODELS) or model.startswith('gemini-3')
-    
-    async def chat(
-        self,
-        messages: List[Dict[str, Any]],
-        model: str,
-        temperature: float = 0.7,
-        max_tokens: Optional[int] = None,
-        stream: bool = False,
-        thinking_level: Optional[str] = None  # Gemini 3: 'low', 'high'
-    ) -> Dict[str, Any]:
-        if not self.is_available():
-            raise ValueError("Google API key not configured")
+
+    async def _context_cache(self, model: str, system_instruction: Optional[str]) -> Optional[str]:
+        """
+        Name of an explicit context cache holding a long system prompt
         
-        import base64
-        import asyncio
+        Bot system prompts repeat verbatim on every turn; caching them
+        server-side bills them at the cached rate. Failures (prompt below the
+        model's minimum, unsupported model) are remembered for one TTL.
+        """
+        if not settings.prompt_cache_enabled or not isinstance(system_instruction, str):
+            return None
+        if len(system_instruction) < settings.google_context_cache_min_chars:
+            return None
+        
+        key = hashlib.sha256(f"{model}\0{system_instruction}".encode()).hexdigest()
+        now = time.monotonic()
+        entry = self._context_caches.get(key)
+        if entry and entry[1] > now:
+            return entry[0]
+        
+        pending = self._context_cache_pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = self._context_cache_pending[key] = asyncio.get_running_loop().create_future()
+        
+        ttl = settings.google_context_cache_ttl_seconds
+        try:
+            try:
+                cache = await self.client.aio.caches.create(
+                    model=model,
+                    config=types.CreateCachedContentConfig(system_instruction=system_instruction, ttl=f"{ttl}s")
+                )
+                # Stop using it a little before the server drops it
+                entry = (cache.name, now + ttl * 0.9)
+                logger.info(f"🗄️ Gemini context cache created for {model}: {cache.name}")
+            except Exception as e:
+                entry = (None, now + ttl)
+                logger.info(f"ℹ️ Gemini context caching unavailable for {model}: {e}")
+            
+            self._context_caches = {k: v for k, v in self._context_caches.items() if v[1] > now}
+            self._context_caches[key] = entry
+            pending.set_result(entry[0])
+            return entry[0]
+        finally:
+            del self._context_cache_pending[key]
+            if not pending.done():
+                pending.set_result(None)  # Creator was cancelled; waiters go without the cache
+    
+    async def _image_file_part(self, image_file: Dict[str, str]) -> "types.Part":
+        """Reference a local image by Files API handle, uploading it only once"""
+        path = image_file["path"]
+        mime_type = image_file.get("mime_type", "image/jpeg")
+        
+        async def upload():
+            return await self.client.aio.files.upload(
+                file=path,
+                config=types.UploadFileConfig(mime_type=mime_type)
+            )
         
-        is_gemini_3 = self._is_gemini_3(model)
+        try:
+            uploaded = await image_cache.get_file_handle(
+                "google", path, upload, settings.google_file_ref_ttl_seconds
+            )
+            return types.Part.from_uri(file_uri=uploaded.uri, mime_type=uploaded.mime_type or mime_type)
+        except Exception as e:
+            # Fall back to inline bytes if the Files API is unavailable
+            logger.warning(f"⚠️ Gemini file upload failed, sending inline: {e}")
+            data = await asyncio.to_thread(Path(path).read_bytes)
+            return types.Part.from_bytes(data=data, mime_type=mime_type)
+    
+    def _remember(self, key: str, parts: List[Any], size: int) -> List[Any]:
+        max_bytes = settings.google_message_cache_max_mb * 1024 * 1024
+        with self._converted_lock:
+            previous = self._converted.pop(key, None)
+            if previous is not None:
+                self._converted_bytes -= previous[1]
+            if size > max_bytes:
+                return parts  # Too large to keep
+            self._converted[key] = (parts, size)
+            self._converted_bytes += size
+            while (
+                len(self._converted) > settings.google_message_cache_size
+                or self._converted_bytes > max_bytes
+            ):
+                _, (_, evicted_size) = self._converted.popitem(last=False)
+                self._converted_bytes -= evicted_size
+        return parts
+    
+    def _recall(self, key: str) -> Optional[List[Any]]:
+        with self._converted_lock:
+            entry = self._converted.get(key)
+            if entry is None:
+                return None
+            self._converted.move_to_end(key)
+            return entry[0]
+    
+    def _multimodal_parts(self, content: List[Dict[str, Any]], message_id: Optional[str] = None) -> List[Any]:
+        """
+        Convert a multimodal message, decoding inline images and documents
         
-        # Convert messages to Gemini format using types
+        Runs in a worker thread. image_file items are returned as-is and
+        resolved on the event loop, since uploads are async. Stored messages
+        (those with an id) don't change, so they are cached by id.
+        """
+        if message_id is not None:
+            parts = self._recall(message_id)
+            if parts is not None:
+                return parts
+        
+        parts = []
+        size = 0
+        for item in content:
+            if item.get("type") == "text":
+                parts.append(types.Part.from_text(text=item["text"]))
+                size += len(item["text"])
+            elif item.get("type") == "image_url":
+                image_url = item["image_url"]["url"]
+                if image_url.startswith("data:"):
+                    header, b64_data = image_url.split(",", 1)
+                    mime_type = header.split(":")[1].split(";")[0]
+                    data = base64.b64decode(b64_data)
+                    parts.append(types.Part.from_bytes(data=data, mime_type=mime_type))
+                    size += len(data)
+            elif item.get("type") == "image_file":
+                parts.append(item)
+            elif item.get("type") == "document":
+                doc_data = item.get("document", {})
+                mime_type = doc_data.get("mime_type", "application/pdf")
+                doc_bytes = base64.b64decode(doc_data.get("data", ""))
+                parts.append(types.Part.from_bytes(data=doc_bytes, mime_type=mime_type))
+                size += len(doc_bytes)
+        if message_id is None:
+            return parts
+        return self._remember(message_id, parts, size)
+    
+    async def _convert_messages(self, messages: List[Dict[str, Any]]) -> Tuple[Optional[str], List["types.Content"]]:
+        """Split out the system instruction and convert the rest to Gemini contents"""
         contents = []
         system_instruction = None
         
@@ -801,42 +1140,40 @@ class GoogleProvider(LLMProvider):
             role = msg["role"]
             content = msg["content"]
             
-            if role == "system":
-                system_instruction = content
+            # Leading system messages are the system instruction; later ones
+            # (per-turn RAG/web context) are passed as user text
+            if role == "system" and not contents:
+                system_instruction = f"{system_instruction}\n\n{content}" if system_instruction else content
                 continue
             
             # Map roles: user -> user, assistant -> model
             gemini_role = "model" if role == "assistant" else "user"
             
-            # Handle multimodal content
-            parts = []
             if isinstance(content, list):
-                for item in content:
-                    if item.get("type") == "text":
-                        parts.append(types.Part.from_text(text=item["text"]))
-                    elif item.get("type") == "image_url":
-                        image_url = item["image_url"]["url"]
-                        if image_url.startswith("data:"):
-                            header, b64_data = image_url.split(",", 1)
-                            mime_type = header.split(":")[1].split(";")[0]
-                            image_bytes = base64.b64decode(b64_data)
-                            parts.append(types.Part.from_bytes(data=image_bytes, mime_type=mime_type))
-                    elif item.get("type") == "document":
-                        doc_data = item.get("document", {})
-                        mime_type = doc_data.get("mime_type", "application/pdf")
-                        b64_data = doc_data.get("data", "")
-                        doc_bytes = base64.b64decode(b64_data)
-                        parts.append(types.Part.from_bytes(data=doc_bytes, mime_type=mime_type))
+                parts = await asyncio.to_thread(self._multimodal_parts, content, msg.get("id"))
+                if any(isinstance(part, dict) for part in parts):
+                    parts = [
+                        await self._image_file_part(part["image_file"]) if isinstance(part, dict) else part
+                        for part in parts
+                    ]
             else:
-                parts.append(types.Part.from_text(text=content))
+                parts = [types.Part.from_text(text=content)]
             
             contents.append(types.Content(role=gemini_role, parts=parts))
         
-        # Build generation config
+        return system_instruction, contents
+    
+    async def _generation_config(
+        self,
+        model: str,
+        system_instruction: Optional[str],
+        temperature: float,
+        max_tokens: Optional[int]
+    ) -> "types.GenerateContentConfig":
         config_kwargs = {}
         
         # Gemini 3 recommends temperature=1.0
-        if is_gemini_3:
+        if self._is_gemini_3(model):
             config_kwargs["temperature"] = 1.0
         else:
             config_kwargs["temperature"] = temperature
@@ -848,14 +1185,30 @@ class GoogleProvider(LLMProvider):
         # if is_gemini_3 and thinking_level:
         #     config_kwargs["thinking_config"] = types.ThinkingConfig(thinking_budget=thinking_level)
         
-        if system_instruction:
+        cached_content = await self._context_cache(model, system_instruction)
+        if cached_content:
+            config_kwargs["cached_content"] = cached_content
+        elif system_instruction:
             config_kwargs["system_instruction"] = system_instruction
         
-        config = types.GenerateContentConfig(**config_kwargs)
+        return types.GenerateContentConfig(**config_kwargs)
+    
+    async def chat(
+        self,
+        messages: List[Dict[str, Any]],
+        model: str,
+        temperature: float = 0.7,
+        max_tokens: Optional[int] = None,
+        stream: bool = False,
+        thinking_level: Optional[str] = None  # Gemini 3: 'low', 'high'
+    ) -> Dict[str, Any]:
+        if not self.is_available():
+            raise ValueError("Google API key not configured")
+        
+        system_instruction, contents = await self._convert_messages(messages)
+        config = await self._generation_config(model, system_instruction, temperature, max_tokens)
         
-        # Generate using the new SDK
-        response = await asyncio.to_thread(
-            self.client.models.generate_content,
+        response = await self.client.aio.models.generate_content(
             model=model,
             contents=contents,
             config=config
@@ -884,7 +1237,7 @@ class GoogleProvider(LLMProvider):
         result = {
             "content": text_content,
             "model": model,
-            "tokens": response.usage_metadata.total_token_count if hasattr(response, 'usage_metadata') and response.usage_metadata else None
+            "usage": TokenUsage.from_google(getattr(response, "usage_metadata", None))
         }
         
         if thought_signature:
@@ -903,100 +1256,43 @@ class GoogleProvider(LLMProvider):
         if not self.is_available():
             raise ValueError("Google API key not configured")
         
-        import base64
-        import asyncio
-        
-        is_gemini_3 = self._is_gemini_3(model)
-        
-        # Convert messages to Gemini format using types
-        contents = []
-        system_instruction = None
-        
-        for msg in messages:
-            role = msg["role"]
-            content = msg["content"]
-            
-            if role == "system":
-                system_instruction = content
-                continue
-            
-            gemini_role = "model" if role == "assistant" else "user"
-            
-            parts = []
-            if isinstance(content, list):
-                for item in content:
-                    if item.get("type") == "text":
-                        parts.append(types.Part.from_text(text=item["text"]))
-                    elif item.get("type") == "image_url":
-                        image_url = item["image_url"]["url"]
-                        if image_url.startswith("data:"):
-                            header, b64_data = image_url.split(",", 1)
-                            mime_type = header.split(":")[1].split(";")[0]
-                            image_bytes = base64.b64decode(b64_data)
-                            parts.append(types.Part.from_bytes(data=image_bytes, mime_type=mime_type))
-                    elif item.get("type") == "document":
-                        doc_data = item.get("document", {})
-                        mime_type = doc_data.get("mime_type", "application/pdf")
-                        b64_data = doc_data.get("data", "")
-                        doc_bytes = base64.b64decode(b64_data)
-                        parts.append(types.Part.from_bytes(data=doc_bytes, mime_type=mime_type))
-            else:
-                parts.append(types.Part.from_text(text=content))
-            
-            contents.append(types.Content(role=gemini_role, parts=parts))
-        
-        # Build generation config
-        config_kwargs = {}
-        
-        if is_gemini_3:
-            config_kwargs["temperature"] = 1.0
-        else:
-            config_kwargs["temperature"] = temperature
-        
-        if max_tokens:
-            config_kwargs["max_output_tokens"] = max_tokens
-        
-        # Skip thinking config for now - may not be supported in all models
-        # if is_gemini_3 and thinking_level:
-        #     config_kwargs["thinking_config"] = types.ThinkingConfig(thinking_budget=thinking_level)
+        system_instruction, contents = await self._convert_messages(messages)
+        config = await self._generation_config(model, system_instruction, temperature, max_tokens)
         
-        if system_instruction:
-            config_kwargs["system_instruction"] = system_instruction
-        
-        config = types.GenerateContentConfig(**config_kwargs)
-        
-        # Use non-streaming and yield the full response
-        # The google-genai SDK streaming doesn't work well with async
         try:
-            response = await asyncio.to_thread(
-                self.client.models.generate_content,
+            stream = await self.client.aio.models.generate_content_stream(
                 model=model,
                 contents=contents,
                 config=config
             )
             
-            # Extract text from response
-            if response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                for part in response.candidates[0].content.parts:
-                    if hasattr(part, 'text') and part.text:
-                        # Yield in chunks to simulate streaming
-                        text = part.text
-                        chunk_size = 50
-                        for i in range(0, len(text), chunk_size):
-                            yield text[i:i+chunk_size]
+            usage_metadata = None
+            async for chunk in stream:
+                # Usage is cumulative; the last chunk carries the totals
+                usage_metadata = getattr(chunk, "usage_metadata", None) or usage_metadata
+                if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts:
+                    for part in chunk.candidates[0].content.parts:
+                        if getattr(part, "text", None):
+                            yield part.text
+            
+            usage = TokenUsage.from_google(usage_metadata)
+            if usage:
+                yield usage
         except Exception as e:
-            print(f"❌ Google streaming error: {e}")
-            import traceback
-            traceback.print_exc()
-            yield f"\n\nError: {str(e)}"
+            # Raise rather than stream the error as text, so it is retried or reported as an error
+            logger.error(f"❌ Google streaming error: {e}")
+            raise
 
 
 class DeepSeekProvider(LLMProvider):
     """DeepSeek API Provider"""
+    
+    name = "deepseek"
     def __init__(self):
         self.client = AsyncOpenAI(
             api_key=settings.deepseek_api_key,
-            base_url="https://api.deepseek.com"
+            base_url="https://api.deepseek.com",
+            **SDK_CLIENT_OPTIONS
         ) if settings.deepseek_api_key else None
     
     def is_available(self) -> bool:
@@ -1028,11 +1324,7 @@ class DeepSeekProvider(LLMProvider):
         result = {
             "content": content,
             "model": model,
-            "usage": {
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
-            }
+            "usage": TokenUsage.from_openai(response.usage)
         }
         
         if reasoning_content:
@@ -1055,10 +1347,16 @@ class DeepSeekProvider(LLMProvider):
             messages=messages,
             temperature=temperature,
             max_tokens=max_tokens,
-            stream=True
+            stream=True,
+            extra_body={"stream_options": {"include_usage": True}}
         )
         
         async for chunk in stream:
+            usage = TokenUsage.from_openai(getattr(chunk, "usage", None))
+            if usage:
+                yield usage
+            if not chunk.choices:
+                continue
             delta = chunk.choices[0].delta
             
             # Support for reasoning_content (DeepSeek R1)
@@ -1069,6 +1367,20 @@ class DeepSeekProvider(LLMProvider):
                 yield delta.content
 
 
+# Served when OpenAI model listing fails
+OPENAI_FALLBACK_MODELS = [
+    {"id": "gpt-4o", "name": "GPT-4o", "provider": "openai", "context_window": 128000, "supports_functions": True, "supports_vision": True},
+    {"id": "gpt-4o-mini", "name": "GPT-4o Mini", "provider": "openai", "context_window": 128000, "supports_functions": True, "supports_vision": True},
+    {"id": "gpt-4-turbo", "name": "GPT-4 Turbo", "provider": "openai", "context_window": 128000, "supports_functions": True, "supports_vision": True},
+    {"id": "gpt-4", "name": "GPT-4", "provider": "openai", "context_window": 8192, "supports_functions": True, "supports_vision": False},
+    {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo", "provider": "openai", "context_window": 16385, "supports_functions": True, "supports_vision": False}
+]
+
+VOLCANO_FALLBACK_MODELS = [
+    {"id": "doubao-pro", "name": "豆包 (Smart Router)", "provider": "volcano", "context_window": 128000, "supports_functions": True, "supports_vision": True}
+]
+
+
 class LLMManager:
     def __init__(self):
         self.providers = {
@@ -1080,84 +1392,143 @@ class LLMManager:
             "deepseek": DeepSeekProvider(),
             "ollama": OllamaProvider()
         }
+        # Last successful discovery result per provider, served while its circuit is open
+        self._discovered_models: Dict[str, List[Dict[str, Any]]] = {}
+        self._reprobes: set = set()
+        model_labels.register("openai", [model["id"] for model in OPENAI_FALLBACK_MODELS])
+        model_labels.register("volcano", [model["id"] for model in VOLCANO_FALLBACK_MODELS])
     
     def get_provider(self, provider_name: str) -> LLMProvider:
         if provider_name not in self.providers:
             raise ValueError(f"Unknown provider: {provider_name}")
         return self.providers[provider_name]
     
+    async def _discover_openai(self) -> List[Dict[str, Any]]:
+        """List models from the OpenAI API, most relevant first"""
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                "https://api.openai.com/v1/models",
+                headers={"Authorization": f"Bearer {settings.openai_api_key}"},
+                timeout=settings.openai_discovery_timeout
+            )
+            response.raise_for_status()
+            chat_models = response.json().get("data", [])
+        logger.debug(f"🔍 Total models from OpenAI API: {len(chat_models)}")
+        
+        # Sort by most recent/relevant models first
+        priority_models = ["gpt-4o", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo"]
+        sorted_models = []
+        
+        for priority in priority_models:
+            matching = [m for m in chat_models if priority in m["id"]]
+            sorted_models.extend(matching)
+        
+        # Add remaining models
+        remaining = [m for m in chat_models if m not in sorted_models]
+        sorted_models.extend(remaining)
+        
+        models = [
+            {
+                "id": model["id"],
+                "name": model["id"].replace("-", " ").title(),
+                "provider": "openai",
+                "context_window": 128000 if "gpt-4" in model["id"] else 16385,
+                "supports_functions": True
+            }
+            for model in sorted_models  # Show all available models
+        ]
+        if not models:
+            raise ValueError("No chat models found")
+        return models
+    
+    async def _discover_ollama(self) -> List[Dict[str, Any]]:
+        """List locally pulled Ollama models"""
+        async with httpx.AsyncClient() as client:
+            response = await client.get(
+                f"{settings.ollama_base_url}/api/tags", timeout=settings.ollama_discovery_timeout
+            )
+            response.raise_for_status()
+            data = response.json()
+        return [
+            {
+                "id": model["name"],
+                "name": model["name"].replace(":", " ").title(),
+                "provider": "ollama",
+                "context_window": model.get("details", {}).get("parameter_size", "Unknown"),
+                "supports_functions": False
+            }
+            for model in data.get("models", [])
+        ]
+    
+    async def _run_discovery(self, name: str, discover, timeout: float) -> List[Dict[str, Any]]:
+        breaker = circuit_breakers.get(f"discovery:{name}")
+        try:
+            models = await asyncio.wait_for(discover(), timeout)
+        except Exception:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+        self._discovered_models[name] = models
+        return models
+    
+    async def _background_reprobe(self, name: str, discover, timeout: float):
+        try:
+            await self._run_discovery(name, discover, timeout)
+        except Exception as e:
+            logger.debug(f"Background re-probe of {name} failed: {e}")
+    
+    async def _probe(
+        self,
+        name: str,
+        discover,
+        timeout: float,
+        fallback: Optional[List[Dict[str, Any]]] = None
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Discover a provider's models within its deadline
+        
+        While the provider's breaker is open the last good (or fallback) list
+        is returned immediately and recovery is checked in the background.
+        """
+        breaker = circuit_breakers.get(f"discovery:{name}")
+        cached = self._discovered_models.get(name, fallback)
+        if breaker.is_open:
+            if breaker.try_acquire_trial():
+                task = asyncio.create_task(self._background_reprobe(name, discover, timeout))
+                self._reprobes.add(task)
+                task.add_done_callback(self._reprobes.discard)
+            return cached
+        try:
+            return await self._run_discovery(name, discover, timeout)
+        except Exception as e:
+            logger.warning(f"⚠️ {name} model discovery failed: {type(e).__name__}: {e}")
+            return cached
+    
     async def get_available_providers(self) -> List[Dict[str, Any]]:
         providers_status = []
         
+        # Providers with live model lists are probed concurrently, each with its own deadline
+        probes = {}
+        if self.providers["openai"].is_available():
+            probes["openai"] = self._probe(
+                "openai", self._discover_openai, settings.openai_discovery_timeout, OPENAI_FALLBACK_MODELS
+            )
+        if self.providers["volcano"].is_available():
+            # Volcano Engine uses smart routing, so we only need one entry as fallback
+            probes["volcano"] = self._probe(
+                "volcano", self.providers["volcano"].get_available_models,
+                settings.volcano_discovery_timeout, VOLCANO_FALLBACK_MODELS
+            )
+        probes["ollama"] = self._probe("ollama", self._discover_ollama, settings.ollama_discovery_timeout)
+        discovered = dict(zip(probes, await asyncio.gather(*probes.values())))
+        
         # OpenAI
-        openai_provider = self.providers["openai"]
-        if openai_provider.is_available():
-            try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(
-                        "https://api.openai.com/v1/models",
-                        headers={"Authorization": f"Bearer {settings.openai_api_key}"},
-                        timeout=10.0
-                    )
-                    if response.status_code == 200:
-                        data = response.json()
-                        all_models = data.get("data", [])
-                        print(f"🔍 Total models from OpenAI API: {len(all_models)}")
-                        
-                        # Don't filter - show all models
-                        chat_models = all_models
-                        
-                        print(f"📋 Showing all {len(chat_models)} models")
-                        print("First 10 models:")
-                        for model in chat_models[:10]:
-                            print(f"  - {model['id']}")
-                        
-                        # Sort by most recent/relevant models first
-                        priority_models = ["gpt-4o", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo"]
-                        sorted_models = []
-                        
-                        for priority in priority_models:
-                            matching = [m for m in chat_models if priority in m["id"]]
-                            sorted_models.extend(matching)
-                        
-                        # Add remaining models
-                        remaining = [m for m in chat_models if m not in sorted_models]
-                        sorted_models.extend(remaining)
-                        
-                        models = [
-                            {
-                                "id": model["id"],
-                                "name": model["id"].replace("-", " ").title(),
-                                "provider": "openai",
-                                "context_window": 128000 if "gpt-4" in model["id"] else 16385,
-                                "supports_functions": True
-                            }
-                            for model in sorted_models  # Show all available models
-                        ]
-                        
-                        if models:  # Only add if we got models
-                            providers_status.append({
-                                "provider": "openai",
-                                "available": True,
-                                "models": models
-                            })
-                        else:
-                            # If no models found, use fallback
-                            raise ValueError("No chat models found")
-            except Exception as e:
-                print(f"OpenAI models fetch error: {e}")
-                # Fallback to default models if API call fails
-                providers_status.append({
-                    "provider": "openai",
-                    "available": True,
-                    "models": [
-                        {"id": "gpt-4o", "name": "GPT-4o", "provider": "openai", "context_window": 128000, "supports_functions": True, "supports_vision": True},
-                        {"id": "gpt-4o-mini", "name": "GPT-4o Mini", "provider": "openai", "context_window": 128000, "supports_functions": True, "supports_vision": True},
-                        {"id": "gpt-4-turbo", "name": "GPT-4 Turbo", "provider": "openai", "context_window": 128000, "supports_functions": True, "supports_vision": True},
-                        {"id": "gpt-4", "name": "GPT-4", "provider": "openai", "context_window": 8192, "supports_functions": True, "supports_vision": False},
-                        {"id": "gpt-3.5-turbo", "name": "GPT-3.5 Turbo", "provider": "openai", "context_window": 16385, "supports_functions": True, "supports_vision": False}
-                    ]
-                })
+        if discovered.get("openai"):
+            providers_status.append({
+                "provider": "openai",
+                "available": True,
+                "models": discovered["openai"]
+            })
         
         # Anthropic - Use static list (Anthropic doesn't have a models list endpoint)
         anthropic_provider = self.providers["anthropic"]
@@ -1224,53 +1595,23 @@ class LLMManager:
             })
         
         # Volcano Engine (火山引擎)
-        volcano_provider = self.providers["volcano"]
-        if volcano_provider.is_available():
-            try:
-                # Volcano Engine uses smart routing, so we only need one entry
-                volcano_models = await volcano_provider.get_available_models()
-                
-                providers_status.append({
-                    "provider": "volcano",
-                    "available": True,
-                    "models": volcano_models
-                })
-            except Exception as e:
-                print(f"⚠️ Error in Volcano discovery: {e}")
-                providers_status.append({
-                    "provider": "volcano",
-                    "available": True,
-                    "models": [
-                        {"id": "doubao-pro", "name": "豆包 (Smart Router)", "provider": "volcano", "context_window": 128000, "supports_functions": True, "supports_vision": True}
-                    ]
-                })
+        if discovered.get("volcano") is not None:
+            providers_status.append({
+                "provider": "volcano",
+                "available": True,
+                "models": discovered["volcano"]
+            })
         
-        # Ollama - Fetch from local API
-        ollama_provider = self.providers["ollama"]
-        if await ollama_provider.is_available():
-            try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.get(f"{settings.ollama_base_url}/api/tags", timeout=5.0)
-                    data = response.json()
-                    models = [
-                        {
-                            "id": model["name"],
-                            "name": model["name"].replace(":", " ").title(),
-                            "provider": "ollama",
-                            "context_window": model.get("details", {}).get("parameter_size", "Unknown"),
-                            "supports_functions": False
-                        }
-                        for model in data.get("models", [])
-                    ]
-                    providers_status.append({
-                        "provider": "ollama",
-                        "available": True,
-                        "models": models
-                    })
-            except:
-                pass
+        # Ollama - only listed when the local server answered
+        if discovered.get("ollama") is not None:
+            providers_status.append({
+                "provider": "ollama",
+                "available": True,
+                "models": discovered["ollama"]
+            })
         
+        for entry in providers_status:
+            model_labels.register(entry["provider"], [model["id"] for model in entry["models"]])
         return providers_status
 
-
 llm_manager = LLMManager()
@@ -0,0 +1,325 @@
+"""
+Resilient LLM calls: retries, hedging and failover
+
+Wraps llm_manager so call sites get the same behaviour for every provider:
+- retryable failures (429, 5xx, timeouts, dropped connections) are retried
+  with full-jitter exponential backoff, honouring Retry-After
+- latency-critical short calls can be hedged: if the first request hasn't
+  answered after a delay, a duplicate is sent and the first reply wins
+- when a target keeps failing, its model is missing or its circuit is open,
+  the call moves on to the next target of a failover route, e.g.
+  openai:gpt-4o > openrouter:openai/gpt-4o
+
+Streams are only retried before the first chunk is delivered.
+"""
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+import asyncio
+import random
+import time
+from backend.config import settings
+from backend.llm_providers import llm_manager, LLMManager, LLMProvider
+from backend.circuit_breaker import circuit_breakers
+from backend.logger import get_logger
+from backend.metrics import LLM_FAILOVERS_TOTAL, LLM_HEDGED_REQUESTS_TOTAL, LLM_RETRIES_TOTAL
+
+logger = get_logger(__name__)
+
+RETRYABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+FAILOVER_STATUS = {401, 403, 404}
+MODEL_MISSING_PHRASES = ("model_not_found", "does not exist", "invalid model", "not supported", "not available")
+
+
+@dataclass(frozen=True)
+class LLMTarget:
+    """A provider/model pair a call can be sent to"""
+    provider: str
+    model: str
+
+    def __str__(self) -> str:
+        return f"{self.provider}:{self.model}"
+
+    @classmethod
+    def parse(cls, spec: str) -> "LLMTarget":
+        provider, _, model = spec.strip().partition(":")
+        return cls(provider.strip(), model.strip())
+
+
+@dataclass
+class ErrorVerdict:
+    """How the engine should react to a failed attempt"""
+    retryable: bool
+    failover: bool
+    retry_after: Optional[float] = None
+    reason: str = "error"
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for attr in ("status_code", "code", "status"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(exc: BaseException) -> ErrorVerdict:
+    """Decide whether a provider error is worth retrying or failing over"""
+    if isinstance(exc, asyncio.TimeoutError):
+        return ErrorVerdict(retryable=True, failover=True, reason="timeout")
+
+    name = type(exc).__name__
+    if "Timeout" in name:
+        return ErrorVerdict(retryable=True, failover=True, reason="timeout")
+    if "Connection" in name or "Connect" in name or name in ("RemoteProtocolError", "ReadError"):
+        return ErrorVerdict(retryable=True, failover=True, reason="connection")
+
+    status = _status_code(exc)
+    if status in RETRYABLE_STATUS:
+        reason = "rate_limited" if status == 429 else f"http_{status}"
+        return ErrorVerdict(retryable=True, failover=True, retry_after=_retry_after(exc), reason=reason)
+    if status in FAILOVER_STATUS:
+        return ErrorVerdict(retryable=False, failover=True, reason=f"http_{status}")
+
+    message = str(exc).lower()
+    if any(phrase in message for phrase in MODEL_MISSING_PHRASES):
+        return ErrorVerdict(retryable=False, failover=True, reason="model_unavailable")
+    return ErrorVerdict(retryable=False, failover=False)
+
+
+def _messages_for(llm: LLMProvider, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Only Google understands 'image_file' items and message ids; strip them for everyone else"""
+    if llm.name == "google":
+        return messages
+    from backend.image_cache import image_cache
+    messages = [{k: v for k, v in m.items() if k != "id"} if "id" in m else m for m in messages]
+    return image_cache.inline_image_files(messages)
+
+
+def parse_failover_routes(spec: str) -> Dict[LLMTarget, List[LLMTarget]]:
+    """
+    Parse 'openai:gpt-4o>openrouter:openai/gpt-4o, openai:*>openrouter:openai/*'
+
+    Each comma separated route is a chain; '*' in a model stands for the
+    requested model name.
+    """
+    routes: Dict[LLMTarget, List[LLMTarget]] = {}
+    for route in spec.split(","):
+        hops = [LLMTarget.parse(hop) for hop in route.split(">") if hop.strip()]
+        if len(hops) > 1:
+            routes[hops[0]] = hops[1:]
+    return routes
+
+
+class ResilientLLM:
+    """Retry/hedge/failover layer in front of the LLM providers"""
+
+    def __init__(
+        self,
+        manager: LLMManager,
+        max_attempts: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        max_retry_after: float = 30.0,
+        hedge_delay: float = 1.5,
+        failover_routes: str = ""
+    ):
+        self.manager = manager
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.hedge_delay = hedge_delay
+        self.routes = parse_failover_routes(failover_routes)
+
+    def targets_for(self, provider: str, model: str, fallbacks: Sequence[LLMTarget] = ()) -> List[LLMTarget]:
+        """Primary target followed by explicit fallbacks and configured route hops"""
+        primary = LLMTarget(provider, model)
+        hops = self.routes.get(primary) or [
+            LLMTarget(hop.provider, hop.model.replace("*", model))
+            for hop in self.routes.get(LLMTarget(provider, "*"), [])
+        ]
+        targets = [primary]
+        for target in [*fallbacks, *hops]:
+            if target not in targets and self._is_configured(target.provider):
+                targets.append(target)
+        return targets
+
+    def _is_configured(self, provider_name: str) -> bool:
+        provider = self.manager.providers.get(provider_name)
+        if provider is None:
+            return False
+        available = provider.is_available()
+        if asyncio.iscoroutine(available):
+            # Ollama probes its server here; let the call itself find out
+            available.close()
+            return True
+        return bool(available)
+
+    def _backoff(self, attempt: int, verdict: ErrorVerdict) -> float:
+        if verdict.retry_after is not None:
+            return min(verdict.retry_after, self.max_retry_after)
+        # Full jitter keeps retrying clients from synchronising
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def _hedged(self, invoke: Callable[[], Awaitable[Any]]) -> Any:
+        """Run invoke(), racing a duplicate if the first is slower than hedge_delay"""
+        first = asyncio.create_task(invoke())
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay)
+            if done:
+                return first.result()
+
+            second = asyncio.create_task(invoke())
+            pending.add(second)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        LLM_HEDGED_REQUESTS_TOTAL.inc(winner="primary" if task is first else "hedge")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # The loser (or everything, if we were cancelled) must not keep running
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    async def call(
+        self,
+        targets: Sequence[LLMTarget],
+        invoke: Callable[[LLMProvider, str], Awaitable[Any]],
+        hedge: bool = False
+    ) -> Tuple[Any, LLMTarget]:
+        """
+        Run invoke(provider, model) against each target in turn until one succeeds
+
+        Returns the result and the target that produced it.
+        """
+        last_error: Optional[BaseException] = None
+        for index, target in enumerate(targets):
+            is_last = index == len(targets) - 1
+            breaker = circuit_breakers.get(f"llm:{target.provider}")
+            if not is_last and not breaker.allow_request():
+                logger.info(f"⏭️ Skipping {target}: circuit open")
+                LLM_FAILOVERS_TOTAL.inc(source=target.provider, target=targets[index + 1].provider, reason="circuit_open")
+                continue
+
+            provider = self.manager.get_provider(target.provider)
+            try:
+                for attempt in range(self.max_attempts):
+                    try:
+                        if hedge:
+                            result = await self._hedged(lambda: invoke(provider, target.model))
+                        else:
+                            result = await invoke(provider, target.model)
+                        breaker.record_success()
+                        return result, target
+                    except Exception as exc:
+                        last_error = exc
+                        verdict = classify_error(exc)
+                        if not verdict.retryable or attempt == self.max_attempts - 1:
+                            break
+                        delay = self._backoff(attempt, verdict)
+                        LLM_RETRIES_TOTAL.inc(provider=target.provider, reason=verdict.reason)
+                        logger.warning(
+                            f"🔁 {target} failed ({verdict.reason}), retry {attempt + 1}/{self.max_attempts - 1} in {delay:.2f}s"
+                        )
+                        await asyncio.sleep(delay)
+
+                # One failed call (after its retries) counts once towards the breaker; any
+                # other error was an answer, so the endpoint itself is up
+                if verdict.retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            finally:
+                # Cancelled calls have no outcome; don't keep the half-open trial claimed
+                breaker.release_trial()
+            if is_last or not verdict.failover:
+                raise last_error
+            LLM_FAILOVERS_TOTAL.inc(source=target.provider, target=targets[index + 1].provider, reason=verdict.reason)
+            logger.warning(f"↪️ {target} failed ({verdict.reason}): failing over to {targets[index + 1]}")
+
+        raise last_error or RuntimeError("No LLM target available")
+
+    async def chat(
+        self,
+        provider: str,
+        model: str,
+        messages: List[Dict[str, Any]],
+        fallbacks: Sequence[LLMTarget] = (),
+        hedge: bool = False,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Resilient equivalent of llm_manager.get_provider(provider).chat(messages, model, ...)"""
+        async def invoke(llm: LLMProvider, model_name: str):
+            return await llm.chat(_messages_for(llm, messages), model_name, **kwargs)
+
+        result, _ = await self.call(self.targets_for(provider, model, fallbacks), invoke, hedge=hedge)
+        return result
+
+    async def chat_stream(
+        self,
+        provider: str,
+        model: str,
+        messages: List[Dict[str, Any]],
+        fallbacks: Sequence[LLMTarget] = (),
+        **kwargs
+    ) -> AsyncGenerator[str, None]:
+        """Resilient chat_stream: retries and failover apply until the first chunk arrives"""
+        async def open_stream(llm: LLMProvider, model_name: str):
+            stream = llm.chat_stream(_messages_for(llm, messages), model_name, **kwargs)
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
+            return stream, first
+
+        (stream, first), _ = await self.call(self.targets_for(provider, model, fallbacks), open_stream)
+        if first is None:
+            return
+        try:
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+
+# Global resilient LLM instance
+resilient_llm = ResilientLLM(
+    llm_manager,
+    max_attempts=settings.llm_retry_max_attempts,
+    base_delay=settings.llm_retry_base_delay,
+    max_delay=settings.llm_retry_max_delay,
+    max_retry_after=settings.llm_retry_after_max,
+    hedge_delay=settings.llm_hedge_delay_seconds,
+    failover_routes=settings.llm_failover_routes
+)
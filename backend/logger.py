@@ -0,0 +1,170 @@
+"""
+Structured, non-blocking logging
+
+Records are pushed onto a queue by a QueueHandler and written to stdout by a
+background QueueListener thread, so request handlers never wait on the stdout
+lock. Every record carries the id of the request that produced it. DEBUG lines
+are dropped (or sampled) unless verbose logging was asked for on that request.
+"""
+from contextvars import ContextVar
+from typing import Optional
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import uuid
+from backend.config import settings
+
+
+ROOT_LOGGER = "backend"
+REQUEST_ID_HEADER = b"x-request-id"
+VERBOSE_HEADER = b"x-debug-logging"
+
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+verbose_var: ContextVar[bool] = ContextVar("verbose_logging", default=False)
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "request_id"}
+
+
+def get_request_id() -> Optional[str]:
+    return request_id_var.get()
+
+
+class RequestContextFilter(logging.Filter):
+    """Tag records with the request id and apply level/sampling rules"""
+
+    def __init__(self, level: int, debug_sample_rate: float):
+        super().__init__()
+        self.level = level
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or "-"
+        if record.levelno >= self.level or verbose_var.get():
+            return True
+        return self.debug_sample_rate > 0 and random.random() < self.debug_sample_rate
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including extra= fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable line with extra= fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extras = [
+            f"{key}={value}" for key, value in record.__dict__.items()
+            if key not in _RECORD_ATTRS and not key.startswith("_")
+        ]
+        return f"{line} {' '.join(extras)}" if extras else line
+
+
+class LogManager:
+    """Owns the queue handler/listener pair behind the 'backend' logger"""
+
+    def __init__(self):
+        self._listener: Optional[logging.handlers.QueueListener] = None
+
+    def setup(self):
+        """Install the queue handler once; safe to call repeatedly"""
+        if self._listener is not None:
+            return
+
+        level = logging.getLevelName(settings.log_level.upper())
+        if not isinstance(level, int):
+            level = logging.INFO
+
+        log_queue: queue.Queue = queue.Queue(-1)
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(RequestContextFilter(level, settings.log_debug_sample_rate))
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JSONFormatter() if settings.log_format == "json" else TextFormatter())
+
+        root = logging.getLogger(ROOT_LOGGER)
+        # Level filtering happens in RequestContextFilter so verbose requests can see DEBUG
+        root.setLevel(logging.DEBUG)
+        root.addHandler(queue_handler)
+        root.propagate = False
+
+        self._listener = logging.handlers.QueueListener(log_queue, stream_handler)
+        self._listener.start()
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        """Flush queued records and stop the writer thread"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+
+class RequestContextMiddleware:
+    """
+    ASGI middleware that assigns each request an id (or reuses X-Request-ID),
+    echoes it on the response and enables verbose logging when the request
+    sends X-Debug-Logging: 1 and the server allows it.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(REQUEST_ID_HEADER, b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        verbose = settings.log_allow_verbose_requests and headers.get(VERBOSE_HEADER) == b"1"
+
+        request_token = request_id_var.set(request_id)
+        verbose_token = verbose_var.set(verbose)
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers") or []) + [
+                    (REQUEST_ID_HEADER, request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            request_id_var.reset(request_token)
+            verbose_var.reset(verbose_token)
+
+
+# Global log manager instance
+log_manager = LogManager()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Get a module logger routed through the async queue handler"""
+    log_manager.setup()
+    if not name.startswith(ROOT_LOGGER):
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)
@@ -1,20 +1,47 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import secrets
 from backend.config import settings
 from backend.database import init_db
+from backend.db_writer import db_writer
+from backend.metrics import metrics
+from backend.logger import RequestContextMiddleware, log_manager
 from backend.routes import conversations, chat, models, tools, config, generation, auth, admin, suggestions, bots, documents, mcp
 from backend.mcp_client import initialize_mcp, shutdown_mcp
+from backend.model_catalog import model_catalog
+from backend.response_cache import response_cache
+from backend.usage import usage_recorder
+from backend.batch_jobs import batch_runner
+from backend.config_cache import config_cache
+from backend.rate_limiter import rate_limiter
+from backend.guest_sessions import guest_sessions, GUEST_TOKEN_HEADER
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await init_db()
+    db_writer.start()
+    await config_cache.load()
     await initialize_mcp()
+    model_catalog.start()
+    usage_recorder.start()
+    batch_runner.start()
+    rate_limiter.start()
+    guest_sessions.start()
     yield
     # Shutdown
+    await batch_runner.stop()
+    await model_catalog.stop()
+    await usage_recorder.stop()
+    await rate_limiter.stop()
+    await guest_sessions.stop()
+    await db_writer.stop()
+    await response_cache.close()
     await shutdown_mcp()
+    log_manager.shutdown()
 
 
 from fastapi.staticfiles import StaticFiles
@@ -36,8 +63,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", GUEST_TOKEN_HEADER],
 )
 
+# Request ids for log correlation
+app.add_middleware(RequestContextMiddleware)
+
 # Routes
 app.include_router(auth.router)
 app.include_router(admin.router)
@@ -67,6 +98,18 @@ async def health():
     return {"status": "healthy"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(request: Request):
+    """Prometheus scrape endpoint (off unless METRICS_ENABLED, bearer token if METRICS_TOKEN)"""
+    if not settings.metrics_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if settings.metrics_token:
+        expected = f"Bearer {settings.metrics_token}"
+        if not secrets.compare_digest(request.headers.get("Authorization", "").encode(), expected.encode()):
+            raise HTTPException(status_code=401, detail="Invalid metrics token", headers={"WWW-Authenticate": "Bearer"})
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
@@ -0,0 +1,265 @@
+"""
+In-process metrics with Prometheus text exposition
+
+Lightweight counters and histograms for capacity planning. Everything lives in
+process memory and is rendered on GET /metrics; no external dependency needed.
+"""
+from typing import Dict, Iterable, List, Sequence, Set, Tuple
+from contextlib import contextmanager
+import threading
+import time
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Base class for labelled metrics"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonically increasing value"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Histogram(Metric):
+    """Distribution of observed values in cumulative buckets"""
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # bucket counts + [sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = [0.0] * (len(self.buckets) + 2)
+                self._series[key] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of a block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                bucket_labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            inf_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_bucket{inf_labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{labels} {series[-2]}")
+            lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds all metrics and renders them in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class ModelLabels:
+    """
+    Model names allowed as label values
+
+    Models come from client requests, so every unseen name would add series
+    that are never dropped. Only models in the provider catalogs, or that a
+    provider has accepted, get their own label, up to max_models; the rest
+    are reported as "other".
+    """
+
+    def __init__(self, max_models: int = 1000):
+        self.max_models = max_models
+        self._known: Set[Tuple[str, str]] = set()
+
+    def register(self, provider: str, models: Iterable[str]):
+        for model in models:
+            if len(self._known) >= self.max_models:
+                return
+            self._known.add((provider, model))
+
+    def label(self, provider: str, model: str, accepted: bool = False) -> str:
+        """model if it is known (or, with accepted, admitted now), else 'other'"""
+        if (provider, model) in self._known:
+            return model
+        if accepted and model and len(self._known) < self.max_models:
+            self._known.add((provider, model))
+            return model
+        return "other"
+
+
+# Global metrics registry
+metrics = MetricsRegistry()
+
+# Global model label registry
+model_labels = ModelLabels()
+
+# Chat turns
+CHAT_TTFT_SECONDS = metrics.histogram(
+    "midas_chat_time_to_first_token_seconds",
+    "Time from turn start to the first generated token",
+    ["provider", "model"]
+)
+CHAT_TURN_SECONDS = metrics.histogram(
+    "midas_chat_turn_seconds",
+    "Total chat turn latency",
+    ["mode", "streaming"]
+)
+CHAT_DISCONNECTS_TOTAL = metrics.counter(
+    "midas_chat_disconnects_total",
+    "Streaming chat turns cancelled because the client disconnected",
+    ["stage"]
+)
+CHAT_STAGE_SECONDS = metrics.histogram(
+    "midas_chat_stage_seconds",
+    "Chat pipeline stage latency",
+    ["stage"]
+)
+
+# Retrieval
+RAG_RETRIEVAL_SECONDS = metrics.histogram(
+    "midas_rag_retrieval_seconds",
+    "RAG retrieval latency including deep research",
+    ["status"]
+)
+EMBEDDING_SECONDS = metrics.histogram(
+    "midas_embedding_seconds",
+    "Embedding API call latency",
+    ["model"]
+)
+
+# Providers
+LLM_REQUEST_SECONDS = metrics.histogram(
+    "midas_llm_request_seconds",
+    "LLM provider call latency",
+    ["provider", "model", "method", "status"]
+)
+LLM_TOKENS_TOTAL = metrics.counter(
+    "midas_llm_tokens_total",
+    "Tokens used by LLM calls",
+    ["provider", "model", "type"]
+)
+LLM_RETRIES_TOTAL = metrics.counter(
+    "midas_llm_retries_total",
+    "LLM calls retried after a transient failure",
+    ["provider", "reason"]
+)
+LLM_FAILOVERS_TOTAL = metrics.counter(
+    "midas_llm_failovers_total",
+    "LLM calls moved to the next target of a failover route",
+    ["source", "target", "reason"]
+)
+LLM_HEDGED_REQUESTS_TOTAL = metrics.counter(
+    "midas_llm_hedged_requests_total",
+    "Hedged LLM calls by which request answered first",
+    ["winner"]
+)
+
+# Storage and tools
+DB_QUERY_SECONDS = metrics.histogram(
+    "midas_db_query_seconds",
+    "Database statement execution time",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+TOOL_SECONDS = metrics.histogram(
+    "midas_tool_seconds",
+    "Agent tool execution time",
+    ["tool", "status"]
+)
+
+# Caches
+CACHE_REQUESTS_TOTAL = metrics.counter(
+    "midas_cache_requests_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"]
+)
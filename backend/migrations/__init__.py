@@ -0,0 +1,296 @@
+"""
+Versioned schema migrations
+
+Each module in this package is one migration with a VERSION, a NAME and an
+async upgrade(m) that receives a MigrationContext. Applied versions are
+recorded in schema_migrations; the app checks them at startup and, with
+DB_AUTO_MIGRATE, applies whatever is pending.
+
+Migrations must be idempotent (guard on what already exists) because a
+database created by create_all is stamped with every version without running
+them. Data backfills go through MigrationContext.backfill, which works in
+short batches and records its position, so an interrupted migration resumes
+where it stopped instead of starting over.
+
+    python -m backend.migrations status
+    python -m backend.migrations upgrade
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional
+import asyncio
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, bindparam, inspect, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.schema import CreateColumn
+from backend.config import settings
+from backend.database import Base, create_extensions, engine
+from backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+migration_metadata = MetaData()
+
+schema_migrations = Table(
+    "schema_migrations", migration_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, default=datetime.utcnow)
+)
+
+# Position of each backfill: rows with a key above last_key are still to do
+schema_backfills = Table(
+    "schema_backfills", migration_metadata,
+    Column("name", String, primary_key=True),
+    Column("last_key", String, nullable=True),
+    Column("rows_done", Integer, default=0),
+    Column("updated_at", DateTime, default=datetime.utcnow)
+)
+
+# Arbitrary constant identifying the migration lock on PostgreSQL
+ADVISORY_LOCK_ID = 7_310_420_049
+
+BackfillBatch = Callable[[AsyncConnection, List[str]], Awaitable[None]]
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    description: str
+    upgrade: Callable[["MigrationContext"], Awaitable[None]]
+
+
+class MigrationContext:
+    """Schema helpers handed to a migration's upgrade()"""
+
+    def __init__(self, migration: Migration, batch_size: int, batch_pause: float):
+        self.migration = migration
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.dialect = engine.dialect.name
+
+    async def execute(self, *statements: str):
+        """Run statements in one transaction"""
+        async with engine.begin() as conn:
+            for statement in statements:
+                await conn.execute(text(statement))
+
+    async def has_table(self, table: str) -> bool:
+        async with engine.connect() as conn:
+            return await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table(table))
+
+    async def get_column(self, table: str, column: str) -> Optional[dict]:
+        """Reflected column info (name, type, nullable, ...) or None"""
+        async with engine.connect() as conn:
+            columns = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_columns(table))
+        return next((info for info in columns if info["name"] == column), None)
+
+    async def add_column(self, table: str, column: Column):
+        """ALTER TABLE ... ADD COLUMN unless the column exists"""
+        if await self.get_column(table, column.name) is not None:
+            logger.info(f"  ⚠️ {table}.{column.name} already exists")
+            return
+        ddl = CreateColumn(column).compile(dialect=engine.dialect)
+        await self.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+        logger.info(f"  ✅ Added {table}.{column.name}")
+
+    async def create_index(self, index):
+        async with engine.begin() as conn:
+            await conn.run_sync(index.create, checkfirst=True)
+
+    async def backfill(self, name: str, table: str, batch: BackfillBatch, key: str = "id", where: str = None):
+        """
+        Call batch(conn, keys) for the table's rows, batch_size keys at a time
+        in key order
+
+        Every batch commits together with its position, so reads and writes
+        keep flowing between batches and a restarted migration continues after
+        the last committed key. Rows inserted behind the position while it
+        runs are not visited; follow up with a catch-up statement if the
+        table takes writes.
+        """
+        name = f"{self.migration.version}:{name}"
+        async with engine.begin() as conn:
+            row = (await conn.execute(
+                select(schema_backfills.c.last_key, schema_backfills.c.rows_done)
+                .where(schema_backfills.c.name == name)
+            )).first()
+            if row is None:
+                await conn.execute(schema_backfills.insert().values(name=name, rows_done=0))
+                last_key, rows_done = None, 0
+            else:
+                last_key, rows_done = row
+        if last_key is not None:
+            logger.info(f"  ↪️ Resuming backfill {name} after {rows_done} rows")
+
+        conditions = [where] if where else []
+        while True:
+            query = f"SELECT {key} FROM {table}"
+            params = {"limit": self.batch_size}
+            if last_key is not None:
+                params["after"] = last_key
+            batch_conditions = conditions + ([f"{key} > :after"] if last_key is not None else [])
+            if batch_conditions:
+                query += " WHERE " + " AND ".join(f"({condition})" for condition in batch_conditions)
+            query += f" ORDER BY {key} LIMIT :limit"
+
+            async with engine.begin() as conn:
+                keys = [str(value) for value in (await conn.execute(text(query), params)).scalars().all()]
+                if not keys:
+                    break
+                await batch(conn, keys)
+                last_key = keys[-1]
+                rows_done += len(keys)
+                await conn.execute(
+                    schema_backfills.update()
+                    .where(schema_backfills.c.name == name)
+                    .values(last_key=last_key, rows_done=rows_done, updated_at=datetime.utcnow())
+                )
+            logger.info(f"  … {name}: {rows_done} rows")
+            if self.batch_pause > 0:
+                await asyncio.sleep(self.batch_pause)
+        logger.info(f"  ✅ Backfill {name} done ({rows_done} rows)")
+
+    @staticmethod
+    def keys_param(statement: str):
+        """text() for a statement filtering on "IN :keys" with the batch's keys"""
+        return text(statement).bindparams(bindparam("keys", expanding=True))
+
+
+class Migrator:
+    """Applies pending migrations and records the schema version"""
+
+    def __init__(self, migrations: List[Migration], batch_size: int = 1000, batch_pause: float = 0.0):
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+
+    @property
+    def latest(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    async def applied(self) -> List[int]:
+        async with engine.begin() as conn:
+            await conn.run_sync(migration_metadata.create_all)
+            return list((await conn.execute(select(schema_migrations.c.version))).scalars().all())
+
+    async def current_version(self) -> int:
+        return max(await self.applied(), default=0)
+
+    async def pending(self) -> List[Migration]:
+        applied = set(await self.applied())
+        return [migration for migration in self.migrations if migration.version not in applied]
+
+    async def _record(self, migration: Migration):
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(schema_migrations.insert().values(version=migration.version, name=migration.name))
+        except IntegrityError:
+            pass  # Another process recorded it first
+
+    async def stamp(self, version: Optional[int] = None):
+        """Mark migrations up to version (default: all) as applied without running them"""
+        for migration in await self.pending():
+            if version is None or migration.version <= version:
+                await self._record(migration)
+
+    async def upgrade(self, target: Optional[int] = None) -> int:
+        """Run pending migrations in order; returns how many ran"""
+        lock = None
+        if engine.dialect.name == "postgresql":
+            # Several workers or deploy hosts may start at once
+            lock = await engine.connect()
+            await lock.execute(text(f"SELECT pg_advisory_lock({ADVISORY_LOCK_ID})"))
+        try:
+            ran = 0
+            for migration in await self.pending():
+                if target is not None and migration.version > target:
+                    break
+                logger.info(f"🔄 Migration {migration.version:04d} {migration.name}: {migration.description}")
+                await migration.upgrade(MigrationContext(migration, self.batch_size, self.batch_pause))
+                await self._record(migration)
+                ran += 1
+            return ran
+        finally:
+            if lock is not None:
+                await lock.execute(text(f"SELECT pg_advisory_unlock({ADVISORY_LOCK_ID})"))
+                await lock.close()
+
+    async def ensure_schema(self, auto_migrate: bool = True):
+        """
+        Bring the database to the current schema at startup
+
+        A new database is created from the models and stamped with the latest
+        version. An existing one gets any tables it lacks, then its pending
+        migrations; without auto_migrate they are reported instead.
+        """
+        import backend.models  # noqa: F401  Register every table on Base.metadata
+        import backend.model_permissions  # noqa: F401
+
+        async with engine.begin() as conn:
+            await create_extensions(conn)
+            fresh = not await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table("users"))
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(migration_metadata.create_all)
+
+        if fresh:
+            await self.stamp()
+            logger.info(f"🗄️ Created database schema at version {self.latest}")
+            return
+
+        applied = await self.applied()
+        if max(applied, default=0) > self.latest:
+            logger.warning(
+                f"⚠️ Database schema version {max(applied)} is newer than this code ({self.latest})"
+            )
+        pending = [migration for migration in self.migrations if migration.version not in set(applied)]
+        if not pending:
+            return
+        if not auto_migrate:
+            raise RuntimeError(
+                f"Database schema is missing migrations {[migration.version for migration in pending]}: "
+                f"run `python -m backend.migrations upgrade`"
+            )
+        ran = await self.upgrade()
+        logger.info(f"✅ Applied {ran} migrations, schema at version {self.latest}")
+
+
+def _load_migrations() -> List[Migration]:
+    from backend.migrations import (
+        m0001_conversation_bot_id,
+        m0002_rag,
+        m0003_rag_conversation_level,
+        m0004_documents_bot_id_nullable,
+        m0005_user_token_version,
+        m0006_query_indexes,
+        m0007_pgvector_embeddings,
+        m0008_batch_job_lease,
+    )
+    modules = [
+        m0001_conversation_bot_id,
+        m0002_rag,
+        m0003_rag_conversation_level,
+        m0004_documents_bot_id_nullable,
+        m0005_user_token_version,
+        m0006_query_indexes,
+        m0007_pgvector_embeddings,
+        m0008_batch_job_lease,
+    ]
+    return [
+        Migration(
+            version=module.VERSION,
+            name=module.NAME,
+            description=(module.__doc__ or "").strip().splitlines()[0],
+            upgrade=module.upgrade
+        )
+        for module in modules
+    ]
+
+
+# Global migrator instance
+migrator = Migrator(
+    _load_migrations(),
+    batch_size=settings.migration_batch_size,
+    batch_pause=settings.migration_batch_pause_seconds
+)
@@ -0,0 +1,49 @@
+"""
+Schema migration command line
+
+    python -m backend.migrations status    # applied and pending versions
+    python -m backend.migrations upgrade   # create or upgrade the schema
+    python -m backend.migrations stamp N   # mark versions up to N as applied
+"""
+import argparse
+import asyncio
+import sys
+from backend.database import engine
+from backend.migrations import migrator
+
+
+async def status():
+    applied = set(await migrator.applied())
+    for migration in migrator.migrations:
+        mark = "✓" if migration.version in applied else "·"
+        print(f"{mark} {migration.version:04d} {migration.name} - {migration.description}")
+    pending = [migration for migration in migrator.migrations if migration.version not in applied]
+    print(f"\nSchema version {max(applied, default=0)}, {len(pending)} pending (latest {migrator.latest})")
+
+
+async def main(args) -> int:
+    try:
+        if args.command == "status":
+            await status()
+        elif args.command == "upgrade":
+            await migrator.ensure_schema(auto_migrate=True)
+            print(f"✓ Schema at version {await migrator.current_version()}")
+        elif args.command == "stamp":
+            await migrator.stamp(args.version)
+            print(f"✓ Stamped up to version {await migrator.current_version()}")
+        return 0
+    except Exception as e:
+        print(f"✗ Migration failed: {e}")
+        return 1
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m backend.migrations", description="Database schema migrations")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Show applied and pending migrations")
+    commands.add_parser("upgrade", help="Create missing tables and apply pending migrations")
+    stamp = commands.add_parser("stamp", help="Mark migrations as applied without running them")
+    stamp.add_argument("version", type=int, nargs="?", help="Last version to mark (default: all)")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,9 @@
+"""Add bot_id to conversations (was migrate_add_bot_id.py)"""
+from sqlalchemy import Column, String
+
+VERSION = 1
+NAME = "conversation_bot_id"
+
+
+async def upgrade(m):
+    await m.add_column("conversations", Column("bot_id", String, nullable=True))
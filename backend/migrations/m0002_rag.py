@@ -0,0 +1,15 @@
+"""Add RAG settings to bots (was migrate_add_rag.py)
+
+The documents and document_chunks tables themselves are created from the
+models before migrations run.
+"""
+from sqlalchemy import Boolean, Column, Float, Integer, false
+
+VERSION = 2
+NAME = "rag"
+
+
+async def upgrade(m):
+    await m.add_column("bots", Column("use_rag", Boolean, server_default=false()))
+    await m.add_column("bots", Column("rag_top_k", Integer, server_default="5"))
+    await m.add_column("bots", Column("rag_similarity_threshold", Float, server_default="0.7"))
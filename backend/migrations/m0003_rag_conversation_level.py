@@ -0,0 +1,10 @@
+"""Add conversation- and user-level documents (was migrate_rag_conversation_level.py)"""
+from sqlalchemy import Column, String
+
+VERSION = 3
+NAME = "rag_conversation_level"
+
+
+async def upgrade(m):
+    await m.add_column("documents", Column("conversation_id", String, nullable=True))
+    await m.add_column("documents", Column("user_id", String, nullable=True))
@@ -0,0 +1,43 @@
+"""Make documents.bot_id nullable (was migrate_fix_bot_id_nullable.py)"""
+
+VERSION = 4
+NAME = "documents_bot_id_nullable"
+
+
+async def upgrade(m):
+    column = await m.get_column("documents", "bot_id")
+    if column is None or column["nullable"]:
+        return
+
+    if m.dialect != "sqlite":
+        await m.execute("ALTER TABLE documents ALTER COLUMN bot_id DROP NOT NULL")
+        return
+
+    # SQLite can't alter a column constraint: rebuild the table
+    await m.execute(
+        """
+        CREATE TABLE documents_new (
+            id TEXT PRIMARY KEY,
+            bot_id TEXT,
+            conversation_id TEXT,
+            user_id TEXT,
+            filename TEXT NOT NULL,
+            content TEXT NOT NULL,
+            chunk_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (bot_id) REFERENCES bots(id),
+            FOREIGN KEY (conversation_id) REFERENCES conversations(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+        """,
+        """
+        INSERT INTO documents_new
+        SELECT id, bot_id, conversation_id, user_id, filename, content, chunk_count, created_at
+        FROM documents
+        """,
+        "DROP TABLE documents",
+        "ALTER TABLE documents_new RENAME TO documents",
+        "CREATE INDEX IF NOT EXISTS idx_documents_bot_id ON documents(bot_id)",
+        "CREATE INDEX IF NOT EXISTS idx_documents_conversation_id ON documents(conversation_id)",
+        "CREATE INDEX IF NOT EXISTS idx_documents_user_id ON documents(user_id)"
+    )
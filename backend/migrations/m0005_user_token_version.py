@@ -0,0 +1,10 @@
+"""Add users.token_version for access token revocation (was migrate_add_token_version.py)"""
+from sqlalchemy import Column, Integer
+
+VERSION = 5
+NAME = "user_token_version"
+
+
+async def upgrade(m):
+    # Existing tokens carry no version and count as 0
+    await m.add_column("users", Column("token_version", Integer, nullable=False, server_default="0"))
@@ -0,0 +1,31 @@
+"""Add indexes for the hot query shapes (was migrate_add_indexes.py)"""
+
+VERSION = 6
+NAME = "query_indexes"
+
+# Spelled out rather than read from the models, so later model changes
+# don't change what this migration does. The HNSW index is m0007's.
+INDEXES = (
+    # Bot listing: the user's own bots, then everyone's public ones
+    "CREATE INDEX IF NOT EXISTS ix_bots_creator_active ON bots (creator_id, is_active)",
+    "CREATE INDEX IF NOT EXISTS ix_bots_public_active ON bots (is_public, is_active)",
+    # A user's conversations and the admin listing, newest first
+    "CREATE INDEX IF NOT EXISTS ix_conversations_user_updated ON conversations (user_id, updated_at)",
+    "CREATE INDEX IF NOT EXISTS ix_conversations_updated ON conversations (updated_at)",
+    # Chat history in order
+    "CREATE INDEX IF NOT EXISTS ix_messages_conversation_created ON messages (conversation_id, created_at)",
+    # RAG scopes
+    "CREATE INDEX IF NOT EXISTS idx_documents_bot_id ON documents (bot_id)",
+    "CREATE INDEX IF NOT EXISTS idx_documents_conversation_id ON documents (conversation_id)",
+    "CREATE INDEX IF NOT EXISTS idx_documents_user_id ON documents (user_id)",
+    # Chunks of a document in order (adjacent chunks, reading-flow windows)
+    "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_chunk ON document_chunks (document_id, chunk_index)",
+)
+
+
+async def upgrade(m):
+    await m.execute(*INDEXES)
+
+    # Superseded by ix_document_chunks_document_chunk (document_id, chunk_index);
+    # ANALYZE refreshes planner statistics so the new indexes are used
+    await m.execute("DROP INDEX IF EXISTS idx_document_chunks_document_id", "ANALYZE")
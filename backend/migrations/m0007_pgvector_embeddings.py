@@ -0,0 +1,46 @@
+"""Convert JSON chunk embeddings to a pgvector column (PostgreSQL with pgvector)
+
+Rows are copied into a new vector column in resumable batches while the app
+keeps serving; the columns are swapped at the end.
+"""
+from sqlalchemy import Column
+from backend.config import settings
+from backend.database import USE_PGVECTOR
+from backend.models import DocumentChunk
+
+VERSION = 7
+NAME = "pgvector_embeddings"
+
+HNSW_INDEX = "ix_document_chunks_embedding_hnsw"
+
+
+async def upgrade(m):
+    if not USE_PGVECTOR:
+        return
+    from pgvector.sqlalchemy import Vector
+
+    column = await m.get_column("document_chunks", "embedding")
+    if not isinstance(column["type"], Vector):
+        await m.add_column("document_chunks", Column("embedding_vector", Vector(settings.embedding_dimensions)))
+
+        convert = m.keys_param(
+            "UPDATE document_chunks SET embedding_vector = CAST(CAST(embedding AS TEXT) AS vector) "
+            "WHERE id IN :keys"
+        )
+
+        async def copy_batch(conn, keys):
+            await conn.execute(convert, {"keys": keys})
+
+        await m.backfill("embedding_vector", "document_chunks", copy_batch, where="embedding_vector IS NULL")
+        await m.execute(
+            # Chunks written while the backfill ran
+            "UPDATE document_chunks SET embedding_vector = CAST(CAST(embedding AS TEXT) AS vector) "
+            "WHERE embedding_vector IS NULL",
+            "ALTER TABLE document_chunks DROP COLUMN embedding",
+            "ALTER TABLE document_chunks RENAME COLUMN embedding_vector TO embedding",
+            "ALTER TABLE document_chunks ALTER COLUMN embedding SET NOT NULL"
+        )
+
+    for index in DocumentChunk.__table__.indexes:
+        if index.name == HNSW_INDEX:
+            await m.create_index(index)
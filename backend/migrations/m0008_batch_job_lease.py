@@ -0,0 +1,10 @@
+"""Add batch_jobs.owner and lease_expires_at so each job runs in one worker"""
+from sqlalchemy import Column, DateTime, String
+
+VERSION = 8
+NAME = "batch_job_lease"
+
+
+async def upgrade(m):
+    await m.add_column("batch_jobs", Column("owner", String, nullable=True))
+    await m.add_column("batch_jobs", Column("lease_expires_at", DateTime, nullable=True))
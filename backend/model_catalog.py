@@ -0,0 +1,127 @@
+"""
+Model catalog cache for GET /models
+
+Provider discovery (OpenAI /v1/models, Volcano endpoints, Ollama tags) is slow
+and rarely changes, so the catalog is served from memory. Entries older than
+the TTL are still served while a single background refresh runs
+(stale-while-revalidate); only a cold or badly outdated cache makes a request
+wait. Each snapshot carries an ETag so clients can revalidate cheaply.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import json
+import time
+from backend.config import settings
+from backend.llm_providers import llm_manager
+from backend.logger import get_logger
+from backend.metrics import CACHE_REQUESTS_TOTAL
+
+logger = get_logger(__name__)
+
+Catalog = List[Dict[str, Any]]
+
+
+class ModelCatalog:
+    """TTL cache with stale-while-revalidate and optional periodic refresh"""
+
+    def __init__(
+        self,
+        loader: Callable[[], Awaitable[Catalog]],
+        ttl_seconds: float = 300,
+        max_stale_seconds: float = 3600,
+        background_refresh: bool = True
+    ):
+        self._loader = loader
+        self.ttl_seconds = ttl_seconds
+        self.max_stale_seconds = max_stale_seconds
+        self.background_refresh = background_refresh
+        self._catalog: Optional[Catalog] = None
+        self._etag: Optional[str] = None
+        self._fetched_at = 0.0
+        self._inflight: Optional[asyncio.Task] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _compute_etag(catalog: Catalog) -> str:
+        body = json.dumps(catalog, sort_keys=True, default=str).encode()
+        return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+    async def get(self) -> Tuple[Catalog, str]:
+        """Return (catalog, etag), refreshing according to its age"""
+        age = time.monotonic() - self._fetched_at
+        if self._catalog is None or age > self.ttl_seconds + self.max_stale_seconds:
+            CACHE_REQUESTS_TOTAL.inc(cache="model_catalog", result="miss")
+            await self.refresh()
+        elif age > self.ttl_seconds:
+            CACHE_REQUESTS_TOTAL.inc(cache="model_catalog", result="stale")
+            self._start_refresh()
+        else:
+            CACHE_REQUESTS_TOTAL.inc(cache="model_catalog", result="hit")
+        return self._catalog, self._etag
+
+    def _start_refresh(self) -> asyncio.Task:
+        """Start a refresh unless one is already running (single flight)"""
+        if self._inflight is None or self._inflight.done():
+            self._inflight = asyncio.create_task(self._load())
+        return self._inflight
+
+    async def refresh(self):
+        """Reload the catalog now, joining a refresh already in progress"""
+        # shield: a cancelled request must not abort the refresh other callers wait on
+        await asyncio.shield(self._start_refresh())
+
+    async def _load(self):
+        start = time.perf_counter()
+        try:
+            catalog = await self._loader()
+        except Exception as e:
+            if self._catalog is None:
+                raise
+            logger.warning(f"⚠️ Model catalog refresh failed, serving cached copy: {e}")
+            return
+        self._catalog = catalog
+        self._etag = self._compute_etag(catalog)
+        self._fetched_at = time.monotonic()
+        logger.info(
+            f"📋 Model catalog refreshed in {time.perf_counter() - start:.2f}s",
+            extra={"providers": [p.get("provider") for p in catalog]}
+        )
+
+    def invalidate(self):
+        """Force the next request to reload the catalog"""
+        self._fetched_at = 0.0
+        self._catalog = None
+
+    async def _refresh_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.warning(f"⚠️ Model catalog refresh failed: {e}")
+            await asyncio.sleep(self.ttl_seconds)
+
+    def start(self):
+        """Warm the cache and keep it fresh in the background"""
+        if self.background_refresh and self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for task in (self._refresher, self._inflight):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except (asyncio.CancelledError, Exception):
+                    pass
+        self._refresher = None
+        self._inflight = None
+
+
+# Global model catalog instance
+model_catalog = ModelCatalog(
+    llm_manager.get_available_providers,
+    ttl_seconds=settings.catalog_ttl_seconds,
+    max_stale_seconds=settings.catalog_max_stale_seconds,
+    background_refresh=settings.catalog_background_refresh
+)
@@ -2,6 +2,7 @@
 from sqlalchemy import Column, String, Integer, Boolean, JSON, DateTime
 from backend.database import Base
 from datetime import datetime
+from typing import Optional
 import uuid
 
 
@@ -43,7 +44,7 @@ class ModelPermission(Base):
 
 
 class UserModelUsage(Base):
-    """Track model usage per user for rate limiting"""
+    """Hourly model usage per user, written in batches by backend.rate_limiter"""
     __tablename__ = "user_model_usage"
     
     id = Column(String, primary_key=True, default=generate_uuid)
@@ -62,7 +63,7 @@ class UserModelUsage(Base):
 
 
 async def get_model_permission(db, model_id: str):
-    """Get model permission settings"""
+    """Get model permission settings (from the database, for editing)"""
     from sqlalchemy import select
     
     result = await db.execute(
@@ -71,6 +72,13 @@ async def get_model_permission(db, model_id: str):
     return result.scalar_one_or_none()
 
 
+async def get_cached_model_permission(db, model_id: str):
+    """Get model permission settings from the config cache (read-only)"""
+    from backend.config_cache import config_cache
+    
+    return await config_cache.get_permission(db, model_id)
+
+
 async def create_default_permissions(db, model_id: str, provider: str):
     """Create default permissions for a model"""
     permission = ModelPermission(
@@ -90,15 +98,19 @@ async def create_default_permissions(db, model_id: str, provider: str):
         admin_max_tokens=0,
         is_enabled=True
     )
+    from backend.config_cache import config_cache
+    
     db.add(permission)
+    await config_cache.bump(db)
     await db.commit()
+    config_cache.invalidate()
     await db.refresh(permission)
     return permission
 
 
 async def can_user_access_model(db, user_role: str, model_id: str) -> tuple[bool, str]:
     """Check if user can access a model"""
-    permission = await get_model_permission(db, model_id)
+    permission = await get_cached_model_permission(db, model_id)
     
     if not permission:
         # No permission set, allow by default for non-guests
@@ -120,92 +132,44 @@ async def can_user_access_model(db, user_role: str, model_id: str) -> tuple[bool
     return (True, "")
 
 
-async def check_rate_limit(db, user_id: str, user_role: str, model_id: str) -> tuple[bool, str]:
-    """Check if user has exceeded rate limit for a model"""
-    from sqlalchemy import select
-    from datetime import datetime, timedelta
+async def acquire_rate_limit(
+    db, user_id: str, user_role: str, model_id: str, scope: Optional[str] = None
+) -> tuple[bool, str]:
+    """Count a request against the user's hourly limit for a model, refusing it if exceeded"""
+    from backend.rate_limiter import rate_limiter
     
-    permission = await get_model_permission(db, model_id)
-    if not permission:
-        return (True, "")  # No limits if not configured
+    permission = await get_cached_model_permission(db, model_id)
     
-    # Get rate limit for user role
+    # Get rate limit for user role (no limits if not configured)
     rate_limit = 0
-    if user_role == "guest":
-        rate_limit = permission.guest_rate_limit
-    elif user_role == "free":
-        rate_limit = permission.free_rate_limit
-    elif user_role == "premium":
-        rate_limit = permission.premium_rate_limit
-    elif user_role == "admin":
-        rate_limit = permission.admin_rate_limit
-    
-    # 0 means unlimited
-    if rate_limit == 0:
-        return (True, "")
-    
-    # Get or create usage record
-    result = await db.execute(
-        select(UserModelUsage).where(
-            UserModelUsage.user_id == user_id,
-            UserModelUsage.model_id == model_id
-        )
-    )
-    usage = result.scalar_one_or_none()
-    
-    now = datetime.utcnow()
-    current_hour = now.replace(minute=0, second=0, microsecond=0)
-    
-    if not usage:
-        # Create new usage record
-        usage = UserModelUsage(
-            user_id=user_id,
-            model_id=model_id,
-            requests_this_hour=0,
-            hour_start=current_hour
-        )
-        db.add(usage)
-        await db.commit()
-        await db.refresh(usage)
-    
-    # Check if we need to reset the counter
-    usage_hour = usage.hour_start
-    if usage_hour < current_hour:
-        usage.requests_this_hour = 0
-        usage.hour_start = current_hour
-        await db.commit()
-    
-    # Check rate limit
-    if usage.requests_this_hour >= rate_limit:
+    if permission:
+        if user_role == "guest":
+            rate_limit = permission.guest_rate_limit
+        elif user_role == "free":
+            rate_limit = permission.free_rate_limit
+        elif user_role == "premium":
+            rate_limit = permission.premium_rate_limit
+        elif user_role == "admin":
+            rate_limit = permission.admin_rate_limit
+    
+    # Requests over the last hour (sliding window); 0 means unlimited but still counts for reporting
+    if not await rate_limiter.acquire(user_id, model_id, rate_limit, scope):
         return (False, f"Rate limit exceeded. Limit: {rate_limit} requests/hour")
     
     return (True, "")
 
 
 async def increment_usage(db, user_id: str, model_id: str, tokens: int = 0):
-    """Increment usage counter for a user and model"""
-    from sqlalchemy import select
-    from datetime import datetime
-    
-    result = await db.execute(
-        select(UserModelUsage).where(
-            UserModelUsage.user_id == user_id,
-            UserModelUsage.model_id == model_id
-        )
-    )
-    usage = result.scalar_one_or_none()
+    """Add a finished request's tokens to the user's usage for a model"""
+    from backend.rate_limiter import rate_limiter
     
-    if usage:
-        usage.requests_this_hour += 1
-        usage.tokens_this_hour += tokens
-        usage.last_request_time = datetime.utcnow()
-        usage.updated_at = datetime.utcnow()
-        await db.commit()
+    # Persisted to user_model_usage in batches by the rate limiter
+    await rate_limiter.record(user_id, model_id, tokens)
 
 
 async def get_max_tokens_for_user(db, user_role: str, model_id: str) -> int:
     """Get max tokens allowed for user role and model"""
-    permission = await get_model_permission(db, model_id)
+    permission = await get_cached_model_permission(db, model_id)
     
     if not permission:
         return 0  # 0 = use model default
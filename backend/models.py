@@ -1,7 +1,8 @@
-from sqlalchemy import Column, String, Text, DateTime, Integer, JSON, ForeignKey, Boolean, Float
+from sqlalchemy import Column, String, Text, DateTime, Integer, JSON, ForeignKey, Boolean, Float, Index
 from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
-from backend.database import Base
+from backend.config import settings
+from backend.database import Base, USE_PGVECTOR
 import uuid
 
 
@@ -9,6 +10,14 @@ def generate_uuid():
     return str(uuid.uuid4())
 
 
+def _embedding_type():
+    """pgvector column on PostgreSQL, JSON array elsewhere"""
+    if USE_PGVECTOR:
+        from pgvector.sqlalchemy import Vector
+        return Vector(settings.embedding_dimensions)
+    return JSON
+
+
 class User(Base):
     __tablename__ = "users"
     
@@ -23,6 +32,7 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     last_login = Column(DateTime, nullable=True)
+    token_version = Column(Integer, default=0, nullable=False)  # Raised to revoke issued access tokens
     
     # Usage limits
     daily_message_limit = Column(Integer, default=50)
@@ -75,6 +85,12 @@ class Bot(Base):
     # Relationships
     creator = relationship("User", back_populates="bots")
     conversations = relationship("Conversation", back_populates="bot", cascade="all, delete-orphan")
+    
+    # Bot listing: the user's own bots, then everyone's public ones
+    __table_args__ = (
+        Index("ix_bots_creator_active", "creator_id", "is_active"),
+        Index("ix_bots_public_active", "is_public", "is_active"),
+    )
 
 
 class Conversation(Base):
@@ -90,6 +106,12 @@ class Conversation(Base):
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
     user = relationship("User", backref="conversations")
     bot = relationship("Bot", back_populates="conversations")
+    
+    # Conversation listing, newest first (per user and overall)
+    __table_args__ = (
+        Index("ix_conversations_user_updated", "user_id", "updated_at"),
+        Index("ix_conversations_updated", "updated_at"),
+    )
 
 
 class Message(Base):
@@ -105,6 +127,11 @@ class Message(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     conversation = relationship("Conversation", back_populates="messages")
+    
+    # A conversation's history in order, read on every chat turn
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
 
 
 class AgentExecution(Base):
@@ -138,6 +165,13 @@ class Document(Base):
     conversation = relationship("Conversation", backref="documents")
     user = relationship("User", backref="documents")
     chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+    
+    # Retrieval scope (bot OR conversation OR user); names match the old migrate_*.py indexes
+    __table_args__ = (
+        Index("idx_documents_bot_id", "bot_id"),
+        Index("idx_documents_conversation_id", "conversation_id"),
+        Index("idx_documents_user_id", "user_id"),
+    )
 
 
 class DocumentChunk(Base):
@@ -148,10 +182,90 @@ class DocumentChunk(Base):
     document_id = Column(String, ForeignKey("documents.id"), nullable=False)
     chunk_index = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)
-    embedding = Column(JSON, nullable=False)  # Store as JSON array
+    embedding = Column(_embedding_type(), nullable=False)  # JSON array, or pgvector on PostgreSQL
     start_char = Column(Integer, nullable=False)
     end_char = Column(Integer, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     document = relationship("Document", back_populates="chunks")
+    
+    __table_args__ = (
+        # Chunks of a document in order (adjacent chunks, reading-flow windows)
+        Index("ix_document_chunks_document_chunk", "document_id", "chunk_index"),
+        # Approximate nearest-neighbour index for cosine distance (pgvector only)
+        *([Index(
+            "ix_document_chunks_embedding_hnsw",
+            "embedding",
+            postgresql_using="hnsw",
+            postgresql_with={"m": settings.pgvector_hnsw_m, "ef_construction": settings.pgvector_hnsw_ef_construction},
+            postgresql_ops={"embedding": "vector_cosine_ops"}
+        )] if USE_PGVECTOR else []),
+    )
+
+
+class LLMUsage(Base):
+    """Aggregated LLM token usage, written in batches by backend.usage"""
+    __tablename__ = "llm_usage"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    period_start = Column(DateTime, nullable=False, index=True)  # Hour the calls were made in (UTC)
+    user_id = Column(String, nullable=True, index=True)
+    provider = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    requests = Column(Integer, default=0)
+    prompt_tokens = Column(Integer, default=0)
+    completion_tokens = Column(Integer, default=0)  # Includes reasoning tokens
+    reasoning_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)  # Prompt tokens served from provider prompt caches
+    estimated_requests = Column(Integer, default=0)  # Calls whose usage was estimated locally
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BatchJob(Base):
+    """Bulk LLM job submitted by an admin, executed by backend.batch_jobs"""
+    __tablename__ = "batch_jobs"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    created_by = Column(String, ForeignKey("users.id"), nullable=True, index=True)
+    name = Column(String, nullable=True)
+    provider = Column(String, nullable=False)
+    model = Column(String, nullable=False)
+    mode = Column(String, default="direct")  # direct (our own workers) or provider (e.g. OpenAI Batch)
+    params = Column(JSON, nullable=True)  # temperature, max_tokens
+    status = Column(String, default="pending", index=True)  # pending, running, completed, failed, cancelled
+    total_items = Column(Integer, default=0)
+    completed_items = Column(Integer, default=0)
+    failed_items = Column(Integer, default=0)
+    provider_batch_id = Column(String, nullable=True)  # Id of the provider-side batch in provider mode
+    owner = Column(String, nullable=True)  # Worker running the job
+    lease_expires_at = Column(DateTime, nullable=True)  # Until when the owner's claim holds
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+
+class BatchItem(Base):
+    """One prompt of a batch job and, once it has run, its result"""
+    __tablename__ = "batch_items"
+    
+    id = Column(String, primary_key=True, default=generate_uuid)
+    job_id = Column(String, ForeignKey("batch_jobs.id"), nullable=False, index=True)
+    custom_id = Column(String, nullable=True)  # Caller's reference, echoed back in results
+    messages = Column(JSON, nullable=False)
+    status = Column(String, default="pending", index=True)  # pending, completed, failed
+    response = Column(Text, nullable=True)
+    usage = Column(JSON, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+
+class CacheVersion(Base):
+    """Version counters that let every worker detect changes to cached data"""
+    __tablename__ = "cache_versions"
+    
+    name = Column(String, primary_key=True)  # e.g. "config" for settings and model permissions
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,286 @@
+"""
+Per-user, per-model request rate limiting
+
+Limits are enforced against sliding-window counters held in memory instead
+of reading and committing a user_model_usage row on every request. Each key
+keeps the count of the current and the previous fixed window; the estimate
+weights the previous window by how much of it still overlaps the sliding
+window, which removes the 2x burst a fixed hour boundary allows.
+
+With RATE_LIMIT_BACKEND=redis the counters live in a Redis-compatible server
+so several workers share them (needs the optional redis package). Recorded
+requests are also aggregated and written to user_model_usage in batches for
+reporting.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+import asyncio
+import time
+from backend.config import settings
+from backend.logger import get_logger
+
+logger = get_logger(__name__)
+
+# (user_id, model_id)
+LimitKey = Tuple[str, str]
+
+
+@dataclass
+class _Window:
+    start: float
+    current: int = 0
+    previous: int = 0
+
+
+class MemoryRateLimitBackend:
+    """Sliding-window counters for a single worker process"""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self._windows: Dict[str, _Window] = {}
+
+    def _window(self, key: str, now: float) -> _Window:
+        start = now - now % self.window_seconds
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = _Window(start)
+        elif window.start < start:
+            # Roll forward; the previous count only survives if it is the adjacent window
+            window.previous = window.current if start - window.start == self.window_seconds else 0
+            window.current = 0
+            window.start = start
+        return window
+
+    async def count(self, key: str, now: float) -> float:
+        window = self._window(key, now)
+        overlap = 1.0 - (now - window.start) / self.window_seconds
+        return window.previous * overlap + window.current
+
+    async def add(self, key: str, now: float, amount: int = 1):
+        self._window(key, now).current += amount
+
+    async def acquire(self, key: str, now: float, limit: int) -> bool:
+        # No await between the check and the increment, so this is atomic per process
+        window = self._window(key, now)
+        overlap = 1.0 - (now - window.start) / self.window_seconds
+        if window.previous * overlap + window.current >= limit:
+            return False
+        window.current += 1
+        return True
+
+    def prune(self, now: float):
+        """Forget keys with no requests in the last two windows"""
+        horizon = now - 2 * self.window_seconds
+        for key in [key for key, window in self._windows.items() if window.start <= horizon]:
+            del self._windows[key]
+
+
+class RedisRateLimitBackend:
+    """Sliding-window counters shared by all workers through Redis"""
+
+    def __init__(self, url: str, window_seconds: float, prefix: str = "midas:ratelimit"):
+        import redis.asyncio as redis  # Optional dependency
+
+        self.window_seconds = window_seconds
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+
+    def _keys(self, key: str, now: float) -> Tuple[str, str, float]:
+        index = int(now // self.window_seconds)
+        return f"{self.prefix}:{key}:{index}", f"{self.prefix}:{key}:{index - 1}", index * self.window_seconds
+
+    async def count(self, key: str, now: float) -> float:
+        current_key, previous_key, start = self._keys(key, now)
+        current, previous = await self._redis.mget(current_key, previous_key)
+        overlap = 1.0 - (now - start) / self.window_seconds
+        return int(previous or 0) * overlap + int(current or 0)
+
+    async def add(self, key: str, now: float, amount: int = 1):
+        current_key, _, _ = self._keys(key, now)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.incrby(current_key, amount)
+            pipe.expire(current_key, int(2 * self.window_seconds) + 60)
+            await pipe.execute()
+
+    async def acquire(self, key: str, now: float, limit: int) -> bool:
+        # INCR first and compare after, so two workers can't both take the last slot
+        current_key, previous_key, start = self._keys(key, now)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.incr(current_key)
+            pipe.expire(current_key, int(2 * self.window_seconds) + 60)
+            pipe.get(previous_key)
+            current, _, previous = await pipe.execute()
+        overlap = 1.0 - (now - start) / self.window_seconds
+        if int(previous or 0) * overlap + current - 1 >= limit:
+            await self._redis.decr(current_key)  # Refused requests don't count
+            return False
+        return True
+
+    def prune(self, now: float):
+        pass  # Keys expire on their own
+
+    async def close(self):
+        await self._redis.close()
+
+
+class RateLimiter:
+    """Enforces request limits in memory and persists usage in batches"""
+
+    def __init__(
+        self,
+        backend: str = "memory",
+        redis_url: str = "",
+        window_seconds: float = 3600,
+        flush_interval: float = 60.0
+    ):
+        self.window_seconds = window_seconds
+        self.flush_interval = flush_interval
+        self._fallback = MemoryRateLimitBackend(window_seconds)
+        self.backend = self._fallback
+        if backend == "redis":
+            try:
+                self.backend = RedisRateLimitBackend(redis_url, window_seconds)
+            except ImportError:
+                logger.warning("⚠️ RATE_LIMIT_BACKEND=redis but the redis package is not installed, using memory")
+        # (user_id, model_id) -> [requests, tokens] not yet written to user_model_usage
+        self._pending: Dict[LimitKey, list] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(user_id: str, model_id: str) -> str:
+        return f"{user_id}:{model_id}"
+
+    async def _call(self, method: str, *args):
+        """Run a backend call; a shared backend that is down falls back to local counters"""
+        try:
+            return await getattr(self.backend, method)(*args)
+        except Exception as e:
+            if self.backend is self._fallback:
+                raise
+            logger.warning(f"⚠️ Rate limit backend error, using local counters: {e}")
+            return await getattr(self._fallback, method)(*args)
+
+    async def check(self, user_id: str, model_id: str, limit: int) -> bool:
+        """True while the user's requests in the sliding window are below limit (0 = unlimited)"""
+        if limit <= 0:
+            return True
+        count = await self._call("count", self._key(user_id, model_id), time.time())
+        return count < limit
+
+    async def acquire(self, user_id: str, model_id: str, limit: int, scope: Optional[str] = None) -> bool:
+        """Count one request against the limit (0 = unlimited); False if the window is full
+
+        Checking and counting is a single step, and the request counts from the
+        moment it is admitted, whether it later fails or is cancelled. scope
+        makes several users share one window (guests from the same address).
+        """
+        if limit > 0 and not await self._call("acquire", self._key(scope or user_id, model_id), time.time(), limit):
+            return False
+        self._pending.setdefault((user_id, model_id), [0, 0])[0] += 1
+        return True
+
+    async def record(self, user_id: str, model_id: str, tokens: int = 0):
+        """Add a finished request's tokens to the usage report (acquire() counted the request)"""
+        self._pending.setdefault((user_id, model_id), [0, 0])[1] += tokens
+
+    async def flush(self):
+        """Write aggregated request counts to user_model_usage"""
+        async with self._flush_lock:
+            self.backend.prune(time.time())
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                await self._write(pending)
+            except Exception as e:
+                logger.warning(f"⚠️ Rate limit usage flush failed, keeping {len(pending)} rows: {e}")
+                for key, (requests, tokens) in pending.items():
+                    merged = self._pending.setdefault(key, [0, 0])
+                    merged[0] += requests
+                    merged[1] += tokens
+
+    async def _write(self, pending: Dict[LimitKey, list]):
+        from sqlalchemy import bindparam, case, insert, select, update
+        from backend.db_writer import db_writer
+        from backend.model_permissions import UserModelUsage
+
+        now = datetime.utcnow()
+        hour = now.replace(minute=0, second=0, microsecond=0)
+        table = UserModelUsage.__table__
+
+        async def write(session):
+            user_ids = {user_id for user_id, _ in pending}
+            existing = set((await session.execute(
+                select(table.c.user_id, table.c.model_id).where(table.c.user_id.in_(user_ids))
+            )).all())
+
+            new_rows = [
+                {"user_id": user_id, "model_id": model_id, "requests_this_hour": requests,
+                 "tokens_this_hour": tokens, "last_request_time": now, "hour_start": hour}
+                for (user_id, model_id), (requests, tokens) in pending.items()
+                if (user_id, model_id) not in existing
+            ]
+            updates = [
+                {"b_user": user_id, "b_model": model_id, "b_requests": requests, "b_tokens": tokens}
+                for (user_id, model_id), (requests, tokens) in pending.items()
+                if (user_id, model_id) in existing
+            ]
+            if new_rows:
+                await session.execute(insert(UserModelUsage), new_rows)
+            if updates:
+                # Rows from an earlier hour start over
+                stale = table.c.hour_start < hour
+                await session.execute(
+                    update(table)
+                    .where(table.c.user_id == bindparam("b_user"), table.c.model_id == bindparam("b_model"))
+                    .values(
+                        requests_this_hour=case(
+                            (stale, bindparam("b_requests")),
+                            else_=table.c.requests_this_hour + bindparam("b_requests")
+                        ),
+                        tokens_this_hour=case(
+                            (stale, bindparam("b_tokens")),
+                            else_=table.c.tokens_this_hour + bindparam("b_tokens")
+                        ),
+                        hour_start=hour,
+                        last_request_time=now,
+                        updated_at=now
+                    ),
+                    updates
+                )
+
+        await db_writer.run(write)
+        logger.debug(f"📊 Flushed rate limit usage for {len(pending)} user/model pairs")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the periodic flush and write whatever is still pending"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        if isinstance(self.backend, RedisRateLimitBackend):
+            await self.backend.close()
+
+
+# Global rate limiter instance
+rate_limiter = RateLimiter(
+    backend=settings.rate_limit_backend,
+    redis_url=settings.rate_limit_redis_url,
+    window_seconds=settings.rate_limit_window_seconds,
+    flush_interval=settings.rate_limit_flush_interval_seconds
+)
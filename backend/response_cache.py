@@ -0,0 +1,270 @@
+"""
+Response cache for repeatable LLM (and translation) calls
+
+Call sites opt in by name ("title", "suggestions", "deep_research", ...) and
+each site has its own TTL and size bound. Lookups go to an exact-match tier in
+a local SQLite file keyed by provider, model, normalised messages and
+parameters. Sites marked semantic can also reuse an answer whose prompt embeds
+within a similarity threshold of the new one.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import re
+import time
+import aiosqlite
+import numpy as np
+from backend.config import settings
+from backend.logger import get_logger
+from backend.metrics import CACHE_REQUESTS_TOTAL
+
+logger = get_logger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS response_cache (
+    key TEXT PRIMARY KEY,
+    site TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    value TEXT NOT NULL,
+    embedding BLOB,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_hit REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_response_cache_site_scope ON response_cache (site, scope, expires_at);
+CREATE INDEX IF NOT EXISTS ix_response_cache_site_last_hit ON response_cache (site, last_hit);
+"""
+
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Collapse whitespace so trivially different prompts share a key"""
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = _WHITESPACE.sub(" ", content).strip()
+        normalized.append({"role": message.get("role"), "content": content})
+    return normalized
+
+
+def _digest(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _encode_embedding(vector: List[float]) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def _decode_embedding(stored) -> np.ndarray:
+    # Entries written before embeddings were stored as float32 blobs hold JSON text
+    if isinstance(stored, str):
+        return np.array(json.loads(stored), dtype=np.float32)
+    return np.frombuffer(stored, dtype=np.float32)
+
+
+def _best_match(embeddings: List[Any], query: List[float]) -> tuple:
+    """Index and cosine similarity of the stored embedding closest to query"""
+    matrix = np.stack([_decode_embedding(stored) for stored in embeddings])
+    vector = np.asarray(query, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(vector) or 1.0)
+    similarities = matrix @ vector / np.where(norms == 0, 1.0, norms)
+    best = int(np.argmax(similarities))
+    return best, float(similarities[best])
+
+
+def _messages_text(messages: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"{m['role']}: {m['content']}" for m in messages if isinstance(m.get("content"), str)
+    )
+
+
+class ResponseCache:
+    """Per-site exact and semantic cache backed by SQLite"""
+
+    def __init__(
+        self,
+        path: str,
+        sites: Dict[str, Dict[str, Any]],
+        enabled: bool = True,
+        semantic_enabled: bool = False,
+        similarity_threshold: float = 0.97
+    ):
+        self.path = path
+        self.sites = sites
+        self.enabled = enabled
+        self.semantic_enabled = semantic_enabled
+        self.similarity_threshold = similarity_threshold
+        self._db: Optional[aiosqlite.Connection] = None
+        self._init_lock = asyncio.Lock()
+
+    def policy(self, site: str) -> Optional[Dict[str, Any]]:
+        return self.sites.get(site) if self.enabled else None
+
+    async def _conn(self) -> aiosqlite.Connection:
+        if self._db is None:
+            async with self._init_lock:
+                if self._db is None:
+                    db = await aiosqlite.connect(self.path)
+                    await db.executescript(SCHEMA)
+                    await db.commit()
+                    self._db = db
+        return self._db
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def _embed(self, text: str) -> Optional[List[float]]:
+        from backend.embeddings import embedding_provider
+        try:
+            return await embedding_provider.embed_text(text[:8000])
+        except Exception as e:
+            logger.debug(f"Semantic cache embedding failed: {e}")
+            return None
+
+    async def get(self, site: str, key: str, scope: str, semantic_text: Optional[str] = None) -> Optional[Any]:
+        """Look up a cached value; semantic_text enables the similarity tier for semantic sites"""
+        policy = self.policy(site)
+        if policy is None:
+            return None
+        db = await self._conn()
+        now = time.time()
+
+        async with db.execute(
+            "SELECT value FROM response_cache WHERE key = ? AND expires_at > ?", (key, now)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is not None:
+            await db.execute("UPDATE response_cache SET last_hit = ? WHERE key = ?", (now, key))
+            await db.commit()
+            CACHE_REQUESTS_TOTAL.inc(cache=f"llm:{site}", result="hit")
+            return json.loads(row[0])
+
+        if semantic_text and policy.get("semantic") and self.semantic_enabled:
+            value = await self._semantic_lookup(db, site, scope, semantic_text, now)
+            if value is not None:
+                CACHE_REQUESTS_TOTAL.inc(cache=f"llm:{site}", result="semantic_hit")
+                return value
+
+        CACHE_REQUESTS_TOTAL.inc(cache=f"llm:{site}", result="miss")
+        return None
+
+    async def _semantic_lookup(self, db, site: str, scope: str, text: str, now: float) -> Optional[Any]:
+        query = await self._embed(text)
+        if query is None:
+            return None
+        async with db.execute(
+            "SELECT key, embedding FROM response_cache "
+            "WHERE site = ? AND scope = ? AND expires_at > ? AND embedding IS NOT NULL",
+            (site, scope, now)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return None
+
+        # Thousands of vectors: decode and compare off the event loop
+        best, similarity = await asyncio.to_thread(_best_match, [row[1] for row in rows], query)
+        if similarity < self.similarity_threshold:
+            return None
+        key = rows[best][0]
+        async with db.execute("SELECT value FROM response_cache WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        await db.execute("UPDATE response_cache SET last_hit = ? WHERE key = ?", (now, key))
+        await db.commit()
+        return json.loads(row[0])
+
+    async def set(self, site: str, key: str, scope: str, value: Any, semantic_text: Optional[str] = None):
+        policy = self.policy(site)
+        if policy is None:
+            return
+        db = await self._conn()
+        now = time.time()
+        embedding = None
+        if semantic_text and policy.get("semantic") and self.semantic_enabled:
+            vector = await self._embed(semantic_text)
+            embedding = _encode_embedding(vector) if vector else None
+
+        await db.execute(
+            "INSERT OR REPLACE INTO response_cache "
+            "(key, site, scope, value, embedding, created_at, expires_at, last_hit) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, site, scope, json.dumps(value, default=str), embedding, now, now + policy["ttl"], now)
+        )
+        # Enforce the site's bound: expired rows first, then least recently used
+        await db.execute("DELETE FROM response_cache WHERE site = ? AND expires_at <= ?", (site, now))
+        await db.execute(
+            "DELETE FROM response_cache WHERE key IN ("
+            "SELECT key FROM response_cache WHERE site = ? ORDER BY last_hit DESC LIMIT -1 OFFSET ?)",
+            (site, int(policy.get("max_entries", 1000)))
+        )
+        await db.commit()
+
+    async def cached(
+        self,
+        site: str,
+        key_parts: Dict[str, Any],
+        compute: Callable[[], Awaitable[Any]],
+        semantic_text: Optional[str] = None
+    ) -> Any:
+        """
+        Return the cached value for key_parts or compute and store it
+
+        key_parts must identify the request completely (provider, model,
+        messages, parameters). Cache failures never fail the call.
+        """
+        if self.policy(site) is None:
+            return await compute()
+
+        key = _digest({"site": site, **key_parts})
+        # Semantic matches must agree on everything except the prompt text
+        scope = _digest({k: v for k, v in key_parts.items() if k != "messages"})
+        try:
+            value = await self.get(site, key, scope, semantic_text)
+        except Exception as e:
+            logger.warning(f"⚠️ Response cache lookup failed: {e}")
+            value = None
+        if value is not None:
+            return value
+
+        value = await compute()
+        try:
+            await self.set(site, key, scope, value, semantic_text)
+        except Exception as e:
+            logger.warning(f"⚠️ Response cache write failed: {e}")
+        return value
+
+    async def chat(
+        self,
+        site: str,
+        provider: str,
+        model: str,
+        messages: List[Dict[str, Any]],
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Cached resilient_llm.chat for call sites whose answers can be reused"""
+        from backend.llm_resilience import resilient_llm
+
+        normalized = normalize_messages(messages)
+        params = {k: v for k, v in kwargs.items() if k not in ("hedge", "fallbacks")}
+        return await self.cached(
+            site,
+            {"provider": provider, "model": model, "messages": normalized, "params": params},
+            lambda: resilient_llm.chat(provider, model, messages, **kwargs),
+            semantic_text=_messages_text(normalized)
+        )
+
+
+# Global response cache instance
+response_cache = ResponseCache(
+    settings.response_cache_path,
+    settings.response_cache_sites,
+    enabled=settings.response_cache_enabled,
+    semantic_enabled=settings.response_cache_semantic,
+    similarity_threshold=settings.response_cache_similarity_threshold
+)
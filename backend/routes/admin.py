@@ -2,16 +2,22 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, desc
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List
-from backend.database import get_db
-from backend.models import User, Conversation, Message
+from typing import Any, Dict, Optional, List
+from backend.database import get_db, get_read_db
+from backend.models import User, Conversation, Message, LLMUsage, BatchJob, BatchItem
 from backend.model_permissions import (
     ModelPermission, get_model_permission, create_default_permissions
 )
-from backend.auth import require_admin, get_password_hash
+from backend.auth import require_admin, get_password_hash_async, revoke_tokens
 from backend.settings_manager import get_all_settings, set_setting
+from backend.tracing import tracer
+from backend.user_cache import user_cache
+from backend.config_cache import config_cache
+from backend.batch_jobs import batch_runner
+from backend.config import settings
+import asyncio
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -34,6 +40,21 @@ class UserCreate(BaseModel):
     role: str = "free"
 
 
+class BatchPrompt(BaseModel):
+    messages: List[Dict[str, Any]]
+    custom_id: Optional[str] = None
+
+
+class BatchJobCreate(BaseModel):
+    provider: str
+    model: str
+    items: List[BatchPrompt]
+    mode: str = "auto"  # auto, direct or provider (provider batch endpoint, e.g. OpenAI Batch)
+    temperature: float = 0.7
+    max_tokens: Optional[int] = None
+    name: Optional[str] = None
+
+
 class ModelPermissionUpdate(BaseModel):
     visible_to_guest: Optional[bool] = None
     visible_to_free: Optional[bool] = None
@@ -107,7 +128,7 @@ async def update_setting(
 @router.get("/stats")
 async def get_stats(
     admin_user: User = Depends(require_admin),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get system statistics (admin only)"""
     # User stats
@@ -156,6 +177,186 @@ async def get_stats(
     }
 
 
+@router.get("/usage")
+async def get_usage(
+    hours: int = 24,
+    admin_user: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Token usage per provider and model over the last `hours` hours (admin only)"""
+    since = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours)
+    result = await db.execute(
+        select(
+            LLMUsage.provider,
+            LLMUsage.model,
+            func.sum(LLMUsage.requests),
+            func.sum(LLMUsage.prompt_tokens),
+            func.sum(LLMUsage.completion_tokens),
+            func.sum(LLMUsage.reasoning_tokens),
+            func.sum(LLMUsage.cached_tokens),
+            func.sum(LLMUsage.estimated_requests)
+        )
+        .where(LLMUsage.period_start >= since)
+        .group_by(LLMUsage.provider, LLMUsage.model)
+        .order_by(desc(func.sum(LLMUsage.prompt_tokens + LLMUsage.completion_tokens)))
+    )
+    
+    return {
+        "since": since.isoformat(),
+        "models": [
+            {
+                "provider": provider,
+                "model": model,
+                "requests": requests,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "reasoning_tokens": reasoning_tokens,
+                "cached_tokens": cached_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                # Share of prompt tokens served from provider prompt caches
+                "prompt_cache_hit_ratio": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else 0.0,
+                "estimated_requests": estimated_requests
+            }
+            for provider, model, requests, prompt_tokens, completion_tokens, reasoning_tokens, cached_tokens, estimated_requests in result.all()
+        ]
+    }
+
+
+@router.get("/traces/{message_id}")
+async def get_message_trace(
+    message_id: str,
+    admin_user: User = Depends(require_admin)
+):
+    """Get the trace recorded for the chat turn that produced a message (admin only)"""
+    trace = await asyncio.to_thread(tracer.get_trace, message_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
+
+
+def _batch_job_dict(job: BatchJob) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "name": job.name,
+        "provider": job.provider,
+        "model": job.model,
+        "mode": job.mode,
+        "status": job.status,
+        "total_items": job.total_items,
+        "completed_items": job.completed_items,
+        "failed_items": job.failed_items,
+        "provider_batch_id": job.provider_batch_id,
+        "error": job.error,
+        "created_by": job.created_by,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "completed_at": job.completed_at.isoformat() if job.completed_at else None
+    }
+
+
+@router.post("/batch")
+async def create_batch_job(
+    request: BatchJobCreate,
+    admin_user: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """Queue many prompts for one provider/model as a background batch job (admin only)"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No prompts in batch")
+    if len(request.items) > settings.batch_max_items:
+        raise HTTPException(status_code=400, detail=f"Batch exceeds {settings.batch_max_items} prompts")
+    
+    try:
+        job = await batch_runner.submit(
+            db,
+            admin_user.id,
+            request.provider,
+            request.model,
+            [item.model_dump() for item in request.items],
+            mode=request.mode,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens,
+            name=request.name
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return _batch_job_dict(job)
+
+
+@router.get("/batch")
+async def list_batch_jobs(
+    skip: int = 0,
+    limit: int = 50,
+    admin_user: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """List batch jobs, newest first (admin only)"""
+    result = await db.execute(
+        select(BatchJob).order_by(desc(BatchJob.created_at)).offset(skip).limit(limit)
+    )
+    return [_batch_job_dict(job) for job in result.scalars().all()]
+
+
+@router.get("/batch/{job_id}")
+async def get_batch_job(
+    job_id: str,
+    admin_user: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """Get a batch job and its progress (admin only)"""
+    job = await db.get(BatchJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return _batch_job_dict(job)
+
+
+@router.get("/batch/{job_id}/results")
+async def get_batch_results(
+    job_id: str,
+    status: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    admin_user: User = Depends(require_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """Results of a batch job; available for each prompt as soon as it completes (admin only)"""
+    job = await db.get(BatchJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    
+    query = select(BatchItem).where(BatchItem.job_id == job_id)
+    if status:
+        query = query.where(BatchItem.status == status)
+    result = await db.execute(query.order_by(BatchItem.created_at, BatchItem.id).offset(skip).limit(limit))
+    
+    return {
+        "job": _batch_job_dict(job),
+        "results": [
+            {
+                "id": item.id,
+                "custom_id": item.custom_id,
+                "status": item.status,
+                "response": item.response,
+                "usage": item.usage,
+                "error": item.error,
+                "completed_at": item.completed_at.isoformat() if item.completed_at else None
+            }
+            for item in result.scalars().all()
+        ]
+    }
+
+
+@router.post("/batch/{job_id}/cancel")
+async def cancel_batch_job(
+    job_id: str,
+    admin_user: User = Depends(require_admin)
+):
+    """Cancel a pending or running batch job; completed results are kept (admin only)"""
+    if not await batch_runner.cancel(job_id):
+        raise HTTPException(status_code=404, detail="No active batch job with that id")
+    return {"message": "Batch job cancelled"}
+
+
 @router.get("/users")
 async def list_users(
     skip: int = 0,
@@ -253,7 +454,7 @@ async def create_user(
     new_user = User(
         username=user_data.username,
         email=user_data.email,
-        hashed_password=get_password_hash(user_data.password),
+        hashed_password=await get_password_hash_async(user_data.password),
         role=user_data.role,
         is_active=True,
         is_guest=False
@@ -302,6 +503,8 @@ async def update_user(
         user.role = user_update.role
     
     if user_update.is_active is not None:
+        if user.is_active and not user_update.is_active:
+            revoke_tokens(user)
         user.is_active = user_update.is_active
     
     if user_update.email is not None:
@@ -314,6 +517,7 @@ async def update_user(
         user.email = user_update.email
     
     await db.commit()
+    user_cache.invalidate(user.id)
     await db.refresh(user)
     
     return {
@@ -346,6 +550,7 @@ async def delete_user(
     # Delete user's conversations and messages (cascade should handle this)
     await db.delete(user)
     await db.commit()
+    user_cache.invalidate(user_id)
     
     return {"message": "User deleted successfully"}
 
@@ -391,9 +596,11 @@ async def bulk_create_permissions(
     db: AsyncSession = Depends(get_db)
 ):
     """Create permissions for all available models (admin only)"""
-    from backend.llm_providers import llm_manager
+    from backend.model_catalog import model_catalog
     
-    providers = await llm_manager.get_available_providers()
+    # Admins expect newly added models to show up, so bypass the TTL
+    await model_catalog.refresh()
+    providers, _ = await model_catalog.get()
     created_count = 0
     
     for provider in providers:
@@ -487,7 +694,9 @@ async def update_model_permission(
         setattr(permission, field, value)
     
     permission.updated_at = datetime.utcnow()
+    await config_cache.bump(db)
     await db.commit()
+    config_cache.invalidate()
     await db.refresh(permission)
     
     return {
@@ -510,6 +719,8 @@ async def delete_model_permission(
         raise HTTPException(status_code=404, detail="Model permission not found")
     
     await db.delete(permission)
+    await config_cache.bump(db)
     await db.commit()
+    config_cache.invalidate()
     
     return {"message": "Model permission deleted successfully"}
@@ -7,13 +7,15 @@ from datetime import datetime
 from backend.database import get_db
 from backend.models import User
 from backend.auth import (
-    get_password_hash,
-    verify_password,
-    create_access_token,
+    get_password_hash_async,
+    verify_and_update_password,
+    create_user_token,
+    revoke_tokens,
     get_current_user,
     get_current_active_user,
     require_admin
 )
+from backend.user_cache import user_cache
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -80,7 +82,7 @@ async def register(user_data: UserRegister, db: AsyncSession = Depends(get_db)):
     is_first_user = existing_any.scalar_one_or_none() is None
 
     # Create new user
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     new_user = User(
         email=user_data.email,
         username=user_data.username,
@@ -94,7 +96,7 @@ async def register(user_data: UserRegister, db: AsyncSession = Depends(get_db)):
     await db.refresh(new_user)
     
     # Create access token
-    access_token = create_access_token(data={"sub": new_user.id})
+    access_token = create_user_token(new_user)
     
     return {
         "access_token": access_token,
@@ -118,7 +120,11 @@ async def login(credentials: UserLogin, db: AsyncSession = Depends(get_db)):
     )
     user = result.scalar_one_or_none()
     
-    if not user or not verify_password(credentials.password, user.hashed_password):
+    verified, new_hash = False, None
+    if user and user.hashed_password:
+        verified, new_hash = await verify_and_update_password(credentials.password, user.hashed_password)
+    
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -131,12 +137,15 @@ async def login(credentials: UserLogin, db: AsyncSession = Depends(get_db)):
             detail="Inactive user"
         )
     
-    # Update last login
+    # Update last login (and the hash, if BCRYPT_ROUNDS changed since it was made)
     user.last_login = datetime.utcnow()
+    if new_hash:
+        user.hashed_password = new_hash
     await db.commit()
+    user_cache.invalidate(user.id)
     
     # Create access token
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_user_token(user)
     
     return {
         "access_token": access_token,
@@ -184,6 +193,7 @@ async def update_current_user(
         current_user.email = user_update.email
     
     await db.commit()
+    user_cache.invalidate(current_user.id)
     await db.refresh(current_user)
     
     return current_user
@@ -227,12 +237,15 @@ async def update_user(
         user.role = user_update.role
     
     if user_update.is_active is not None:
+        if user.is_active and not user_update.is_active:
+            revoke_tokens(user)
         user.is_active = user_update.is_active
     
     if user_update.daily_message_limit is not None:
         user.daily_message_limit = user_update.daily_message_limit
     
     await db.commit()
+    user_cache.invalidate(user.id)
     await db.refresh(user)
     
     return user
@@ -259,5 +272,6 @@ async def delete_user(
     
     await db.delete(user)
     await db.commit()
+    user_cache.invalidate(user_id)
     
     return {"message": "User deleted successfully"}
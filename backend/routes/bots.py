@@ -4,7 +4,7 @@ from sqlalchemy import select
 from typing import List, Optional
 from datetime import datetime
 from pydantic import BaseModel, ConfigDict
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend.models import Bot, User
 from backend.auth import get_current_user
 
@@ -106,7 +106,7 @@ async def create_bot(
 @router.get("/", response_model=List[BotResponse])
 async def list_bots(
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """List all bots (user's own + public bots)"""
     # Get user's own bots
@@ -135,7 +135,7 @@ async def list_bots(
 async def get_bot(
     bot_id: str,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get a specific bot"""
     result = await db.execute(select(Bot).where(Bot.id == bot_id))
@@ -1,29 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import Optional, List
-from backend.database import get_db
+from sqlalchemy import select, update
+from typing import Optional, List, AsyncGenerator
+from backend.config import settings
+from backend.database import get_db, AsyncSessionLocal
 from backend.models import Conversation, Message, Bot, User
 from backend.schemas import ChatRequest, ChatResponse, MessageResponse
-from backend.auth import get_current_user, get_current_user_optional
+from backend.auth import get_current_user, get_user_or_guest
+from backend.guest_sessions import GUEST_TOKEN_HEADER
+from backend.model_permissions import acquire_rate_limit, can_user_access_model, increment_usage
 from backend.vector_store import vector_store
 from backend.reading_flow_rag import reading_flow_rag
 from backend.deep_research_rag import hybrid_rag
 from backend.image_providers import image_manager
 from backend.video_providers import video_manager
-from backend.llm_providers import llm_manager
+from backend.llm_resilience import resilient_llm
+from backend.response_cache import response_cache
+from backend.usage import usage_recorder
 from backend.agent_tools import agent_tool_manager
+from backend.image_cache import image_cache
+from backend.logger import get_logger
+from backend.tracing import tracer, traced
+from backend.metrics import (
+    CHAT_DISCONNECTS_TOTAL, CHAT_STAGE_SECONDS, CHAT_TTFT_SECONDS, CHAT_TURN_SECONDS,
+    RAG_RETRIEVAL_SECONDS, TOOL_SECONDS, model_labels
+)
 from datetime import datetime
 from pathlib import Path
+from dataclasses import dataclass, field
+from contextlib import aclosing, asynccontextmanager
+import asyncio
 import json
 import re
 import base64
 import os
+import time
 import uuid
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/chat", tags=["chat"])
+logger = get_logger(__name__)
 
 
 def save_uploaded_images(base64_images: list[str]) -> list[str]:
@@ -127,7 +144,7 @@ async def generate_video(req: VideoGenerateRequest):
     generate_audio = req.generate_audio if req.generate_audio is not None else True
     ratio = req.ratio
 
-    print(f"🎬 Video generate requested: model={model}, size={size}, duration={duration}, watermark={watermark}, camera_fixed={camera_fixed}, audio={generate_audio}, ratio={ratio}")
+    logger.info(f"🎬 Video generate requested: model={model}, size={size}, duration={duration}, watermark={watermark}, camera_fixed={camera_fixed}, audio={generate_audio}, ratio={ratio}")
     videos = await video_manager.generate(
         prompt=prompt,
         model=model,
@@ -183,7 +200,7 @@ async def generate_image_from_prompt(
             ("seedance" in model_lower or "video" in model_lower)
             or (os.getenv("VOLCANO_VIDEO_ENDPOINT") and model == os.getenv("VOLCANO_VIDEO_ENDPOINT"))
         ):
-            print(f"🎬 Detected video model in image route, delegating to video manager: model={model}")
+            logger.info(f"🎬 Detected video model in image route, delegating to video manager: model={model}")
             videos = await video_manager.generate(prompt=prompt, model=model, size=size)
             if not videos:
                 raise ValueError("No video generated")
@@ -196,23 +213,23 @@ async def generate_image_from_prompt(
                 "revised_prompt": videos[0].get("revised_prompt"),
             }
 
-        print(f"🎨 Generating image with model: {model}")
-        print(f"📝 Prompt: {prompt}")
-        print(f"🖼️ Has input image: {bool(image)}")
+        logger.info(f"🎨 Generating image with model: {model}")
+        logger.debug(f"📝 Prompt: {prompt}")
+        logger.debug(f"🖼️ Has input image: {bool(image)}")
         
         # GPT-Image-1 and DALL-E 2 support native image editing
         if image and model in ["gpt-image-1", "dall-e-2"]:
-            print(f"✅ Using {model} native image editing")
+            logger.info(f"✅ Using {model} native image editing")
             # These models can directly edit images with the prompt
             quality = "auto" if model == "gpt-image-1" else "standard"
         elif image and model == "dall-e-3":
-            print("🔍 DALL-E 3 doesn't support image editing, using vision model to enhance prompt...")
+            logger.info("🔍 DALL-E 3 doesn't support image editing, using vision model to enhance prompt...")
             from backend.llm_providers import llm_manager
             
             try:
                 vision_provider = llm_manager.get_provider("openai")
                 image_size_kb = len(image) * 3 / 4 / 1024
-                print(f"📏 Image size: {image_size_kb:.1f} KB")
+                logger.info(f"📏 Image size: {image_size_kb:.1f} KB")
                 
                 vision_messages = [
                     {
@@ -238,15 +255,15 @@ async def generate_image_from_prompt(
                 )
                 
                 enhanced_prompt = vision_response["content"]
-                print(f"✨ Enhanced prompt: {enhanced_prompt[:200]}...")
+                logger.info(f"✨ Enhanced prompt: {enhanced_prompt[:200]}...")
                 
                 if "sorry" in enhanced_prompt.lower() or "can't" in enhanced_prompt.lower():
-                    print(f"⚠️ Vision model refused, using original prompt")
+                    logger.warning(f"⚠️ Vision model refused, using original prompt")
                 else:
                     prompt = enhanced_prompt
                     image = None  # Don't pass image to DALL-E
             except Exception as vision_error:
-                print(f"⚠️ Vision analysis failed: {vision_error}")
+                logger.warning(f"⚠️ Vision analysis failed: {vision_error}")
                 image = None
             
             quality = "standard"
@@ -270,24 +287,24 @@ async def generate_image_from_prompt(
         
         if images:
             image_url = images[0].get("url")
-            print(f"✅ Image generated successfully")
+            logger.info(f"✅ Image generated successfully")
             
             if not image_url:
                 raise ValueError("Image generated but no URL returned")
             
             # If it's a data URL, save to disk and return file path
             if image_url.startswith("data:"):
-                print(f"💾 Saving data URL to disk...")
+                logger.info(f"💾 Saving data URL to disk...")
                 # Extract base64 data
                 base64_data = image_url.split(",", 1)[1]
                 # Save using the same helper (returns full /static/uploads/... path)
                 saved_paths = save_uploaded_images([base64_data])
                 image_url = saved_paths[0]
-                print(f"✅ Saved generated image to: {image_url}")
+                logger.info(f"✅ Saved generated image to: {image_url}")
             else:
-                print(f"🔗 HTTP URL: {image_url[:100]}...")
+                logger.info(f"🔗 HTTP URL: {image_url[:100]}...")
             
-            print(f"📦 Revised prompt: {images[0].get('revised_prompt', 'None')}")
+            logger.info(f"📦 Revised prompt: {images[0].get('revised_prompt', 'None')}")
             
             return {
                 "url": image_url,
@@ -297,12 +314,13 @@ async def generate_image_from_prompt(
         else:
             raise ValueError("No images generated")
     except Exception as e:
-        print(f"❌ Image generation error: {type(e).__name__}: {str(e)}")
+        logger.error(f"❌ Image generation error: {type(e).__name__}: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Image generation failed: {str(e)}")
 
 
+@traced("tool.web_search")
 async def fetch_realtime_context(query: str) -> tuple[Optional[str], list[dict]]:
     """Run web search tool to gather up-to-date info"""
     tool = agent_tool_manager.get_tool("web_search")
@@ -313,6 +331,7 @@ async def fetch_realtime_context(query: str) -> tuple[Optional[str], list[dict]]
         "input": {"query": query},
         "status": "pending"
     }
+    start = time.perf_counter()
     try:
         result = await tool.execute(query=query, max_results=5)
         exec_record["output"] = result
@@ -341,8 +360,11 @@ async def fetch_realtime_context(query: str) -> tuple[Optional[str], list[dict]]
         exec_record["status"] = "error"
         exec_record["error"] = str(exc)
         return None, [exec_record]
+    finally:
+        TOOL_SECONDS.observe(time.perf_counter() - start, tool="web_search", status=exec_record["status"])
 
 
+@traced("rag.fetch_context")
 async def fetch_rag_context(query: str, bot_id: str, conversation_id: str, db: AsyncSession, use_deep_research: bool = False) -> tuple[Optional[str], list[dict]]:
     """Retrieve relevant context from bot's or conversation's knowledge base using RAG"""
     
@@ -396,10 +418,10 @@ async def fetch_rag_context(query: str, bot_id: str, conversation_id: str, db: A
             bot = bot_result.scalar_one_or_none()
             if bot and bot.meta_data and bot.meta_data.get('use_deep_research'):
                 force_deep = True
-                print(f"🔬 Bot has deep research enabled in meta_data")
+                logger.info(f"🔬 Bot has deep research enabled in meta_data")
         
         if force_deep:
-            print(f"🔬 Deep research FORCED by user toggle")
+            logger.info(f"🔬 Deep research FORCED by user toggle")
         
         context_text = await hybrid_rag.query(
             query=query,
@@ -412,10 +434,11 @@ async def fetch_rag_context(query: str, bot_id: str, conversation_id: str, db: A
     except Exception as exc:
         exec_record["status"] = "error"
         exec_record["error"] = str(exc)
-        print(f"❌ RAG retrieval error: {exc}")
+        logger.error(f"❌ RAG retrieval error: {exc}")
         return None, [exec_record]
 
 
+@traced("agent.process_tools")
 async def process_agent_tools(
     messages: list,
     model: str,
@@ -454,42 +477,46 @@ async def process_agent_tools(
     async def run_tool(tool_name: str, tool_input: dict, formatter) -> None:
         tool = agent_tool_manager.get_tool(tool_name)
         if not tool:
-            print(f"⚠️ Tool not found: {tool_name}")
+            logger.warning(f"⚠️ Tool not found: {tool_name}")
             return
         exec_record = {
             "tool_name": tool_name,
             "tool_input": tool_input,
             "status": "pending"
         }
-        print(f"🔧 Running tool: {tool_name} with input: {tool_input}")
-        try:
-            # Pass uploaded_image to image generation tool
-            if tool_name == "generate_image":
-                result = await tool.execute(**tool_input, uploaded_image=uploaded_image)
-            else:
-                result = await tool.execute(**tool_input)
+        logger.debug(f"🔧 Running tool: {tool_name} with input: {tool_input}")
+        start = time.perf_counter()
+        with tracer.span("tool.run", tool=tool_name) as span:
+            try:
+                # Pass uploaded_image to image generation tool
+                if tool_name == "generate_image":
+                    result = await tool.execute(**tool_input, uploaded_image=uploaded_image)
+                else:
+                    result = await tool.execute(**tool_input)
             
-            # Don't log result - may contain base64 image data
-            print(f"📊 Tool {tool_name} executed")
-            exec_record["tool_output"] = result
+                # Don't log result - may contain base64 image data
+                logger.debug(f"📊 Tool {tool_name} executed")
+                exec_record["tool_output"] = result
             
-            if not result.get("success", True):
+                if not result.get("success", True):
+                    exec_record["status"] = "error"
+                    exec_record["error"] = result.get("error", "Unknown error")
+                    logger.error(f"❌ Tool failed: {exec_record['error']}")
+                else:
+                    exec_record["status"] = "success"
+                    formatted = formatter(result)
+                    if formatted:
+                        tool_context_sections.append(formatted)
+                        logger.debug(f"✅ Tool succeeded")
+            except Exception as exc:
                 exec_record["status"] = "error"
-                exec_record["error"] = result.get("error", "Unknown error")
-                print(f"❌ Tool failed: {exec_record['error']}")
-            else:
-                exec_record["status"] = "success"
-                formatted = formatter(result)
-                if formatted:
-                    tool_context_sections.append(formatted)
-                    print(f"✅ Tool succeeded")
-        except Exception as exc:
-            exec_record["status"] = "error"
-            exec_record["error"] = str(exc)
-            print(f"💥 Tool exception: {exc}")
-        finally:
-            agent_executions.append(exec_record)
-            print(f"📝 Execution recorded for {tool_name}")
+                exec_record["error"] = str(exc)
+                logger.error(f"💥 Tool exception: {exc}")
+            finally:
+                TOOL_SECONDS.observe(time.perf_counter() - start, tool=tool_name, status=exec_record["status"])
+                span.set(tool_status=exec_record["status"])
+                agent_executions.append(exec_record)
+                logger.debug(f"📝 Execution recorded for {tool_name}")
 
     # Use LLM function calling to decide which tools to use
     from backend.agent_tools import agent_tool_manager
@@ -498,17 +525,19 @@ async def process_agent_tools(
     
     # Strip images from message history to avoid token limits
     # Images are only needed for the current tool execution, not in conversation context
-    print(f"🔍 Original messages count: {len(messages)}")
+    logger.debug(f"🔍 Original messages count: {len(messages)}")
     for i, msg in enumerate(messages):
         content_type = type(msg.get("content")).__name__
         if isinstance(msg.get("content"), list):
-            print(f"  Message {i}: role={msg.get('role')}, content is list with {len(msg['content'])} items")
+            logger.debug(f"  Message {i}: role={msg.get('role')}, content is list with {len(msg['content'])} items")
         elif isinstance(msg.get("content"), str):
-            print(f"  Message {i}: role={msg.get('role')}, content length={len(msg['content'])}")
+            logger.debug(f"  Message {i}: role={msg.get('role')}, content length={len(msg['content'])}")
     
     clean_messages = []
     for msg in messages:
         clean_msg = msg.copy()
+        # The id keys the provider's cached conversion of the full content
+        clean_msg.pop("id", None)
         if isinstance(clean_msg.get("content"), list):
             # Remove image_url items from content array
             clean_msg["content"] = [
@@ -523,15 +552,15 @@ async def process_agent_tools(
                 clean_msg["content"] = ""
         clean_messages.append(clean_msg)
     
-    print(f"✅ Cleaned messages count: {len(clean_messages)}")
+    logger.debug(f"✅ Cleaned messages count: {len(clean_messages)}")
     total_chars = 0
     for i, msg in enumerate(clean_messages):
         if isinstance(msg.get("content"), str):
             total_chars += len(msg['content'])
-            print(f"  Clean message {i}: role={msg.get('role')}, content length={len(msg['content'])}")
+            logger.debug(f"  Clean message {i}: role={msg.get('role')}, content length={len(msg['content'])}")
         elif isinstance(msg.get("content"), list):
-            print(f"  Clean message {i}: role={msg.get('role')}, content is STILL A LIST with {len(msg['content'])} items - THIS IS THE BUG!")
-    print(f"📊 Total characters in clean_messages: {total_chars} (~{total_chars // 4} tokens)")
+            logger.debug(f"  Clean message {i}: role={msg.get('role')}, content is STILL A LIST with {len(msg['content'])} items - THIS IS THE BUG!")
+    logger.debug(f"📊 Total characters in clean_messages: {total_chars} (~{total_chars // 4} tokens)")
     
     # Add context about uploaded images
     if uploaded_image:
@@ -543,12 +572,13 @@ async def process_agent_tools(
     try:
         # Estimate tokens before calling
         total_chars = sum(len(str(m.get("content", ""))) for m in clean_messages)
-        print(f"📊 About to call LLM with {len(clean_messages)} messages, ~{total_chars} chars (~{total_chars // 4} tokens)")
+        logger.debug(f"📊 About to call LLM with {len(clean_messages)} messages, ~{total_chars} chars (~{total_chars // 4} tokens)")
         
         # Call LLM with available tools
-        response = await llm_manager.get_provider(provider).chat(
-            clean_messages,
+        response = await resilient_llm.chat(
+            provider,
             model,
+            clean_messages,
             tools=tools
         )
         
@@ -573,741 +603,752 @@ async def process_agent_tools(
                 "content": "Tool outputs:\n" + "\n\n".join(tool_context_sections)
             })
         
-        final_response = await llm_manager.get_provider(provider).chat(
-            clean_messages,
-            model
+        final_response = await resilient_llm.chat(
+            provider,
+            model,
+            clean_messages
         )
         
         return final_response["content"], agent_executions
     except Exception as e:
-        print(f"❌ Agent processing error: {e}")
+        logger.error(f"❌ Agent processing error: {e}")
         # Fallback to simple response (use clean_messages to avoid token limits)
-        response = await llm_manager.get_provider(provider).chat(clean_messages, model)
+        response = await resilient_llm.chat(provider, model, clean_messages)
         return response["content"], agent_executions
 
 
-@router.post("/", response_model=ChatResponse)
-async def chat(
-    request: ChatRequest,
-    db: AsyncSession = Depends(get_db)
-):
-    """Send a chat message and get a response"""
-    
-    # Get or create conversation
-    if request.conversation_id:
-        result = await db.execute(
-            select(Conversation).where(Conversation.id == request.conversation_id)
-        )
-        conversation = result.scalar_one_or_none()
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-    else:
-        conversation = Conversation(
-            title=request.message[:50],
-            bot_id=request.bot_id  # Store bot_id in conversation
+# -------- Turn execution pipeline --------
+# Both /chat and /chat/stream run the same stages; they only differ in the sink
+# that receives progress events (dropped for JSON, forwarded as SSE frames).
+
+def format_image_generation_error(error: Exception) -> str:
+    """Parse an image generation error into user-facing markdown"""
+    error_msg = str(error)
+    if "safety system" in error_msg.lower() or "moderation_blocked" in error_msg:
+        return "🚫 **Content Policy Violation**\n\nYour image generation request was blocked by OpenAI's safety system. The content may violate their usage policies.\n\nPlease try:\n- Rephrasing your prompt\n- Using more general descriptions\n- Avoiding sensitive content"
+    elif "rate_limit" in error_msg.lower():
+        return "⏱️ **Rate Limit Reached**\n\nToo many requests. Please wait a moment and try again."
+    elif "insufficient_quota" in error_msg.lower() or "quota" in error_msg.lower():
+        return "💳 **Quota Exceeded**\n\nYour API quota has been exceeded. Please check your OpenAI account."
+    elif "invalid" in error_msg.lower():
+        return f"⚠️ **Invalid Request**\n\n{error_msg}"
+    return f"❌ **Image Generation Failed**\n\n{error_msg}"
+
+
+@dataclass
+class ChatTurn:
+    """State shared by the stages of a single chat turn"""
+    request: ChatRequest
+    conversation: Optional[Conversation] = None
+    history: list = field(default_factory=list)
+    formatted_messages: list = field(default_factory=list)
+    image_paths: Optional[list] = None
+    rag_execs: list = field(default_factory=list)
+    realtime_execs: list = field(default_factory=list)
+    agent_executions: list = field(default_factory=list)
+    mode: str = "llm"  # llm, agent, media
+    media_type: str = "image"
+    input_image: Optional[str] = None
+    reference_images: Optional[list] = None
+    uploaded_images_b64: list = field(default_factory=list)
+    response_content: str = ""
+    generated_images: list = field(default_factory=list)
+    generated_videos: list = field(default_factory=list)
+    assistant_message: Optional[Message] = None
+    timings: dict = field(default_factory=dict)
+    started_at: float = field(default_factory=time.perf_counter)
+    first_token_recorded: bool = False
+    current_stage: Optional[str] = None
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        """Time a pipeline stage"""
+        start = time.perf_counter()
+        self.current_stage = name
+        try:
+            with tracer.span(f"chat.{name}"):
+                yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+            CHAT_STAGE_SECONDS.observe(self.timings[name], stage=name)
+
+
+class ChatSink:
+    """Receives progress events for a chat turn (ignored by default)"""
+    streaming = False
+
+    async def emit(self, event: dict):
+        pass
+
+    async def close(self):
+        pass
+
+
+class JSONSink(ChatSink):
+    """Non-streaming delivery: the endpoint returns the finished turn as JSON"""
+
+
+class SSESink(ChatSink):
+    """
+    Streaming delivery: events are forwarded as Server-Sent Events
+
+    Content deltas arriving within flush_interval of the first pending one
+    (up to max_chars) are coalesced into a single frame; any other event
+    flushes pending content first, so ordering is preserved. While idle, a
+    `: ping` comment is sent every heartbeat_interval seconds (0 disables it)
+    to keep proxies from timing out and to surface dead connections.
+    """
+    streaming = True
+
+    def __init__(
+        self,
+        flush_interval: float = settings.sse_flush_interval_seconds,
+        max_chars: int = settings.sse_max_coalesce_chars,
+        heartbeat_interval: float = settings.sse_heartbeat_seconds
+    ):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.flush_interval = flush_interval
+        self.max_chars = max_chars
+        self.heartbeat_interval = heartbeat_interval
+
+    async def emit(self, event: dict):
+        await self.queue.put(event)
+
+    async def close(self):
+        await self.queue.put(None)
+
+    async def _next_event(self, timeout: float):
+        try:
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+
+    async def frames(self) -> AsyncGenerator[str, None]:
+        loop = asyncio.get_running_loop()
+        pending: list = []
+        pending_chars = 0
+        flush_at = None
+
+        while True:
+            if flush_at is not None:
+                timeout = max(0.0, flush_at - loop.time())
+            else:
+                # A heartbeat interval of 0 or less disables the pings
+                timeout = self.heartbeat_interval if self.heartbeat_interval > 0 else None
+            try:
+                event = await self._next_event(timeout)
+            except asyncio.TimeoutError:
+                if pending:
+                    yield f"data: {json.dumps({'type': 'content', 'content': ''.join(pending)})}\n\n"
+                    pending, pending_chars, flush_at = [], 0, None
+                else:
+                    yield ": ping\n\n"
+                continue
+
+            if event is not None and event.get("type") == "content" and self.flush_interval > 0:
+                pending.append(event["content"])
+                pending_chars += len(event["content"])
+                if flush_at is None:
+                    flush_at = loop.time() + self.flush_interval
+                if pending_chars < self.max_chars and loop.time() < flush_at:
+                    continue
+                yield f"data: {json.dumps({'type': 'content', 'content': ''.join(pending)})}\n\n"
+                pending, pending_chars, flush_at = [], 0, None
+                continue
+
+            if pending:
+                yield f"data: {json.dumps({'type': 'content', 'content': ''.join(pending)})}\n\n"
+                pending, pending_chars, flush_at = [], 0, None
+            if event is None:
+                break
+            yield f"data: {json.dumps(event)}\n\n"
+
+
+class ChatPipeline:
+    """Runs a chat turn through load → retrieve → route → generate → persist → postprocess"""
+
+    def __init__(
+        self,
+        request: ChatRequest,
+        db: AsyncSession,
+        sink: ChatSink,
+        user: Optional[User] = None,
+        client_host: Optional[str] = None
+    ):
+        self.request = request
+        self.db = db
+        self.sink = sink
+        self.user = user
+        self.client_host = client_host
+        self.model_id = f"{request.provider}:{request.model}"
+        self.turn = ChatTurn(request=request)
+        self.trace_root = tracer.start_trace(
+            "chat.turn", provider=request.provider, model=request.model, streaming=sink.streaming
         )
-        db.add(conversation)
-        await db.commit()
-        await db.refresh(conversation)
-    
-    # Save uploaded images to disk immediately
-    image_paths = save_uploaded_images(request.images) if request.images else None
-    if image_paths:
-        print(f"💾 Saved {len(image_paths)} images to: {image_paths}")
-    
-    # Handle inline documents (for Google AI)
-    inline_documents = None
-    if request.documents:
-        inline_documents = [{"mime_type": doc.mime_type, "data": doc.data} for doc in request.documents]
-        print(f"📄 Received {len(inline_documents)} inline documents for Google AI")
-    
-    # Build meta_data for user message
-    user_meta_data = {}
-    if image_paths:
-        user_meta_data["images"] = image_paths
-    if inline_documents:
-        user_meta_data["documents"] = inline_documents
-    
-    # Save user message with file paths and inline documents
-    user_message = Message(
-        conversation_id=conversation.id,
-        role="user",
-        content=request.message,
-        meta_data=user_meta_data if user_meta_data else None
-    )
-    db.add(user_message)
-    await db.commit()
-    
-    # Get conversation history
-    messages_result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conversation.id)
-        .order_by(Message.created_at)
-    )
-    history = messages_result.scalars().all()
-    
-    # Build conversation history for LLM
-    formatted_messages = []
-    if request.system_prompt:
-        formatted_messages.append({"role": "system", "content": request.system_prompt})
-    
-    # Check if using Google AI provider (needs special multimodal format)
-    is_google_provider = request.provider == "google"
-    
-    for msg in history:
-        # For Google AI, include images/documents inline in content
-        if is_google_provider and msg.meta_data:
-            content_parts = []
-            
-            # Add images if present
-            msg_images = msg.meta_data.get("images", [])
-            for img_path in msg_images:
-                clean_path = img_path.replace("/static/", "")
-                file_path = Path("backend/static") / clean_path
-                if file_path.exists():
-                    with open(file_path, "rb") as f:
-                        img_b64 = base64.b64encode(f.read()).decode()
-                    ext = file_path.suffix.lower()
-                    mime_map = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
-                    mime_type = mime_map.get(ext, "image/jpeg")
-                    content_parts.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{img_b64}"}})
-            
-            # Add documents if present
-            msg_docs = msg.meta_data.get("documents", [])
-            for doc in msg_docs:
-                content_parts.append({"type": "document", "document": doc})
-            
-            # Add text content
-            if msg.content:
-                content_parts.append({"type": "text", "text": msg.content})
-            
-            if content_parts:
-                formatted_messages.append({"role": msg.role, "content": content_parts})
+        self.usage = usage_recorder.start_turn()
+
+    async def status(self, text: str):
+        """Progress notes are only shown to streaming clients"""
+        await self.sink.emit({"type": "content", "content": text})
+
+    async def authorize(self):
+        """Enforce the user's (or guest's) model permissions and hourly request limit"""
+        if self.user is None:
+            return
+        allowed, reason = await can_user_access_model(self.db, self.user.role, self.model_id)
+        if not allowed:
+            raise HTTPException(status_code=403, detail=reason)
+        # A new guest session is one request without a token away, so guests share
+        # the limit of their address
+        scope = f"guest@{self.client_host}" if self.user.is_guest and self.client_host else None
+        allowed, reason = await acquire_rate_limit(self.db, self.user.id, self.user.role, self.model_id, scope)
+        if not allowed:
+            raise HTTPException(status_code=429, detail=reason)
+
+    async def load(self):
+        """Resolve the conversation, store the user message and build the prompt history"""
+        request, db, turn = self.request, self.db, self.turn
+        await self.authorize()
+        async with turn.stage("load"):
+            # Get or create conversation
+            if request.conversation_id:
+                result = await db.execute(
+                    select(Conversation).where(Conversation.id == request.conversation_id)
+                )
+                conversation = result.scalar_one_or_none()
+                if not conversation:
+                    raise HTTPException(status_code=404, detail="Conversation not found")
             else:
+                conversation = Conversation(
+                    title=request.message[:50],
+                    bot_id=request.bot_id  # Store bot_id in conversation
+                )
+                db.add(conversation)
+                await db.commit()
+                await db.refresh(conversation)
+            turn.conversation = conversation
+            self.usage.user_id = conversation.user_id or (self.user.id if self.user else None)
+
+            # Save uploaded images to disk immediately
+            turn.image_paths = save_uploaded_images(request.images) if request.images else None
+            if turn.image_paths:
+                logger.info(f"💾 Saved {len(turn.image_paths)} images to: {turn.image_paths}")
+
+            # Handle inline documents (for Google AI)
+            inline_documents = None
+            if request.documents:
+                inline_documents = [{"mime_type": doc.mime_type, "data": doc.data} for doc in request.documents]
+                logger.info(f"📄 Received {len(inline_documents)} inline documents for Google AI")
+
+            # Build meta_data for user message
+            user_meta_data = {}
+            if turn.image_paths:
+                user_meta_data["images"] = turn.image_paths
+            if inline_documents:
+                user_meta_data["documents"] = inline_documents
+
+            # Save user message with file paths and inline documents
+            user_message = Message(
+                conversation_id=conversation.id,
+                role="user",
+                content=request.message,
+                meta_data=user_meta_data if user_meta_data else None
+            )
+            db.add(user_message)
+            await db.commit()
+
+            # Get conversation history
+            messages_result = await db.execute(
+                select(Message)
+                .where(Message.conversation_id == conversation.id)
+                .order_by(Message.created_at)
+            )
+            turn.history = messages_result.scalars().all()
+            turn.formatted_messages = self._format_history(turn.history)
+
+    def _format_history(self, history: list) -> list:
+        """Build conversation history for the LLM"""
+        request = self.request
+        formatted_messages = []
+        if request.system_prompt:
+            formatted_messages.append({"role": "system", "content": request.system_prompt})
+
+        # Google AI needs images/documents inline in content
+        is_google_provider = request.provider == "google"
+
+        for msg in history:
+            if is_google_provider and msg.meta_data:
+                content_parts = []
+
+                for img_path in msg.meta_data.get("images", []):
+                    # Encoded payloads are cached by path + mtime
+                    image_part = image_cache.build_image_part(img_path, request.provider)
+                    if image_part:
+                        content_parts.append(image_part)
+
+                for doc in msg.meta_data.get("documents", []):
+                    content_parts.append({"type": "document", "document": doc})
+
+                if msg.content:
+                    content_parts.append({"type": "text", "text": msg.content})
+
+                if content_parts:
+                    # The id lets GoogleProvider reuse the decoded parts on later turns
+                    formatted_messages.append({"role": msg.role, "content": content_parts, "id": msg.id})
+                else:
+                    formatted_messages.append({"role": msg.role, "content": msg.content})
+            else:
+                # Standard text-only format for other providers
                 formatted_messages.append({"role": msg.role, "content": msg.content})
-        else:
-            formatted_messages.append({"role": msg.role, "content": msg.content})
-    
-    # Inject RAG context from bot or conversation documents
-    rag_context = None
-    rag_execs: list[dict] = []
-    rag_context, rag_execs = await fetch_rag_context(request.message, request.bot_id, conversation.id, db, request.use_deep_research)
-    if rag_context:
-        formatted_messages.append({
-            "role": "system",
-            "content": "Relevant information from knowledge base:\n" + rag_context
+
+        return formatted_messages
+
+    async def execute(self):
+        """Run every stage after load and notify the sink"""
+        turn = self.turn
+        try:
+            await self._run_stages()
+        except asyncio.CancelledError:
+            # The streaming client went away: stop here, but keep what was generated
+            CHAT_DISCONNECTS_TOTAL.inc(stage=turn.current_stage or "unknown")
+            if self.trace_root:
+                self.trace_root.end(status="cancelled")
+            await self._persist_truncated()
+            raise
+        except BaseException as exc:
+            if self.trace_root:
+                self.trace_root.end(status="error", error=str(exc) or type(exc).__name__)
+            raise
+        finally:
+            await tracer.finish_trace(
+                self.trace_root,
+                message_id=turn.assistant_message.id if turn.assistant_message else None,
+                conversation_id=turn.conversation.id if turn.conversation else None,
+                mode=turn.mode
+            )
+
+        # Include meta_data in done event so frontend can display images
+        await self.sink.emit({
+            "type": "done",
+            "message_id": turn.assistant_message.id,
+            "meta_data": turn.assistant_message.meta_data
         })
-        print("📚 RAG context added")
-    
-    # Inject realtime context if requested
-    realtime_context = None
-    realtime_execs: list[dict] = []
-    if request.use_realtime_data:
-        realtime_context, realtime_execs = await fetch_realtime_context(request.message)
-        if realtime_context:
-            formatted_messages.append({
-                "role": "system",
-                "content": "Latest web research results:\n" + realtime_context
-            })
-            print("🌐 Realtime context added")
-        else:
-            print("⚠️ Realtime context unavailable")
 
-    # Check if this is an image or video generation model
-    # Use image_manager for robust detection
-    all_image_models = [m["id"] for m in image_manager.get_available_models()]
-    
-    is_volcano_media = False
-    if request.provider == "volcano":
-        from backend.config import settings
-        media_keywords = ["seedance", "seedream", "video-generation", "t2v", "i2v"]
-        
-        # Check if it matches specialized endpoints or has media keywords or is in the image manager
-        is_volcano_media = (
-            request.model in all_image_models or
-            any(kw in request.model.lower() for kw in media_keywords) or
-            (settings.volcano_image_endpoint and request.model == settings.volcano_image_endpoint) or
-            (settings.volcano_video_endpoint and request.model == settings.volcano_video_endpoint)
+    async def _run_stages(self):
+        turn = self.turn
+        await self.sink.emit({"type": "conversation_id", "conversation_id": turn.conversation.id})
+
+        async with turn.stage("retrieve"):
+            await self.retrieve()
+        async with turn.stage("route"):
+            await self.route()
+        async with turn.stage("generate"):
+            await self.generate()
+        if self.user is not None:
+            await increment_usage(self.db, self.user.id, self.model_id, self.usage.usage.total_tokens)
+        async with turn.stage("persist"):
+            await self.persist()
+        async with turn.stage("postprocess"):
+            await self.postprocess()
+
+        CHAT_TURN_SECONDS.observe(
+            time.perf_counter() - turn.started_at, mode=turn.mode, streaming=str(self.sink.streaming).lower()
         )
-        print(f"🔍 Volcano Media Check: model={request.model}, is_media={is_volcano_media}")
-        print(f"   Image EP: {settings.volcano_image_endpoint}")
-        print(f"   Video EP: {settings.volcano_video_endpoint}")
-        
-    is_image_model = request.model in all_image_models or is_volcano_media
-    
-    generated_images = []
-    generated_videos = []
-    
-    # Get LLM response
-    try:
-        agent_executions = list(rag_execs) + list(realtime_execs)
-        
-        if is_image_model:
-            # Direct image generation when image model is selected
-            print(f"🎨 Image model selected: {request.model}")
-            print(f"📝 Generating image from prompt: {request.message[:100]}...")
-            
-            # Multi-turn image generation: Check if there's a previous generated image
-            input_image = None
-            reference_images_list = None
-            
-            if request.images:
-                # User uploaded image(s)
-                if len(request.images) == 1:
-                    # Single image - use for editing
-                    input_image = request.images[0]
-                    print(f"🖼️ Using user-uploaded image for editing")
-                else:
-                    # Multiple images - use as references (GPT-Image-1 only)
-                    if request.model == "gpt-image-1":
-                        reference_images_list = request.images
-                        print(f"🎨 Using {len(request.images)} images as references")
-                    else:
-                        # For other models, just use first image
-                        input_image = request.images[0]
-                        print(f"🖼️ Using first uploaded image (model doesn't support references)")
+        logger.info(
+            f"⏱️ Chat turn [{turn.mode}]",
+            extra={
+                "conversation_id": turn.conversation.id,
+                "streaming": self.sink.streaming,
+                "timings_ms": {name: round(seconds * 1000) for name, seconds in turn.timings.items()}
+            }
+        )
+
+    async def retrieve(self):
+        """Inject RAG and realtime web context"""
+        request, turn = self.request, self.turn
+
+        rag_start = time.perf_counter()
+        rag_context, turn.rag_execs = await fetch_rag_context(
+            request.message, request.bot_id, turn.conversation.id, self.db, request.use_deep_research
+        )
+        if turn.rag_execs:
+            RAG_RETRIEVAL_SECONDS.observe(time.perf_counter() - rag_start, status=turn.rag_execs[0]["status"])
+        if rag_context:
+            self._add_context("Relevant information from knowledge base:\n" + rag_context)
+            logger.debug("📚 RAG context added")
+            await self.status("📚 Retrieved context from knowledge base...")
+        if turn.rag_execs:
+            await self.sink.emit({"type": "agent_executions", "executions": turn.rag_execs})
+
+        if request.use_realtime_data:
+            realtime_context, turn.realtime_execs = await fetch_realtime_context(request.message)
+            if realtime_context:
+                self._add_context("Latest web research results:\n" + realtime_context)
+                logger.debug("🌐 Realtime context added")
+                await self.status("🌐 Pulled fresh info from the web...")
             else:
-                # Check if the last assistant message has a generated image (multi-turn)
-                if len(history) >= 2:
-                    last_assistant_msg = None
-                    for msg in reversed(history):
-                        if msg.role == "assistant":
-                            last_assistant_msg = msg
-                            break
-                    
-                    if last_assistant_msg and last_assistant_msg.meta_data:
-                        last_images = last_assistant_msg.meta_data.get("images", [])
-                        if last_images:
-                            # Load the last generated image for multi-turn editing
-                            last_image_path = last_images[0]
-                            print(f"🔄 Multi-turn: Using previous generated image: {last_image_path}")
-                            
-                            # Load image from disk and convert to base64
-                            from pathlib import Path
-                            clean_path = last_image_path.replace("/static/", "")
-                            file_path = Path("backend/static") / clean_path
-                            if file_path.exists():
-                                with open(file_path, "rb") as f:
-                                    input_image = base64.b64encode(f.read()).decode()
-                                print(f"✅ Loaded previous image for multi-turn editing")
-                            else:
-                                print(f"⚠️ Previous image not found on disk")
-            
-            try:
-                # Generate image directly
-                image_result = await generate_image_from_prompt(
-                    prompt=request.message,
-                    model=request.model,
-                    image=input_image,
-                    reference_images=reference_images_list,
-                    size=request.image_size or "1024x1024",
-                    image_fidelity=request.image_fidelity or "high",
-                    moderation=request.moderation or "low"
-                )
-                
-                # Format response with image or video
-                media_type = "video" if "seedance" in request.model.lower() or "video" in request.model.lower() else "image"
-                response_content = f"🎨 Generated {media_type} using {request.model}"
-                if image_result.get("revised_prompt"):
-                    response_content += f"\n\n**Revised prompt:** {image_result['revised_prompt']}"
-                
-                # Add to appropriate list in meta_data
-                if media_type == "video":
-                    generated_videos = [image_result["url"]]
-                    generated_images = []
-                else:
-                    generated_images = [image_result["url"]]
-                    generated_videos = []
-                
-                print(f"✅ {media_type.capitalize()} generated successfully: {image_result['url'][:100]}")
-            except Exception as img_error:
-                print(f"❌ Image generation failed: {img_error}")
-                
-                # Parse error message for better user feedback
-                error_msg = str(img_error)
-                if "safety system" in error_msg.lower() or "moderation_blocked" in error_msg:
-                    response_content = "🚫 **Content Policy Violation**\n\nYour image generation request was blocked by OpenAI's safety system. The content may violate their usage policies.\n\nPlease try:\n- Rephrasing your prompt\n- Using more general descriptions\n- Avoiding sensitive content"
-                elif "rate_limit" in error_msg.lower():
-                    response_content = "⏱️ **Rate Limit Reached**\n\nToo many requests. Please wait a moment and try again."
-                elif "insufficient_quota" in error_msg.lower() or "quota" in error_msg.lower():
-                    response_content = "💳 **Quota Exceeded**\n\nYour API quota has been exceeded. Please check your OpenAI account."
-                elif "invalid" in error_msg.lower():
-                    response_content = f"⚠️ **Invalid Request**\n\n{error_msg}"
-                else:
-                    response_content = f"❌ **Image Generation Failed**\n\n{error_msg}"
-                
-                generated_images = []
-        
+                logger.warning("⚠️ Realtime context unavailable")
+            if turn.realtime_execs:
+                await self.sink.emit({"type": "agent_executions", "executions": turn.realtime_execs})
+
+        turn.agent_executions = list(turn.rag_execs) + list(turn.realtime_execs)
+
+    def _add_context(self, content: str):
+        """
+        Insert per-turn context just before the user's new message
+
+        The system prompt and earlier turns then form a prefix that is
+        identical from turn to turn, which provider prompt caches can reuse.
+        """
+        messages = self.turn.formatted_messages
+        position = len(messages) - 1 if messages and messages[-1]["role"] == "user" else len(messages)
+        messages.insert(position, {"role": "system", "content": content})
+
+    async def route(self):
+        """Pick media generation, agent tools or plain LLM and load the inputs they need"""
+        request, turn = self.request, self.turn
+
+        # Use image_manager for robust image/video model detection
+        all_image_models = [m["id"] for m in image_manager.get_available_models()]
+        is_volcano_media = False
+        if request.provider == "volcano":
+            media_keywords = ["seedance", "seedream", "video-generation", "t2v", "i2v"]
+            is_volcano_media = bool(
+                request.model in all_image_models or
+                any(kw in request.model.lower() for kw in media_keywords) or
+                (settings.volcano_image_endpoint and request.model == settings.volcano_image_endpoint) or
+                (settings.volcano_video_endpoint and request.model == settings.volcano_video_endpoint)
+            )
+            logger.debug(f"🔍 Volcano Media Check: model={request.model}, is_media={is_volcano_media}")
+
+        if request.model in all_image_models or is_volcano_media:
+            turn.mode = "media"
+            model_lower = request.model.lower()
+            is_video = (
+                "seedance" in model_lower or "video" in model_lower or
+                bool(settings.volcano_video_endpoint and request.model == settings.volcano_video_endpoint)
+            )
+            turn.media_type = "video" if is_video else "image"
+            await self._load_media_inputs()
         elif request.use_agent:
-            llm_provider = llm_manager.get_provider(request.provider)
+            turn.mode = "agent"
             # Load base64 from file paths only when needed for tools
-            uploaded_images_b64 = []
-            if image_paths:
-                for path in image_paths:
-                    # Strip /static/ prefix if present
-                    clean_path = path.replace("/static/", "")
-                    file_path = Path("backend/static") / clean_path
-                    if file_path.exists():
-                        with open(file_path, "rb") as f:
-                            uploaded_images_b64.append(base64.b64encode(f.read()).decode())
-                print(f"🤖 Agent mode: loaded {len(uploaded_images_b64)} images from disk for tools")
-            
-            response_content, agent_executions = await process_agent_tools(
-                formatted_messages,
-                request.model,
-                request.provider,
-                conversation.id,
-                db,
-                original_prompt=request.message,
-                uploaded_images=uploaded_images_b64
-            )
-            agent_executions = list(realtime_execs) + agent_executions
-            
-            # Extract generated image URLs from agent executions
-            generated_images = []
-            for exec_record in agent_executions:
-                if exec_record.get("tool_name") == "generate_image" and exec_record.get("status") == "success":
-                    tool_output = exec_record.get("tool_output", {})
-                    if tool_output.get("url"):
-                        generated_images.append(tool_output["url"])
+            if turn.image_paths:
+                for path in turn.image_paths:
+                    img_b64 = image_cache.get_base64(path)
+                    if img_b64:
+                        turn.uploaded_images_b64.append(img_b64)
+                logger.info(f"🤖 Agent mode: loaded {len(turn.uploaded_images_b64)} images from disk for tools")
         else:
-            llm_provider = llm_manager.get_provider(request.provider)
-            response = await llm_provider.chat(
-                formatted_messages,
-                request.model,
-                request.temperature,
-                request.max_tokens
+            turn.mode = "llm"
+
+    async def _load_media_inputs(self):
+        """Select uploaded or previously generated images for editing"""
+        request, turn = self.request, self.turn
+        logger.info(f"🎨 Media model selected: {request.model}")
+        await self.status(f"🎨 Generating {turn.media_type} with {request.model}...")
+
+        if request.images:
+            if len(request.images) == 1:
+                # Single image - use for editing
+                turn.input_image = request.images[0]
+                logger.info(f"🖼️ Using user-uploaded image for editing")
+            elif request.model == "gpt-image-1":
+                # Multiple images - use as references (GPT-Image-1 only)
+                turn.reference_images = request.images
+                logger.info(f"🎨 Using {len(request.images)} images as references")
+                await self.status(f"🎨 Using {len(request.images)} reference images...")
+            else:
+                # For other models, just use first image
+                turn.input_image = request.images[0]
+                logger.info(f"🖼️ Using first uploaded image (model doesn't support references)")
+            return
+
+        # Multi-turn image generation: reuse the last generated image
+        if len(turn.history) < 2:
+            return
+        last_assistant_msg = next((msg for msg in reversed(turn.history) if msg.role == "assistant"), None)
+        if not last_assistant_msg or not last_assistant_msg.meta_data:
+            return
+        last_images = last_assistant_msg.meta_data.get("images", [])
+        if not last_images:
+            return
+
+        last_image_path = last_images[0]
+        logger.info(f"🔄 Multi-turn: Using previous generated image: {last_image_path}")
+        await self.status("🔄 Refining previous image...")
+        turn.input_image = image_cache.get_base64(last_image_path)
+        if turn.input_image:
+            logger.info(f"✅ Loaded previous image for multi-turn editing")
+        else:
+            logger.warning(f"⚠️ Previous image not found on disk")
+
+    async def generate(self):
+        """Produce the assistant response for the routed mode"""
+        if self.turn.mode == "media":
+            await self._generate_media()
+        elif self.turn.mode == "agent":
+            await self._generate_agent()
+        else:
+            await self._generate_llm()
+
+    async def _generate_media(self):
+        request, turn = self.request, self.turn
+        try:
+            image_result = await generate_image_from_prompt(
+                prompt=request.message,
+                model=request.model,
+                image=turn.input_image,
+                reference_images=turn.reference_images,
+                size=request.image_size or "1024x1024",
+                image_fidelity=request.image_fidelity or "high",
+                moderation=request.moderation or "low"
             )
-            response_content = response["content"]
-            
-            # If there's reasoning content (DeepSeek R1 / Volcano), wrap it in <think> tags
-            # so the frontend can format it consistently with streaming mode
-            if response.get("reasoning_content"):
-                response_content = f"<think>\n{response['reasoning_content']}\n</think>\n\n{response_content}"
-                
-            agent_executions = list(realtime_execs)
-            generated_images = []
-        
-        # Save assistant message with generated media in meta_data
-        meta_data = {"agent_executions": agent_executions} if agent_executions else {}
-        if generated_images:
-            meta_data["images"] = generated_images
-        if generated_videos:
-            meta_data["videos"] = generated_videos
-            
-        assistant_message = Message(
-            conversation_id=conversation.id,
+
+            turn.response_content = f"🎨 Generated {turn.media_type} using {request.model}"
+            if image_result.get("revised_prompt"):
+                turn.response_content += f"\n\n**Revised prompt:** {image_result['revised_prompt']}"
+
+            if turn.media_type == "video":
+                turn.generated_videos = [image_result["url"]]
+            else:
+                turn.generated_images = [image_result["url"]]
+            await self.sink.emit({"type": turn.media_type, "url": image_result["url"]})
+            logger.info(f"✅ {turn.media_type.capitalize()} generated successfully: {image_result['url'][:100]}")
+        except Exception as img_error:
+            logger.error(f"❌ Image generation failed: {img_error}")
+            turn.response_content = format_image_generation_error(img_error)
+
+        await self.sink.emit({"type": "content", "content": turn.response_content})
+
+    async def _generate_agent(self):
+        request, turn = self.request, self.turn
+        await self.status("🤖 Agent tools engaged...")
+        turn.response_content, tool_executions = await process_agent_tools(
+            turn.formatted_messages,
+            request.model,
+            request.provider,
+            turn.conversation.id,
+            self.db,
+            original_prompt=request.message,
+            uploaded_images=turn.uploaded_images_b64
+        )
+        turn.agent_executions = turn.agent_executions + tool_executions
+        await self.sink.emit({"type": "content", "content": turn.response_content})
+        if tool_executions:
+            await self.sink.emit({"type": "agent_executions", "executions": tool_executions})
+
+        # Extract generated image URLs from agent executions
+        for exec_record in tool_executions:
+            if exec_record.get("tool_name") == "generate_image" and exec_record.get("status") == "success":
+                tool_output = exec_record.get("tool_output", {})
+                if tool_output.get("url"):
+                    turn.generated_images.append(tool_output["url"])
+                    await self.sink.emit({"type": "image", "url": tool_output["url"]})
+
+    def _record_first_token(self):
+        if self.turn.first_token_recorded:
+            return
+        self.turn.first_token_recorded = True
+        CHAT_TTFT_SECONDS.observe(
+            time.perf_counter() - self.turn.started_at,
+            provider=self.request.provider, model=model_labels.label(self.request.provider, self.request.model)
+        )
+
+    async def _generate_llm(self):
+        request, turn = self.request, self.turn
+
+        if self.sink.streaming:
+            # aclosing: on cancellation the provider stream (and its HTTP
+            # connection) is closed right away, not when the generator is collected
+            async with aclosing(resilient_llm.chat_stream(
+                request.provider,
+                request.model,
+                turn.formatted_messages,
+                temperature=request.temperature,
+                max_tokens=request.max_tokens
+            )) as stream:
+                async for chunk in stream:
+                    if chunk:
+                        self._record_first_token()
+                    turn.response_content += chunk
+                    await self.sink.emit({"type": "content", "content": chunk})
+            return
+
+        response = await resilient_llm.chat(
+            request.provider,
+            request.model,
+            turn.formatted_messages,
+            temperature=request.temperature,
+            max_tokens=request.max_tokens
+        )
+        self._record_first_token()
+        turn.response_content = response["content"]
+
+        # If there's reasoning content (DeepSeek R1 / Volcano), wrap it in <think> tags
+        # so the frontend can format it consistently with streaming mode
+        if response.get("reasoning_content"):
+            turn.response_content = f"<think>\n{response['reasoning_content']}\n</think>\n\n{turn.response_content}"
+
+    def _assistant_message(self, truncated: bool = False) -> Message:
+        request, turn = self.request, self.turn
+        meta_data = {"agent_executions": turn.agent_executions} if turn.agent_executions else {}
+        if turn.generated_images:
+            meta_data["images"] = turn.generated_images
+        if turn.generated_videos:
+            meta_data["videos"] = turn.generated_videos
+        # Every LLM call of the turn so far, agent tool loops included
+        if self.usage.calls:
+            meta_data["usage"] = self.usage.usage.to_dict()
+
+        if truncated:
+            meta_data["truncated"] = True
+
+        return Message(
+            conversation_id=turn.conversation.id,
             role="assistant",
-            content=response_content,
+            content=turn.response_content,
             model=request.model,
+            tokens=self.usage.usage.total_tokens if self.usage.calls else None,
             meta_data=meta_data if meta_data else None
         )
-        db.add(assistant_message)
-        
-        # Update conversation timestamp
-        conversation.updated_at = datetime.utcnow()
-        
-        # Generate title for new conversations (first exchange)
-        if len(history) == 1:  # Only user message exists
-            # Use bot name if provided, otherwise generate a title
-            if request.bot_name:
-                conversation.title = f"Chat with {request.bot_name}"
-                print(f"✅ Using bot name for title: {conversation.title}")
-            else:
-                try:
-                    # Always use GPT-4o for title generation (image models don't support chat)
-                    title_llm = llm_manager.get_provider("openai")
-                    title_prompt = [
-                        {"role": "user", "content": f"Generate a concise 3-5 word title for a conversation that starts with: '{request.message[:100]}'. Respond with ONLY the title, no quotes or extra text."}
-                    ]
-                    title_response = await title_llm.chat(
-                        title_prompt,
-                        "gpt-4o-mini",  # Use fast, cheap model for titles
-                        temperature=0.7,
-                        max_tokens=20
-                    )
-                    conversation.title = title_response["content"].strip().strip('"\'')[:60]
-                    print(f"✅ Generated title: {conversation.title}")
-                except Exception as e:
-                    print(f"Failed to generate title: {e}")
-                    # Keep the default title if generation fails
-        
-        await db.commit()
-        await db.refresh(assistant_message)
-        
-        return ChatResponse(
-            conversation_id=conversation.id,
-            message=MessageResponse.model_validate(assistant_message),
-            agent_executions=agent_executions
-        )
-        
+
+    async def persist(self):
+        """Save the assistant message with generated media in meta_data"""
+        turn = self.turn
+        turn.assistant_message = self._assistant_message()
+        self.db.add(turn.assistant_message)
+        turn.conversation.updated_at = datetime.utcnow()
+        await self.db.commit()
+        await self.db.refresh(turn.assistant_message)
+
+    async def _persist_truncated(self):
+        """Save a partial answer, flagged as truncated, after a client disconnect"""
+        turn = self.turn
+        if turn.conversation is None or turn.assistant_message is not None:
+            return
+        if not turn.response_content and not turn.agent_executions:
+            return
+        try:
+            # Own session: the request's session may be mid-operation or closing
+            async with AsyncSessionLocal() as db:
+                turn.assistant_message = self._assistant_message(truncated=True)
+                db.add(turn.assistant_message)
+                await db.execute(
+                    update(Conversation)
+                    .where(Conversation.id == turn.conversation.id)
+                    .values(updated_at=datetime.utcnow())
+                )
+                await db.commit()
+            logger.info(
+                f"✂️ Saved truncated response ({len(turn.response_content)} chars)",
+                extra={"conversation_id": turn.conversation.id, "stage": turn.current_stage}
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to save truncated response: {e}")
+
+    async def postprocess(self):
+        """Title new conversations after their first exchange"""
+        request, turn = self.request, self.turn
+        if len(turn.history) != 1:  # Only the user message existed
+            return
+
+        if request.bot_name:
+            turn.conversation.title = f"Chat with {request.bot_name}"
+            logger.info(f"✅ Using bot name for title: {turn.conversation.title}")
+        else:
+            try:
+                # Always use GPT-4o for title generation (image models don't support chat)
+                title_prompt = [
+                    {"role": "user", "content": f"Generate a concise 3-5 word title for a conversation that starts with: '{request.message[:100]}'. Respond with ONLY the title, no quotes or extra text."}
+                ]
+                title_response = await response_cache.chat(
+                    "title",
+                    "openai",
+                    "gpt-4o-mini",  # Use fast, cheap model for titles
+                    title_prompt,
+                    hedge=True,
+                    temperature=0.7,
+                    max_tokens=20
+                )
+                turn.conversation.title = title_response["content"].strip().strip('"\'')[:60]
+                logger.info(f"✅ Generated title: {turn.conversation.title}")
+            except Exception as e:
+                logger.warning(f"Failed to generate title: {e}")
+                # Keep the default title if generation fails
+                return
+
+        await self.db.commit()
+        await self.sink.emit({"type": "title", "title": turn.conversation.title})
+
+
+def _client_host(http_request: Request) -> Optional[str]:
+    return http_request.client.host if http_request.client else None
+
+
+@router.post("/", response_model=ChatResponse)
+async def chat(
+    request: ChatRequest,
+    http_request: Request,
+    current_user: User = Depends(get_user_or_guest),
+    db: AsyncSession = Depends(get_db)
+):
+    """Send a chat message and get a response"""
+    pipeline = ChatPipeline(request, db, JSONSink(), current_user, _client_host(http_request))
+    await pipeline.load()
+
+    try:
+        await pipeline.execute()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    return ChatResponse(
+        conversation_id=pipeline.turn.conversation.id,
+        message=MessageResponse.model_validate(pipeline.turn.assistant_message),
+        agent_executions=pipeline.turn.agent_executions
+    )
+
 
 @router.post("/stream")
 async def chat_stream(
     request: ChatRequest,
+    http_request: Request,
+    response: Response,
+    current_user: User = Depends(get_user_or_guest),
     db: AsyncSession = Depends(get_db)
 ):
     """Stream chat response"""
-    
-    # Get or create conversation
-    if request.conversation_id:
-        result = await db.execute(
-            select(Conversation).where(Conversation.id == request.conversation_id)
-        )
-        conversation = result.scalar_one_or_none()
-        if not conversation:
-            raise HTTPException(status_code=404, detail="Conversation not found")
-    else:
-        conversation = Conversation(
-            title=request.message[:50],
-            bot_id=request.bot_id  # Store bot_id in conversation
-        )
-        db.add(conversation)
-        await db.commit()
-        await db.refresh(conversation)
-    
-    # Save uploaded images to disk immediately
-    image_paths = save_uploaded_images(request.images) if request.images else None
-    if image_paths:
-        print(f"💾 Saved {len(image_paths)} images (streaming)")
-    
-    # Handle inline documents (for Google AI)
-    inline_documents = None
-    if request.documents:
-        inline_documents = [{"mime_type": doc.mime_type, "data": doc.data} for doc in request.documents]
-        print(f"📄 Received {len(inline_documents)} inline documents for Google AI")
-    
-    # Build meta_data for user message
-    user_meta_data = {}
-    if image_paths:
-        user_meta_data["images"] = image_paths
-    if inline_documents:
-        user_meta_data["documents"] = inline_documents
-    
-    # Save user message with file paths and inline documents
-    user_message = Message(
-        conversation_id=conversation.id,
-        role="user",
-        content=request.message,
-        meta_data=user_meta_data if user_meta_data else None
-    )
-    db.add(user_message)
-    await db.commit()
-    
-    # Get conversation history
-    messages_result = await db.execute(
-        select(Message)
-        .where(Message.conversation_id == conversation.id)
-        .order_by(Message.created_at)
-    )
-    history = messages_result.scalars().all()
-    
-    # Build conversation history for LLM
-    formatted_messages = []
-    if request.system_prompt:
-        formatted_messages.append({"role": "system", "content": request.system_prompt})
-    
-    # Check if using Google AI provider (needs special multimodal format)
-    is_google_provider = request.provider == "google"
-    
-    for msg in history:
-        # For Google AI, include images/documents inline in content
-        if is_google_provider and msg.meta_data:
-            content_parts = []
-            
-            # Add images if present
-            msg_images = msg.meta_data.get("images", [])
-            for img_path in msg_images:
-                # Load image from disk and convert to base64
-                clean_path = img_path.replace("/static/", "")
-                file_path = Path("backend/static") / clean_path
-                if file_path.exists():
-                    with open(file_path, "rb") as f:
-                        img_b64 = base64.b64encode(f.read()).decode()
-                    # Determine mime type from extension
-                    ext = file_path.suffix.lower()
-                    mime_map = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
-                    mime_type = mime_map.get(ext, "image/jpeg")
-                    content_parts.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{img_b64}"}})
-            
-            # Add documents if present
-            msg_docs = msg.meta_data.get("documents", [])
-            for doc in msg_docs:
-                content_parts.append({"type": "document", "document": doc})
-            
-            # Add text content
-            if msg.content:
-                content_parts.append({"type": "text", "text": msg.content})
-            
-            if content_parts:
-                formatted_messages.append({"role": msg.role, "content": content_parts})
-            else:
-                formatted_messages.append({"role": msg.role, "content": msg.content})
-        else:
-            # Standard text-only format for other providers
-            formatted_messages.append({"role": msg.role, "content": msg.content})
-    
-    async def generate():
+    sink = SSESink()
+    pipeline = ChatPipeline(request, db, sink, current_user, _client_host(http_request))
+    await pipeline.load()
+
+    async def run():
         try:
-            llm_provider = llm_manager.get_provider(request.provider)
-            full_response = ""
-            generated_images = []
-            generated_videos = []
-            
-            # Send conversation ID first
-            yield f"data: {json.dumps({'type': 'conversation_id', 'conversation_id': conversation.id})}\n\n"
-            
-            # Optionally add RAG context
-            rag_context = None
-            rag_execs: list[dict] = []
-            rag_context, rag_execs = await fetch_rag_context(request.message, request.bot_id, conversation.id, db, request.use_deep_research)
-            if rag_context:
-                formatted_messages.append({
-                    "role": "system",
-                    "content": "Relevant information from knowledge base:\n" + rag_context
-                })
-                yield f"data: {json.dumps({'type': 'content', 'content': '📚 Retrieved context from knowledge base...'})}\n\n"
-            if rag_execs:
-                yield f"data: {json.dumps({'type': 'agent_executions', 'executions': rag_execs})}\n\n"
-            
-            # Optionally add realtime context
-            realtime_context = None
-            realtime_execs: list[dict] = []
-            if request.use_realtime_data:
-                realtime_context, realtime_execs = await fetch_realtime_context(request.message)
-                if realtime_context:
-                    formatted_messages.append({
-                        "role": "system",
-                        "content": "Latest web research results:\n" + realtime_context
-                    })
-                    yield f"data: {json.dumps({'type': 'content', 'content': '🌐 Pulled fresh info from the web...'})}\n\n"
-                if realtime_execs:
-                    yield f"data: {json.dumps({'type': 'agent_executions', 'executions': realtime_execs})}\n\n"
-
-            agent_executions = list(rag_execs) + list(realtime_execs)
-            
-            # Check if this is an image or video generation model
-            # Use image_manager for robust detection
-            all_image_models = [m["id"] for m in image_manager.get_available_models()]
-            
-            is_volcano_media = False
-            if request.provider == "volcano":
-                from backend.config import settings
-                media_keywords = ["seedance", "seedream", "video-generation", "t2v", "i2v"]
-                is_volcano_media = (
-                    request.model in all_image_models or
-                    any(kw in request.model.lower() for kw in media_keywords) or
-                    (settings.volcano_image_endpoint and request.model == settings.volcano_image_endpoint) or
-                    (settings.volcano_video_endpoint and request.model == settings.volcano_video_endpoint)
-                )
-                
-            is_image_model = request.model in all_image_models or is_volcano_media
-            
-            if is_image_model:
-                media_type = "video" if "seedance" in request.model.lower() or "video" in request.model.lower() or (settings.volcano_video_endpoint and request.model == settings.volcano_video_endpoint) else "image"
-                # Direct media generation when model is selected
-                yield f"data: {json.dumps({'type': 'content', 'content': f'🎨 Generating {media_type} with {request.model}...'})}\n\n"
-                
-                # Multi-turn image generation: Check if there's a previous generated image
-                input_image = None
-                reference_images_list = None
-                
-                if request.images:
-                    # User uploaded image(s)
-                    if len(request.images) == 1:
-                        # Single image - use for editing
-                        input_image = request.images[0]
-                        print(f"🖼️ Using user-uploaded image for editing")
-                    else:
-                        # Multiple images - use as references (GPT-Image-1 only)
-                        if request.model == "gpt-image-1":
-                            reference_images_list = request.images
-                            print(f"🎨 Using {len(request.images)} images as references")
-                            yield f"data: {json.dumps({'type': 'content', 'content': f'🎨 Using {len(request.images)} reference images...'})}\n\n"
-                        else:
-                            # For other models, just use first image
-                            input_image = request.images[0]
-                            print(f"🖼️ Using first uploaded image (model doesn't support references)")
-                else:
-                    # Check if the last assistant message has a generated image (multi-turn)
-                    if len(history) >= 2:
-                        last_assistant_msg = None
-                        for msg in reversed(history):
-                            if msg.role == "assistant":
-                                last_assistant_msg = msg
-                                break
-                        
-                        if last_assistant_msg and last_assistant_msg.meta_data:
-                            last_images = last_assistant_msg.meta_data.get("images", [])
-                            if last_images:
-                                # Load the last generated image for multi-turn editing
-                                last_image_path = last_images[0]
-                                print(f"🔄 Multi-turn: Using previous generated image: {last_image_path}")
-                                yield f"data: {json.dumps({'type': 'content', 'content': '🔄 Refining previous image...'})}\n\n"
-                                
-                                # Load image from disk and convert to base64
-                                from pathlib import Path
-                                clean_path = last_image_path.replace("/static/", "")
-                                file_path = Path("backend/static") / clean_path
-                                if file_path.exists():
-                                    with open(file_path, "rb") as f:
-                                        input_image = base64.b64encode(f.read()).decode()
-                                    print(f"✅ Loaded previous image for multi-turn editing")
-                                else:
-                                    print(f"⚠️ Previous image not found on disk")
-                
-                try:
-                    image_result = await generate_image_from_prompt(
-                        prompt=request.message,
-                        model=request.model,
-                        image=input_image,
-                        reference_images=reference_images_list,
-                        size=request.image_size or "1024x1024",
-                        image_fidelity=request.image_fidelity or "high",
-                        moderation=request.moderation or "low"
-                    )
-                    
-                    full_response = f"🎨 Generated {media_type} using {request.model}"
-                    if image_result.get("revised_prompt"):
-                        full_response += f"\n\n**Revised prompt:** {image_result['revised_prompt']}"
-                    
-                    # Send the generated media
-                    if media_type == "video":
-                        yield f"data: {json.dumps({'type': 'video', 'url': image_result['url']})}\n\n"
-                        generated_videos = [image_result["url"]]
-                        generated_images = []
-                    else:
-                        yield f"data: {json.dumps({'type': 'image', 'url': image_result['url']})}\n\n"
-                        generated_images = [image_result["url"]]
-                        generated_videos = []
-                        
-                    yield f"data: {json.dumps({'type': 'content', 'content': full_response})}\n\n"
-                except Exception as img_error:
-                    print(f"❌ Image generation failed: {img_error}")
-                    
-                    # Parse error message for better user feedback
-                    error_msg = str(img_error)
-                    if "safety system" in error_msg.lower() or "moderation_blocked" in error_msg:
-                        full_response = "🚫 **Content Policy Violation**\n\nYour image generation request was blocked by OpenAI's safety system. The content may violate their usage policies.\n\nPlease try:\n- Rephrasing your prompt\n- Using more general descriptions\n- Avoiding sensitive content"
-                    elif "rate_limit" in error_msg.lower():
-                        full_response = "⏱️ **Rate Limit Reached**\n\nToo many requests. Please wait a moment and try again."
-                    elif "insufficient_quota" in error_msg.lower() or "quota" in error_msg.lower():
-                        full_response = "💳 **Quota Exceeded**\n\nYour API quota has been exceeded. Please check your OpenAI account."
-                    elif "invalid" in error_msg.lower():
-                        full_response = f"⚠️ **Invalid Request**\n\n{error_msg}"
-                    else:
-                        full_response = f"❌ **Image Generation Failed**\n\n{error_msg}"
-                    
-                    yield f"data: {json.dumps({'type': 'content', 'content': full_response})}\n\n"
-                    generated_images = []
-            
-            elif request.use_agent:
-                # Load base64 from file paths only when needed for tools
-                uploaded_images_b64 = []
-                if image_paths:
-                    for path in image_paths:
-                        # Strip /static/ prefix if present
-                        clean_path = path.replace("/static/", "")
-                        file_path = Path("backend/static") / clean_path
-                        if file_path.exists():
-                            with open(file_path, "rb") as f:
-                                uploaded_images_b64.append(base64.b64encode(f.read()).decode())
-                    print(f"🤖 Agent mode (streaming): loaded {len(uploaded_images_b64)} images from disk for tools")
-                
-                # Process via agent tools (non-streaming response)
-                yield f"data: {json.dumps({'type': 'content', 'content': '🤖 Agent tools engaged...'})}\n\n"
-                full_response, agent_executions = await process_agent_tools(
-                    formatted_messages,
-                    request.model,
-                    request.provider,
-                    conversation.id,
-                    db,
-                    original_prompt=request.message,
-                    uploaded_images=uploaded_images_b64
-                )
-                agent_executions = list(realtime_execs) + agent_executions
-                yield f"data: {json.dumps({'type': 'content', 'content': full_response})}\n\n"
-                if agent_executions:
-                    yield f"data: {json.dumps({'type': 'agent_executions', 'executions': agent_executions})}\n\n"
-                
-                # Extract generated image URLs from agent executions
-                generated_images = []
-                for exec_record in agent_executions:
-                    if exec_record.get("tool_name") == "generate_image" and exec_record.get("status") == "success":
-                        tool_output = exec_record.get("tool_output", {})
-                        if tool_output.get("url"):
-                            generated_images.append(tool_output["url"])
-                            # Send image URL
-                            yield f"data: {json.dumps({'type': 'image', 'url': tool_output['url']})}\n\n"
-            else:
-                # Normal LLM streaming
-                async for chunk in llm_provider.chat_stream(
-                    formatted_messages,
-                    request.model,
-                    request.temperature,
-                    request.max_tokens
-                ):
-                    full_response += chunk
-                    yield f"data: {json.dumps({'type': 'content', 'content': chunk})}\n\n"
-                
-                generated_images = []
-            
-            # Save final message
-            meta_data = {"agent_executions": agent_executions} if agent_executions else {}
-            if generated_images:
-                meta_data["images"] = generated_images
-            if generated_videos:
-                meta_data["videos"] = generated_videos
-                
-            assistant_message = Message(
-                conversation_id=conversation.id,
-                role="assistant",
-                content=full_response,
-                model=request.model,
-                meta_data=meta_data if meta_data else None
-            )
-            db.add(assistant_message)
-            conversation.updated_at = datetime.utcnow()
-            print(f"💾 Saved assistant message with meta_data: {assistant_message.meta_data is not None}")
-            
-            # Generate title for new conversations (first exchange)
-            if len(history) == 1:  # Only user message exists
-                # Use bot name if provided, otherwise generate a title
-                if request.bot_name:
-                    conversation.title = f"Chat with {request.bot_name}"
-                    print(f"✅ Using bot name for title (streaming): {conversation.title}")
-                    # Send title update to frontend
-                    yield f"data: {json.dumps({'type': 'title', 'title': conversation.title})}\n\n"
-                else:
-                    try:
-                        # Always use GPT-4o for title generation (image models don't support chat)
-                        title_llm = llm_manager.get_provider("openai")
-                        title_prompt = [
-                            {"role": "user", "content": f"Generate a concise 3-5 word title for a conversation that starts with: '{request.message[:100]}'. Respond with ONLY the title, no quotes or extra text."}
-                        ]
-                        title_response = await title_llm.chat(
-                            title_prompt,
-                            "gpt-4o-mini",  # Use fast, cheap model for titles
-                            temperature=0.7,
-                            max_tokens=20
-                        )
-                        conversation.title = title_response["content"].strip().strip('"\'')[:60]
-                        print(f"✅ Generated title: {conversation.title}")
-                        # Send title update to frontend
-                        yield f"data: {json.dumps({'type': 'title', 'title': conversation.title})}\n\n"
-                    except Exception as e:
-                        print(f"Failed to generate title: {e}")
-            
-            await db.commit()
-            await db.refresh(assistant_message)
-            
-            # Include meta_data in done event so frontend can display images
-            yield f"data: {json.dumps({'type': 'done', 'message_id': assistant_message.id, 'meta_data': assistant_message.meta_data})}\n\n"
-            
+            await pipeline.execute()
         except Exception as e:
-            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
-    
-    return StreamingResponse(generate(), media_type="text/event-stream")
+            await sink.emit({"type": "error", "error": str(e)})
+        finally:
+            await sink.close()
+
+    async def generate():
+        task = asyncio.create_task(run())
+        try:
+            async for frame in sink.frames():
+                yield frame
+        finally:
+            # The server stops iterating when the client disconnects; cancelling
+            # the turn closes the provider stream so no more tokens are billed
+            if not task.done():
+                logger.info("🔌 Client disconnected, cancelling chat turn")
+                task.cancel()
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            # Set on the dependency response by get_user_or_guest, which a returned response doesn't inherit
+            **{k: v for k, v in response.headers.items() if k == GUEST_TOKEN_HEADER.lower()}
+        }
+    )
@@ -3,7 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, desc
 from sqlalchemy.orm import selectinload
 from typing import List
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend.models import Conversation, Message
 from backend.schemas import ConversationCreate, ConversationResponse
 
@@ -34,7 +34,7 @@ async def create_conversation(
 async def list_conversations(
     skip: int = 0,
     limit: int = 50,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """List all conversations"""
     try:
@@ -88,7 +88,7 @@ async def list_conversations(
 @router.get("/{conversation_id}")
 async def get_conversation(
     conversation_id: str,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Get a specific conversation with messages"""
     result = await db.execute(
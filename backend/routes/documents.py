@@ -10,7 +10,7 @@ from datetime import datetime
 from pydantic import BaseModel, ConfigDict
 import json
 import asyncio
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend.models import Bot, Document, User
 from backend.auth import get_current_user
 from backend.vector_store import vector_store
@@ -336,7 +336,7 @@ async def upload_document_file_stream(
 async def list_bot_documents(
     bot_id: str,
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """List all documents for a bot"""
     # Verify bot exists and user has access
@@ -1,20 +1,26 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import JSONResponse
 from typing import List
 from backend.schemas import ProviderStatus
-from backend.llm_providers import llm_manager
+from backend.model_catalog import model_catalog
 
 router = APIRouter(prefix="/models", tags=["models"])
 
 
 @router.get("/")
-async def get_available_models():
+async def get_available_models(request: Request):
     """Get all available LLM providers and their models"""
     try:
-        providers = await llm_manager.get_available_providers()
-        return providers
+        providers, etag = await model_catalog.get()
     except Exception as e:
         print(f"Error in get_available_models: {e}")
         import traceback
         traceback.print_exc()
         from fastapi import HTTPException
         raise HTTPException(status_code=500, detail=str(e))
+
+    # Let clients revalidate without downloading an unchanged catalog
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=providers, headers=headers)
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
 from pydantic import BaseModel
-from backend.llm_providers import llm_manager
+from backend.response_cache import response_cache
 from backend.auth import get_user_or_guest
 from backend.models import User
 
@@ -41,16 +41,16 @@ Assistant responded: {request.assistant_message[:500]}...
 Generate 5 relevant follow-up questions:"""
 
     try:
-        # Get the provider
-        provider = llm_manager.get_provider(request.provider)
-        
-        # Generate suggestions
-        response = await provider.chat(
+        # Generate suggestions (hedged: the UI waits on this after every reply)
+        response = await response_cache.chat(
+            "suggestions",
+            request.provider,
+            request.model,
             messages=[
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt}
             ],
-            model=request.model,
+            hedge=True,
             temperature=0.7,
             max_tokens=200
         )
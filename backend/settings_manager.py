@@ -2,6 +2,7 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from backend.models import SystemSettings
+from backend.config_cache import config_cache
 import json
 
 # Default settings
@@ -35,13 +36,10 @@ DEFAULT_SETTINGS = {
 
 async def get_setting(db: AsyncSession, key: str, default: str = None) -> str:
     """Get a system setting value"""
-    result = await db.execute(
-        select(SystemSettings).where(SystemSettings.key == key)
-    )
-    setting = result.scalar_one_or_none()
+    value = await config_cache.get_setting(db, key)
     
-    if setting:
-        return setting.value
+    if value is not None:
+        return value
     
     # Return default from DEFAULT_SETTINGS or provided default
     if key in DEFAULT_SETTINGS:
@@ -69,7 +67,9 @@ async def set_setting(db: AsyncSession, key: str, value: str, description: str =
         )
         db.add(setting)
     
+    await config_cache.bump(db)
     await db.commit()
+    config_cache.invalidate()
     await db.refresh(setting)
     return setting
 
@@ -0,0 +1,222 @@
+"""
+Lightweight request tracing
+
+Spans are tracked through contextvars, so nested calls (and tasks spawned from
+them) pick up their parent automatically. A chat turn opens a trace; every span
+recorded while it is active is attached to it. Finished traces are kept in a
+bounded in-memory index keyed by message id and, if an export path is set,
+appended to a JSONL file that is rotated once it reaches a size cap.
+"""
+from typing import Any, Dict, List, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+import asyncio
+import functools
+import json
+import time
+import uuid
+from backend.config import settings
+from backend.logger import get_logger, get_request_id
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class Span:
+    """A timed operation inside a trace"""
+    name: str
+    trace_id: str
+    parent_id: Optional[str] = None
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    start_time: float = field(default_factory=time.time)
+    duration_ms: Optional[float] = None
+    status: str = "ok"
+    error: Optional[str] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    _started: float = field(default_factory=time.perf_counter, repr=False)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, status: Optional[str] = None, error: Optional[str] = None):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 2)
+        if status:
+            self.status = status
+        if error:
+            self.error = error[:500]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class _NoopSpan:
+    """Stand-in yielded when no trace is active"""
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+@dataclass
+class Trace:
+    """All spans recorded for one chat turn"""
+    trace_id: str
+    request_id: Optional[str]
+    spans: List[Span] = field(default_factory=list)
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "request_id": self.request_id,
+            **self.attributes,
+            "spans": [span.to_dict() for span in self.spans]
+        }
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Creates spans and stores finished traces"""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        export_path: Optional[str] = None,
+        max_traces: int = 500,
+        export_max_bytes: int = 50 * 1024 * 1024
+    ):
+        self.enabled = enabled
+        self.export_path = Path(export_path) if export_path else None
+        self.max_traces = max_traces
+        self.export_max_bytes = export_max_bytes
+        self._by_message: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def start_trace(self, name: str, **attributes) -> Optional[Span]:
+        """Open a trace and make its root span current"""
+        if not self.enabled:
+            return None
+        trace = Trace(trace_id=uuid.uuid4().hex, request_id=get_request_id())
+        current_trace.set(trace)
+        root = self.start_span(name, **attributes)
+        current_span.set(root)
+        return root
+
+    def start_span(self, name: str, **attributes) -> Optional[Span]:
+        """
+        Start a child of the current span without making it current
+
+        Used for async generators, which must not leave a span set in the
+        consumer's context between yields.
+        """
+        trace = current_trace.get()
+        if trace is None:
+            return None
+        parent = current_span.get()
+        span = Span(
+            name=name,
+            trace_id=trace.trace_id,
+            parent_id=parent.span_id if parent else None,
+            attributes=attributes
+        )
+        trace.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Record a block as a child of the current span"""
+        span = self.start_span(name, **attributes)
+        if span is None:
+            yield NOOP_SPAN
+            return
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.end(status="cancelled" if isinstance(exc, (asyncio.CancelledError, GeneratorExit)) else "error",
+                     error=str(exc) or type(exc).__name__)
+            raise
+        else:
+            span.end()
+        finally:
+            current_span.reset(token)
+
+    async def finish_trace(self, root: Optional[Span], message_id: Optional[str] = None, **attributes):
+        """Close the root span, index the trace by message id and export it"""
+        trace = current_trace.get()
+        if root is None or trace is None:
+            return
+        if root.duration_ms is None:
+            root.end()
+        trace.attributes.update(attributes, message_id=message_id)
+        record = trace.to_dict()
+
+        if message_id:
+            self._by_message[message_id] = record
+            self._by_message.move_to_end(message_id)
+            while len(self._by_message) > self.max_traces:
+                self._by_message.popitem(last=False)
+
+        if self.export_path:
+            try:
+                await asyncio.to_thread(self._append, json.dumps(record, default=str, ensure_ascii=False))
+            except OSError as e:
+                logger.warning(f"⚠️ Trace export failed: {e}")
+
+    def _append(self, line: str):
+        if self.export_path.exists() and self.export_path.stat().st_size >= self.export_max_bytes:
+            # Keep one previous generation; lookups only scan the current file
+            self.export_path.replace(self.export_path.with_name(self.export_path.name + ".1"))
+        with open(self.export_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+    def get_trace(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a trace by message id, falling back to the JSONL export"""
+        record = self._by_message.get(message_id)
+        if record is not None or not self.export_path or not self.export_path.exists():
+            return record
+        with open(self.export_path, encoding="utf-8") as f:
+            for line in f:
+                if message_id in line:
+                    candidate = json.loads(line)
+                    if candidate.get("message_id") == message_id:
+                        record = candidate
+        return record
+
+
+def traced(name: Optional[str] = None):
+    """Decorator recording an async function call as a span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Global tracer instance
+tracer = Tracer(
+    enabled=settings.tracing_enabled,
+    export_path=settings.tracing_export_path,
+    max_traces=settings.tracing_max_traces,
+    export_max_bytes=settings.tracing_export_max_mb * 1024 * 1024
+)
@@ -0,0 +1,288 @@
+"""
+Token usage accounting
+
+Every provider reports prompt, completion and reasoning tokens: chat() results
+carry a usage dict and chat_stream() ends with a TokenUsage item (taken from the
+provider's stream-final usage chunk) that the instrumentation strips before the
+consumer sees it. When a provider reports nothing, usage is estimated locally
+and flagged as estimated.
+
+Recorded usage goes to the collector of the current chat turn (so the turn can
+store its token count on the assistant message) and is aggregated in memory per
+hour, user, provider and model. The aggregates are written to the llm_usage
+table in batches.
+"""
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+from backend.config import settings
+from backend.logger import get_logger
+from backend.metrics import LLM_TOKENS_TOTAL, model_labels
+
+logger = get_logger(__name__)
+
+
+def _field(obj: Any, name: str) -> Any:
+    """Read a usage field from an SDK object or a plain dict"""
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+@dataclass
+class TokenUsage:
+    """
+    Tokens spent by one LLM call
+
+    completion_tokens includes reasoning_tokens, as OpenAI counts them, and
+    prompt_tokens includes cached_tokens (prompt tokens served from the
+    provider's prompt cache).
+    """
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    reasoning_tokens: int = 0
+    cached_tokens: int = 0
+    estimated: bool = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: "TokenUsage"):
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.reasoning_tokens += other.reasoning_tokens
+        self.cached_tokens += other.cached_tokens
+        self.estimated = self.estimated or other.estimated
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "cached_tokens": self.cached_tokens,
+            "total_tokens": self.total_tokens,
+            "estimated": self.estimated
+        }
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Any]]) -> Optional["TokenUsage"]:
+        if not data:
+            return None
+        return cls(
+            prompt_tokens=data.get("prompt_tokens") or 0,
+            completion_tokens=data.get("completion_tokens") or 0,
+            reasoning_tokens=data.get("reasoning_tokens") or 0,
+            cached_tokens=data.get("cached_tokens") or 0,
+            estimated=bool(data.get("estimated"))
+        )
+
+    @classmethod
+    def from_openai(cls, usage: Any) -> Optional["TokenUsage"]:
+        """OpenAI-compatible usage (OpenAI, OpenRouter, DeepSeek, Volcano Ark)"""
+        if not usage:
+            return None
+        details = _field(usage, "completion_tokens_details")
+        # DeepSeek reports cache hits as prompt_cache_hit_tokens
+        cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens") or _field(usage, "prompt_cache_hit_tokens")
+        return cls(
+            prompt_tokens=_field(usage, "prompt_tokens") or 0,
+            completion_tokens=_field(usage, "completion_tokens") or 0,
+            reasoning_tokens=_field(details, "reasoning_tokens") or 0,
+            cached_tokens=cached or 0
+        )
+
+    @classmethod
+    def from_anthropic(cls, usage: Any) -> Optional["TokenUsage"]:
+        if not usage:
+            return None
+        # Cached prompt tokens are reported separately from input_tokens
+        cache_read = _field(usage, "cache_read_input_tokens") or 0
+        prompt = (
+            (_field(usage, "input_tokens") or 0)
+            + (_field(usage, "cache_creation_input_tokens") or 0)
+            + cache_read
+        )
+        return cls(
+            prompt_tokens=prompt,
+            completion_tokens=_field(usage, "output_tokens") or 0,
+            cached_tokens=cache_read
+        )
+
+    @classmethod
+    def from_google(cls, metadata: Any) -> Optional["TokenUsage"]:
+        if not metadata:
+            return None
+        # Gemini reports thinking tokens next to, not inside, the candidate tokens
+        thoughts = _field(metadata, "thoughts_token_count") or 0
+        return cls(
+            prompt_tokens=_field(metadata, "prompt_token_count") or 0,
+            completion_tokens=(_field(metadata, "candidates_token_count") or 0) + thoughts,
+            reasoning_tokens=thoughts,
+            cached_tokens=_field(metadata, "cached_content_token_count") or 0
+        )
+
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """tiktoken's cl100k_base, if tiktoken is installed and its data can be loaded"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.info(f"ℹ️ tiktoken unavailable, estimating tokens from length: {e}")
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate token count of a piece of text"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def estimate_usage(messages: List[Dict[str, Any]], completion: str) -> TokenUsage:
+    """Local estimate for providers that don't report usage (text parts only)"""
+    prompt = 0
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        # ~4 tokens of per-message framing
+        prompt += estimate_tokens(content or "") + 4
+    return TokenUsage(prompt_tokens=prompt, completion_tokens=estimate_tokens(completion), estimated=True)
+
+
+@dataclass
+class UsageCollector:
+    """Usage of every LLM call made while it is current (one chat turn)"""
+    user_id: Optional[str] = None
+    usage: TokenUsage = field(default_factory=TokenUsage)
+    calls: int = 0
+
+
+current_collector: ContextVar[Optional[UsageCollector]] = ContextVar("current_usage_collector", default=None)
+
+# (hour, user_id, provider, model)
+UsageKey = Tuple[datetime, Optional[str], str, str]
+
+
+class UsageRecorder:
+    """Aggregates recorded usage and writes it to the database in batches"""
+
+    def __init__(self, enabled: bool = True, flush_interval: float = 30.0, max_pending: int = 500):
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[UsageKey, Dict[str, int]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._early_flush: Optional[asyncio.Task] = None
+
+    def start_turn(self, user_id: Optional[str] = None) -> UsageCollector:
+        """Collect usage for the current context (and tasks spawned from it)"""
+        collector = UsageCollector(user_id=user_id)
+        current_collector.set(collector)
+        return collector
+
+    def record(self, provider: str, model: str, usage: TokenUsage):
+        """Account for one LLM call"""
+        label = model_labels.label(provider, model)
+        LLM_TOKENS_TOTAL.inc(usage.prompt_tokens, provider=provider, model=label, type="prompt")
+        LLM_TOKENS_TOTAL.inc(usage.completion_tokens, provider=provider, model=label, type="completion")
+        if usage.reasoning_tokens:
+            LLM_TOKENS_TOTAL.inc(usage.reasoning_tokens, provider=provider, model=label, type="reasoning")
+        if usage.cached_tokens:
+            LLM_TOKENS_TOTAL.inc(usage.cached_tokens, provider=provider, model=label, type="cached_prompt")
+
+        collector = current_collector.get()
+        if collector is not None:
+            collector.usage.add(usage)
+            collector.calls += 1
+
+        if not self.enabled:
+            return
+        hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        key = (hour, collector.user_id if collector else None, provider, model)
+        row = self._pending.setdefault(key, {
+            "requests": 0, "prompt_tokens": 0, "completion_tokens": 0,
+            "reasoning_tokens": 0, "cached_tokens": 0, "estimated_requests": 0
+        })
+        row["requests"] += 1
+        row["prompt_tokens"] += usage.prompt_tokens
+        row["completion_tokens"] += usage.completion_tokens
+        row["reasoning_tokens"] += usage.reasoning_tokens
+        row["cached_tokens"] += usage.cached_tokens
+        row["estimated_requests"] += int(usage.estimated)
+
+        if len(self._pending) >= self.max_pending and (self._early_flush is None or self._early_flush.done()):
+            self._early_flush = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        """Write pending aggregates to llm_usage"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            try:
+                await self._write(pending)
+            except Exception as e:
+                logger.warning(f"⚠️ Usage flush failed, keeping {len(pending)} rows for the next attempt: {e}")
+                for key, row in pending.items():
+                    merged = self._pending.setdefault(key, dict.fromkeys(row, 0))
+                    for name, value in row.items():
+                        merged[name] += value
+
+    async def _write(self, pending: Dict[UsageKey, Dict[str, int]]):
+        from sqlalchemy import insert
+        from backend.db_writer import db_writer
+        from backend.models import LLMUsage
+
+        rows = [
+            {"period_start": hour, "user_id": user_id, "provider": provider, "model": model, **counts}
+            for (hour, user_id, provider, model), counts in pending.items()
+        ]
+
+        await db_writer.run(lambda session: session.execute(insert(LLMUsage), rows))
+        logger.debug(f"📊 Flushed {len(rows)} usage rows")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self.enabled and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the periodic flush and write whatever is still pending"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+
+# Global usage recorder instance
+usage_recorder = UsageRecorder(
+    enabled=settings.usage_accounting_enabled,
+    flush_interval=settings.usage_flush_interval_seconds,
+    max_pending=settings.usage_flush_max_pending
+)
@@ -0,0 +1,100 @@
+"""
+Authenticated-user cache
+
+The auth dependencies decode the JWT and need the User row on every request.
+Rows are cached in process for a short TTL, keyed by user id and the token
+version carried in the JWT, so the hot path is a JWT check plus a dict lookup.
+A cached row is attached to the request's session without a query
+(merge(load=False)), so routes can still modify and commit it.
+
+Routes that change a user invalidate its entries; the TTL bounds staleness
+between worker processes. Raising a user's token_version revokes every token
+issued before, since those keys no longer match the row.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import threading
+import time
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+from backend.config import settings
+from backend.logger import get_logger
+from backend.metrics import CACHE_REQUESTS_TOTAL
+from backend.models import User
+
+logger = get_logger(__name__)
+
+# (user id, token version)
+UserKey = Tuple[str, int]
+
+
+class UserCache:
+    """TTL + LRU cache of User column values"""
+
+    def __init__(self, ttl_seconds: float = 30.0, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[UserKey, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._columns = [attr.key for attr in inspect(User).column_attrs]
+
+    def _lookup(self, key: UserKey) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, values = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return values
+
+    def _store(self, key: UserKey, user: User):
+        values = {name: getattr(user, name) for name in self._columns}
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, values)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get_user(self, db: AsyncSession, user_id: str, token_version: int = 0) -> Optional[User]:
+        """The user a token refers to, or None if it doesn't exist or the token was revoked"""
+        key = (user_id, token_version)
+        if self.ttl_seconds > 0:
+            values = self._lookup(key)
+            if values is not None:
+                CACHE_REQUESTS_TOTAL.inc(cache="user", result="hit")
+                user = User(**values)
+                make_transient_to_detached(user)
+                return await db.merge(user, load=False)
+            CACHE_REQUESTS_TOTAL.inc(cache="user", result="miss")
+
+        result = await db.execute(select(User).where(User.id == user_id))
+        user = result.scalar_one_or_none()
+        if user is None:
+            return None
+        if (user.token_version or 0) != token_version:
+            logger.debug(f"Token version {token_version} revoked for user {user_id}")
+            return None
+        if self.ttl_seconds > 0:
+            self._store(key, user)
+        return user
+
+    def invalidate(self, user_id: str):
+        """Drop every cached version of a user (call after changing or deleting it)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Global user cache instance
+user_cache = UserCache(
+    ttl_seconds=settings.user_cache_ttl_seconds,
+    max_entries=settings.user_cache_max_entries
+)
@@ -1,13 +1,21 @@
 """
-Simple in-memory vector store for RAG
-Uses cosine similarity for retrieval
+Vector store for RAG
+Uses cosine similarity for retrieval: ranked in SQL with pgvector on
+PostgreSQL, in Python over the candidate chunks on SQLite
 """
 from typing import List, Dict, Tuple, Optional
 import numpy as np
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, and_, or_, text, delete, insert, update
+from backend.config import settings
+from backend.database import USE_PGVECTOR, read_session, recent_writes, scope_keys
+from backend.db_writer import db_writer
 from backend.models import Document, DocumentChunk
 from backend.embeddings import embedding_provider
+from backend.logger import get_logger
+from backend.tracing import traced
+
+logger = get_logger(__name__)
 
 
 def cosine_similarity(a: List[float], b: List[float]) -> float:
@@ -28,6 +36,8 @@ def cosine_similarity(a: List[float], b: List[float]) -> float:
 class VectorStore:
     """Vector store for document retrieval"""
     
+    _pgvector_version: Optional[Tuple[int, ...]] = None  # Read from pg_extension on first scoped search
+    
     async def add_document(
         self,
         db: AsyncSession,
@@ -47,10 +57,13 @@ class VectorStore:
         Returns the document ID
         
         Args:
+            db: The caller's session; rows are written through db_writer, not this session
             batch_size: Number of chunks to process at once (default 50)
             progress_callback: Optional callback function(current, total, status)
         """
-        # Create document record
+        # Create document record. It is committed up front and each batch of chunks
+        # in a short transaction of its own, so the write lock is never held while
+        # embeddings are generated; search skips the document until chunk_count is set.
         document = Document(
             bot_id=bot_id,
             conversation_id=conversation_id,
@@ -59,21 +72,50 @@ class VectorStore:
             content=content,
             chunk_count=0
         )
-        db.add(document)
-        await db.flush()
+        
+        async def insert_document(session):
+            session.add(document)
+        
+        await db_writer.run(insert_document)
+        try:
+            await self._store_chunks(document, content, chunk_size, chunk_overlap, batch_size, progress_callback)
+        except Exception:
+            await db_writer.run(lambda session: self._delete_document_rows(session, document.id))
+            raise
+        
+        # Written outside ORM sessions, so mark it for read-your-writes here
+        recent_writes.mark(scope_keys(conversation_id=conversation_id, user_id=user_id, bot_id=bot_id))
         
+        if progress_callback:
+            await progress_callback(100, 100, "Complete!")
+        
+        logger.info(f"✅ Added document '{filename}' with {document.chunk_count} chunks")
+        return document.id
+    
+    async def _delete_document_rows(self, session: AsyncSession, document_id: str):
+        await session.execute(delete(DocumentChunk).where(DocumentChunk.document_id == document_id))
+        await session.execute(delete(Document).where(Document.id == document_id))
+    
+    async def _store_chunks(
+        self,
+        document: Document,
+        content: str,
+        chunk_size: int,
+        chunk_overlap: int,
+        batch_size: int,
+        progress_callback
+    ):
+        """Split, embed and write the document's chunks batch by batch"""
         if progress_callback:
             await progress_callback(0, 100, "Splitting document into chunks...")
         
         # Split into chunks with progress
-        print(f"📄 Starting to split document: {len(content)} characters")
+        logger.debug(f"📄 Starting to split document: {len(content)} characters")
         chunks = self._split_text(content, chunk_size, chunk_overlap)
         total_chunks = len(chunks)
-        print(f"✂️  Document split into {total_chunks} chunks")
+        logger.debug(f"✂️  Document split into {total_chunks} chunks")
         
-        print(f"\n{'='*60}")
-        print(f"📄 Processing {filename}: {total_chunks} chunks")
-        print(f"{'='*60}", flush=True)
+        logger.info(f"📄 Processing {document.filename}: {total_chunks} chunks")
         
         if progress_callback:
             await progress_callback(10, 100, f"Processing {total_chunks} chunks in batches...")
@@ -104,7 +146,7 @@ class VectorStore:
             chunk_texts = [chunk["text"] for chunk in batch_chunks]
             embeddings = await embedding_provider.embed_texts(chunk_texts)
             embed_time = time.time() - batch_start_time
-            print(f"  ⏱️  Embedding generation took {embed_time:.2f}s for {len(batch_chunks)} chunks", flush=True)
+            logger.debug(f"  ⏱️  Embedding generation took {embed_time:.2f}s for {len(batch_chunks)} chunks")
             
             # Progress for storing
             store_progress = 10 + int(((batch_start + len(batch_chunks) * 0.5) / total_chunks) * 85)
@@ -116,19 +158,20 @@ class VectorStore:
                 )
             
             # Store chunks with embeddings
-            for i, (chunk, embedding) in enumerate(zip(batch_chunks, embeddings)):
-                chunk_record = DocumentChunk(
-                    document_id=document.id,
-                    chunk_index=batch_start + i,
-                    content=chunk["text"],
-                    embedding=embedding,
-                    start_char=chunk["start"],
-                    end_char=chunk["end"]
-                )
-                db.add(chunk_record)
+            chunk_rows = [
+                {
+                    "document_id": document.id,
+                    "chunk_index": batch_start + i,
+                    "content": chunk["text"],
+                    "embedding": embedding,
+                    "start_char": chunk["start"],
+                    "end_char": chunk["end"]
+                }
+                for i, (chunk, embedding) in enumerate(zip(batch_chunks, embeddings))
+            ]
             
             # Commit this batch
-            await db.flush()
+            await db_writer.run(lambda session: session.execute(insert(DocumentChunk), chunk_rows))
             
             # Free memory after each batch
             del chunk_texts
@@ -159,19 +202,14 @@ class VectorStore:
                     f"Batch {batch_num}/{total_batches} complete: {processed}/{total_chunks} chunks processed{eta_str}"
                 )
             
-            print(f"  ✓ Batch {batch_num}/{total_batches}: {processed}/{total_chunks} chunks (took {batch_total_time:.2f}s){eta_str}", flush=True)
+            logger.debug(f"  ✓ Batch {batch_num}/{total_batches}: {processed}/{total_chunks} chunks (took {batch_total_time:.2f}s){eta_str}")
         
         document.chunk_count = len(chunks)
-        await db.commit()
-        await db.refresh(document)
-        
-        if progress_callback:
-            await progress_callback(100, 100, "Complete!")
-        
-        print(f"✅ Added document '{filename}' with {len(chunks)} chunks")
-        print(f"{'='*60}\n", flush=True)
-        return document.id
+        await db_writer.run(lambda session: session.execute(
+            update(Document).where(Document.id == document.id).values(chunk_count=document.chunk_count)
+        ))
     
+    @traced("vector_store.search")
     async def search(
         self,
         db: AsyncSession,
@@ -195,8 +233,6 @@ class VectorStore:
         query_embedding = await embedding_provider.embed_text(query)
         
         # Build query based on what's provided
-        query_stmt = select(DocumentChunk, Document).join(Document, DocumentChunk.document_id == Document.id)
-        
         conditions = []
         if bot_id:
             conditions.append(Document.bot_id == bot_id)
@@ -205,16 +241,184 @@ class VectorStore:
         if user_id:
             conditions.append(Document.user_id == user_id)
         
+        # Read from the replica unless this scope was just written (e.g. a document just uploaded)
+        async with read_session(db, bot_id=bot_id, conversation_id=conversation_id, user_id=user_id) as reader:
+            if USE_PGVECTOR:
+                top_results = await self._search_sql(reader, query_embedding, conditions, top_k, similarity_threshold)
+            else:
+                top_results = await self._search_python(reader, query_embedding, conditions, top_k, similarity_threshold)
+            
+            if not top_results:
+                return []
+            
+            # Optionally include adjacent chunks for better context
+            if include_adjacent and top_results:
+                expanded_results = []
+                added_chunk_ids = set()
+                
+                for result in top_results:
+                    doc_id = result['document_id']
+                    chunk_idx = result['chunk_index']
+                    
+                    # Get adjacent chunks (previous and next)
+                    adjacent_query = select(DocumentChunk).where(
+                        DocumentChunk.document_id == doc_id,
+                        DocumentChunk.chunk_index.in_([chunk_idx - 1, chunk_idx, chunk_idx + 1])
+                    ).order_by(DocumentChunk.chunk_index)
+                    
+                    adjacent_result = await reader.execute(adjacent_query)
+                    adjacent_chunks = adjacent_result.scalars().all()
+                    
+                    # Add adjacent chunks with lower similarity score
+                    for adj_chunk in adjacent_chunks:
+                        if adj_chunk.id not in added_chunk_ids:
+                            # Mark adjacent chunks with adjusted similarity
+                            is_main = adj_chunk.chunk_index == chunk_idx
+                            expanded_results.append({
+                                "chunk_id": adj_chunk.id,
+                                "document_id": doc_id,
+                                "filename": result['filename'],
+                                "content": adj_chunk.content,
+                                "similarity": result['similarity'] if is_main else result['similarity'] * 0.8,
+                                "chunk_index": adj_chunk.chunk_index,
+                                "is_adjacent": not is_main
+                            })
+                            added_chunk_ids.add(adj_chunk.id)
+                
+                # Sort by document and chunk index for coherent reading
+                expanded_results.sort(key=lambda x: (x['document_id'], x['chunk_index']))
+                return expanded_results
+            
+            return top_results
+    
+    async def _search_sql(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        conditions: list,
+        top_k: int,
+        similarity_threshold: float
+    ) -> List[Dict]:
+        """Rank chunks in PostgreSQL by cosine distance (pgvector)
+        
+        The HNSW index filters after its scan, so a scoped search would lose the
+        scope's chunks that fall outside the ef_search candidates. Small scopes are
+        ranked exactly instead; larger ones use an iterative index scan (pgvector 0.8+)
+        """
+        distance = DocumentChunk.embedding.cosine_distance(query_embedding)
+        
+        exact_scope = None
+        if conditions:
+            scope_result = await db.execute(
+                select(Document.id, Document.chunk_count)
+                .where(Document.chunk_count > 0, or_(*conditions))
+            )
+            scope_docs = scope_result.all()
+            if not scope_docs:
+                return []
+            scoped_chunks = sum(chunk_count for _, chunk_count in scope_docs)
+            if scoped_chunks <= settings.pgvector_exact_scan_max_chunks or not await self._iterative_scan(db):
+                exact_scope = [doc_id for doc_id, _ in scope_docs]
+        
+        if exact_scope is not None:
+            # MATERIALIZED keeps the planner from pushing the ORDER BY into the index:
+            # every chunk in scope gets its distance, then the nearest top_k are kept
+            scoped = (
+                select(
+                    DocumentChunk.id.label("chunk_id"),
+                    DocumentChunk.content,
+                    DocumentChunk.chunk_index,
+                    DocumentChunk.document_id,
+                    distance.label("distance")
+                )
+                .where(DocumentChunk.document_id.in_(exact_scope))
+                .cte("scoped")
+                .prefix_with("MATERIALIZED")
+            )
+            query_stmt = (
+                select(
+                    scoped.c.chunk_id,
+                    scoped.c.content,
+                    scoped.c.chunk_index,
+                    Document.id,
+                    Document.filename,
+                    scoped.c.distance
+                )
+                .join(Document, scoped.c.document_id == Document.id)
+                .order_by(scoped.c.distance)
+                .limit(top_k)
+            )
+        else:
+            query_stmt = (
+                select(
+                    DocumentChunk.id,
+                    DocumentChunk.content,
+                    DocumentChunk.chunk_index,
+                    Document.id,
+                    Document.filename,
+                    distance.label("distance")
+                )
+                .join(Document, DocumentChunk.document_id == Document.id)
+                .where(Document.chunk_count > 0)
+                .order_by(distance)
+                .limit(top_k)
+            )
+            if conditions:
+                query_stmt = query_stmt.where(or_(*conditions))
+            
+            # SET doesn't take bind parameters; the value is an int from settings
+            await db.execute(text(f"SET LOCAL hnsw.ef_search = {int(settings.pgvector_ef_search)}"))
+            if await self._iterative_scan(db):
+                # Keep scanning the graph until top_k rows pass the filter
+                await db.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+        
+        result = await db.execute(query_stmt)
+        
+        # relaxed_order may return rows slightly out of order, so sort before the threshold
+        rows = sorted(result.all(), key=lambda row: row[-1])
+        return [
+            {
+                "chunk_id": chunk_id,
+                "document_id": document_id,
+                "filename": filename,
+                "content": content,
+                "similarity": 1.0 - chunk_distance,
+                "chunk_index": chunk_index
+            }
+            for chunk_id, content, chunk_index, document_id, filename, chunk_distance in rows
+            if 1.0 - chunk_distance >= similarity_threshold
+        ]
+    
+    async def _iterative_scan(self, db: AsyncSession) -> bool:
+        """Whether the installed pgvector supports hnsw.iterative_scan (0.8+)"""
+        if self._pgvector_version is None:
+            result = await db.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))
+            version = result.scalar() or "0"
+            self._pgvector_version = tuple(int(part) for part in version.split(".") if part.isdigit())
+            if self._pgvector_version < (0, 8):
+                logger.warning(f"⚠️ pgvector {version} has no iterative HNSW scan; large scoped searches will scan exactly")
+        return self._pgvector_version >= (0, 8)
+    
+    async def _search_python(
+        self,
+        db: AsyncSession,
+        query_embedding: List[float],
+        conditions: list,
+        top_k: int,
+        similarity_threshold: float
+    ) -> List[Dict]:
+        """Load candidate chunks and rank them in Python (SQLite)"""
+        query_stmt = (
+            select(DocumentChunk, Document)
+            .join(Document, DocumentChunk.document_id == Document.id)
+            .where(Document.chunk_count > 0)
+        )
         if conditions:
-            from sqlalchemy import or_
             query_stmt = query_stmt.where(or_(*conditions))
         
         result = await db.execute(query_stmt)
         chunks_with_docs = result.all()
         
-        if not chunks_with_docs:
-            return []
-        
         # Calculate similarities
         results = []
         for chunk, doc in chunks_with_docs:
@@ -232,47 +436,7 @@ class VectorStore:
         
         # Sort by similarity and return top_k
         results.sort(key=lambda x: x["similarity"], reverse=True)
-        top_results = results[:top_k]
-        
-        # Optionally include adjacent chunks for better context
-        if include_adjacent and top_results:
-            expanded_results = []
-            added_chunk_ids = set()
-            
-            for result in top_results:
-                doc_id = result['document_id']
-                chunk_idx = result['chunk_index']
-                
-                # Get adjacent chunks (previous and next)
-                adjacent_query = select(DocumentChunk).where(
-                    DocumentChunk.document_id == doc_id,
-                    DocumentChunk.chunk_index.in_([chunk_idx - 1, chunk_idx, chunk_idx + 1])
-                ).order_by(DocumentChunk.chunk_index)
-                
-                adjacent_result = await db.execute(adjacent_query)
-                adjacent_chunks = adjacent_result.scalars().all()
-                
-                # Add adjacent chunks with lower similarity score
-                for adj_chunk in adjacent_chunks:
-                    if adj_chunk.id not in added_chunk_ids:
-                        # Mark adjacent chunks with adjusted similarity
-                        is_main = adj_chunk.chunk_index == chunk_idx
-                        expanded_results.append({
-                            "chunk_id": adj_chunk.id,
-                            "document_id": doc_id,
-                            "filename": result['filename'],
-                            "content": adj_chunk.content,
-                            "similarity": result['similarity'] if is_main else result['similarity'] * 0.8,
-                            "chunk_index": adj_chunk.chunk_index,
-                            "is_adjacent": not is_main
-                        })
-                        added_chunk_ids.add(adj_chunk.id)
-            
-            # Sort by document and chunk index for coherent reading
-            expanded_results.sort(key=lambda x: (x['document_id'], x['chunk_index']))
-            return expanded_results
-        
-        return top_results
+        return results[:top_k]
     
     async def delete_document(self, db: AsyncSession, document_id: str):
         """Delete a document and all its chunks"""
@@ -284,7 +448,7 @@ class VectorStore:
         if document:
             await db.delete(document)
             await db.commit()
-            print(f"✅ Deleted document {document_id}")
+            logger.info(f"✅ Deleted document {document_id}")
     
     async def list_documents(self, db: AsyncSession, bot_id: str) -> List[Dict]:
         """List all documents for a bot"""
@@ -317,7 +481,7 @@ class VectorStore:
         
         # Estimate total chunks for progress
         estimated_chunks = text_length // (chunk_size - chunk_overlap) + 1
-        print(f"  Estimated chunks: ~{estimated_chunks}")
+        logger.debug(f"  Estimated chunks: ~{estimated_chunks}")
         
         while start < text_length:
             end = min(start + chunk_size, text_length)
@@ -343,7 +507,7 @@ class VectorStore:
                 
                 # Progress logging every 100 chunks
                 if chunk_count % 100 == 0:
-                    print(f"  Chunking progress: {chunk_count}/{estimated_chunks} chunks", flush=True)
+                    logger.debug(f"  Chunking progress: {chunk_count}/{estimated_chunks} chunks")
             
             # Move start position with overlap
             start = end - chunk_overlap if end < text_length else text_length
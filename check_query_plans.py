@@ -0,0 +1,96 @@
+"""
+Check that the hot queries use indexes
+Prints the plan of each query the chat, listing and RAG paths run most and
+exits non-zero when one of them scans a whole table. Run it against a copy of
+the production database after schema changes (python check_query_plans.py)
+"""
+import asyncio
+import sys
+from sqlalchemy import desc, or_, select, text
+from backend.database import engine, IS_POSTGRES
+from backend.models import Bot, Conversation, Message, Document, DocumentChunk
+
+SAMPLE_ID = "00000000-0000-0000-0000-000000000000"
+
+HOT_QUERIES = {
+    "chat history": select(Message)
+        .where(Message.conversation_id == SAMPLE_ID)
+        .order_by(Message.created_at),
+    "user's conversations": select(Conversation)
+        .where(Conversation.user_id == SAMPLE_ID)
+        .order_by(desc(Conversation.updated_at))
+        .limit(50),
+    "conversation listing": select(Conversation)
+        .order_by(desc(Conversation.updated_at))
+        .limit(50),
+    "RAG candidate chunks": select(DocumentChunk.id, Document.filename)
+        .join(Document, DocumentChunk.document_id == Document.id)
+        .where(Document.chunk_count > 0)
+        .where(or_(
+            Document.bot_id == SAMPLE_ID,
+            Document.conversation_id == SAMPLE_ID,
+            Document.user_id == SAMPLE_ID
+        )),
+    "adjacent chunks": select(DocumentChunk)
+        .where(DocumentChunk.document_id == SAMPLE_ID, DocumentChunk.chunk_index.in_([3, 4, 5]))
+        .order_by(DocumentChunk.chunk_index),
+    "own bots": select(Bot)
+        .where(Bot.creator_id == SAMPLE_ID, Bot.is_active == True),
+    "public bots": select(Bot)
+        .where(Bot.is_public == True, Bot.is_active == True, Bot.creator_id != SAMPLE_ID),
+}
+
+
+# SQLite has no switch to rule out scans, and once ANALYZE has run it rightly
+# scans tables this small; only larger ones count as failures there
+SMALL_TABLE_ROWS = 1000
+
+
+async def full_scans(conn, plan: list) -> list:
+    """Plan lines that read a whole table"""
+    if IS_POSTGRES:
+        return [line for line in plan if "Seq Scan" in line]
+    # SQLite: "SCAN messages" is a table scan, "SCAN x USING (COVERING) INDEX" is not
+    scans = []
+    for line in plan:
+        if line.startswith("SCAN ") and "INDEX" not in line:
+            table = line.split()[1]
+            rows = (await conn.execute(text(f"SELECT COUNT(*) FROM {table}"))).scalar()
+            if rows >= SMALL_TABLE_ROWS:
+                scans.append(line)
+    return scans
+
+
+async def explain(conn, statement) -> list:
+    sql = str(statement.compile(engine.sync_engine, compile_kwargs={"literal_binds": True}))
+    if IS_POSTGRES:
+        rows = (await conn.execute(text(f"EXPLAIN {sql}"))).all()
+        return [row[0].strip() for row in rows]
+    rows = (await conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))).all()
+    return [row[-1] for row in rows]
+
+
+async def check() -> int:
+    failures = 0
+    async with engine.connect() as conn:
+        if IS_POSTGRES:
+            # Small tables are always cheaper to scan; ask whether an index is usable at all
+            await conn.execute(text("SET enable_seqscan = off"))
+        for name, statement in HOT_QUERIES.items():
+            plan = await explain(conn, statement)
+            scans = await full_scans(conn, plan)
+            print(f"{'✗' if scans else '✓'} {name}")
+            for line in plan:
+                print(f"    {line}")
+            failures += bool(scans)
+    await engine.dispose()
+
+    if failures:
+        print(f"\n✗ {failures} hot queries scan a full table (run python -m backend.migrations upgrade?)")
+    else:
+        print("\n✓ All hot queries use indexes")
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(check()) else 0)
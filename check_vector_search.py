@@ -0,0 +1,93 @@
+"""
+Check that scoped RAG searches in PostgreSQL return what the Python ranking does
+Runs each sampled bot/conversation/user scope through both _search_sql and
+_search_python and exits non-zero when they disagree. The exact scan must match
+chunk for chunk; the iterative HNSW scan (large scopes) only has to reach
+MIN_RECALL. Run it against a copy of the production database after changing the
+pgvector settings (python check_vector_search.py)
+"""
+import asyncio
+import sys
+import numpy as np
+from sqlalchemy import func, select
+from backend.config import settings
+from backend.database import AsyncSessionLocal, engine, USE_PGVECTOR
+from backend.models import Document, DocumentChunk
+from backend.vector_store import vector_store
+
+SCOPES_PER_KIND = 10
+TOP_K = 5
+MIN_RECALL = 0.9
+
+
+async def sample_scopes(db) -> list:
+    """(column, value) pairs for the scopes with the most chunks"""
+    scopes = []
+    for column in (Document.bot_id, Document.conversation_id, Document.user_id):
+        result = await db.execute(
+            select(column)
+            .where(column.is_not(None), Document.chunk_count > 0)
+            .group_by(column)
+            .order_by(func.sum(Document.chunk_count).desc())
+            .limit(SCOPES_PER_KIND)
+        )
+        scopes += [(column, value) for value in result.scalars().all()]
+    return scopes
+
+
+async def compare(db, column, value, query_embedding, exact: bool) -> float:
+    """Share of the Python top_k the SQL search also returned"""
+    conditions = [column == value]
+    expected = await vector_store._search_python(db, query_embedding, conditions, TOP_K, -1.0)
+    actual = await vector_store._search_sql(db, query_embedding, conditions, TOP_K, -1.0)
+    await db.rollback()  # Drop the SET LOCALs before the next search
+
+    expected_ids = [row["chunk_id"] for row in expected]
+    actual_ids = [row["chunk_id"] for row in actual]
+    if exact and expected_ids != actual_ids:
+        # Chunks at the same distance may come back in either order
+        same = np.allclose([row["similarity"] for row in expected], [row["similarity"] for row in actual], atol=1e-5)
+        return 1.0 if same and len(expected_ids) == len(actual_ids) else 0.0
+    return len(set(expected_ids) & set(actual_ids)) / len(expected_ids) if expected_ids else 1.0
+
+
+async def check() -> int:
+    if not USE_PGVECTOR:
+        print("✗ DATABASE_URL is not PostgreSQL with pgvector; nothing to compare")
+        return 1
+
+    failures = 0
+    rng = np.random.default_rng(0)
+    exact_limit = settings.pgvector_exact_scan_max_chunks
+    async with AsyncSessionLocal() as db:
+        for column, value in await sample_scopes(db):
+            # One query near a chunk of the scope, one anywhere
+            chunk = (await db.execute(
+                select(DocumentChunk.embedding)
+                .join(Document, DocumentChunk.document_id == Document.id)
+                .where(column == value)
+                .limit(1)
+            )).scalar()
+            queries = [list(map(float, chunk)), rng.standard_normal(settings.embedding_dimensions).tolist()]
+
+            for query_embedding in queries:
+                settings.pgvector_exact_scan_max_chunks = 10 ** 9
+                exact_recall = await compare(db, column, value, query_embedding, exact=True)
+                settings.pgvector_exact_scan_max_chunks = 0
+                index_recall = await compare(db, column, value, query_embedding, exact=False)
+                settings.pgvector_exact_scan_max_chunks = exact_limit
+
+                failed = exact_recall < 1.0 or index_recall < MIN_RECALL
+                print(f"{'✗' if failed else '✓'} {column.key}={value}: exact {exact_recall:.0%}, index {index_recall:.0%}")
+                failures += failed
+    await engine.dispose()
+
+    if failures:
+        print(f"\n✗ {failures} scoped searches differ from the Python ranking")
+    else:
+        print("\n✓ Scoped SQL searches match the Python ranking")
+    return failures
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(check()) else 0)
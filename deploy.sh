@@ -13,7 +13,7 @@ SOURCE_DIR="$(pwd)"
 SKIP_SYSTEMD=0
 SKIP_NGINX=0
 ASSUME_YES=0
-RUN_INIT_DB=1
+RUN_MIGRATIONS=1
 RUN_CREATE_ADMIN=1
 SET_PERMISSIONS=1
 
@@ -32,7 +32,7 @@ Options:
   --skip-systemd        Only sync/build without touching systemd
   --skip-nginx          Explicitly skip Nginx configuration (default)
   --configure-nginx     Enable Nginx configuration
-  --skip-init-db        Skip running init_db.py after deploy
+  --skip-migrations     Skip applying database migrations after deploy
   --skip-create-admin   Skip running create_admin.py after deploy
   --no-permissions      Skip ownership/permission fixes
   --yes                 Assume "yes" for prompts
@@ -170,8 +170,8 @@ parse_args() {
         SKIP_NGINX=1; shift ;;
       --configure-nginx)
         SKIP_NGINX=0; shift ;;
-      --skip-init-db)
-        RUN_INIT_DB=0; shift ;;
+      --skip-migrations|--skip-init-db)
+        RUN_MIGRATIONS=0; shift ;;
       --skip-create-admin)
         RUN_CREATE_ADMIN=0; shift ;;
       --no-permissions)
@@ -244,11 +244,11 @@ bootstrap_database() {
 
   pushd "${APP_DIR}" >/dev/null
 
-  if [[ ${RUN_INIT_DB} -eq 1 ]]; then
-    log "Running init_db.py (this recreates tables)"
-    "${venv_python}" init_db.py
+  if [[ ${RUN_MIGRATIONS} -eq 1 ]]; then
+    log "Applying database migrations"
+    "${venv_python}" -m backend.migrations upgrade
   else
-    log "Skipping init_db.py (--skip-init-db)"
+    log "Skipping database migrations (--skip-migrations)"
   fi
 
   if [[ ${RUN_CREATE_ADMIN} -eq 1 ]]; then
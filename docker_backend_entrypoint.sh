@@ -5,14 +5,20 @@ set -euo pipefail
 mkdir -p /app/backend/static/uploads
 chmod 755 /app/backend/static/uploads
 
-RUN_INIT_DB=${RUN_INIT_DB:-true}
+RUN_MIGRATIONS=${RUN_MIGRATIONS:-true}
+RUN_INIT_DB=${RUN_INIT_DB:-false}
 CREATE_DEFAULT_ADMIN=${CREATE_DEFAULT_ADMIN:-true}
 
 if [[ "${RUN_INIT_DB}" == "true" ]]; then
-  echo "[bootstrap] Running init_db.py (this will recreate tables)."
+  echo "[bootstrap] Running init_db.py (this DROPS all tables and data)."
   python3 init_db.py
+fi
+
+if [[ "${RUN_MIGRATIONS}" == "true" ]]; then
+  echo "[bootstrap] Applying database migrations."
+  python3 -m backend.migrations upgrade
 else
-  echo "[bootstrap] Skipping init_db.py (RUN_INIT_DB=${RUN_INIT_DB})."
+  echo "[bootstrap] Skipping migrations (RUN_MIGRATIONS=${RUN_MIGRATIONS})."
 fi
 
 if [[ "${CREATE_DEFAULT_ADMIN}" == "true" ]]; then
@@ -11,7 +11,8 @@ const api = axios.create({
 
 // Add auth token to requests
 api.interceptors.request.use((config) => {
-  const token = localStorage.getItem('auth_token')
+  // Guests reuse the guest session token the API issued them
+  const token = localStorage.getItem('auth_token') || localStorage.getItem('guest_token')
   console.log('API Request:', config.method?.toUpperCase(), config.url)
   console.log('Auth token present:', !!token)
   if (token) {
@@ -25,10 +26,17 @@ api.interceptors.request.use((config) => {
 
 // Handle 401 errors
 api.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    const guestToken = response.headers['x-guest-token']
+    if (guestToken) {
+      localStorage.setItem('guest_token', guestToken)
+    }
+    return response
+  },
   (error) => {
     if (error.response?.status === 401) {
       localStorage.removeItem('auth_token')
+      localStorage.removeItem('guest_token')
       localStorage.removeItem('user')
       window.location.href = '/login'
     }
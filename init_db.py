@@ -1,15 +1,22 @@
-"""Initialize the database"""
+"""Initialize the database
+
+Drops every table and recreates the schema at the latest migration version.
+This deletes all data; to update an existing database run
+`python -m backend.migrations upgrade` instead.
+"""
 import asyncio
 from backend.database import engine, Base
 from backend.models import Conversation, Message, AgentExecution, User, SystemSettings
 from backend.model_permissions import ModelPermission, UserModelUsage
+from backend.migrations import migrator, migration_metadata
 
 async def init_database():
     async with engine.begin() as conn:
         # Drop all tables
         await conn.run_sync(Base.metadata.drop_all)
-        # Create all tables
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(migration_metadata.drop_all)
+    # Create all tables
+    await migrator.ensure_schema()
     print("Database initialized successfully!")
 
 if __name__ == "__main__":
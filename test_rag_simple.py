@@ -122,7 +122,7 @@ async def test_embeddings():
     
     print("\n✅ All basic RAG tests passed!")
     print("\n📝 Next steps:")
-    print("   1. Ensure database is migrated: python migrate_add_rag.py")
+    print("   1. Ensure database is migrated: python -m backend.migrations upgrade")
     print("   2. Start the API server")
     print("   3. Create a RAG-enabled bot via API")
     print("   4. Upload documents to the bot")